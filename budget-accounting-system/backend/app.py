@@ -1,14 +1,27 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory, stream_with_context
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
-from utils.auth import token_required
-from utils.db import get_connection, release_connection, execute_query, execute_update, execute_insert
+from utils.auth import token_required, admin_required, portal_required, authenticate_request, request_claims, is_portal
+from utils.db import execute_query, execute_update, execute_insert, transaction, cursor, stream_query
+from utils.streaming import requested_stream_format, stream_rows
+from utils.ledger_snapshots import trial_balance_query, rebuild_snapshots
+from utils.document_lines import insert_lines
+from utils.rule_index import assign_analytical_accounts
+from utils.phonepe_client import get_phonepe_client, GatewayError, GatewayUnavailable
+from utils.payments import apply_payment, request_idempotency_key, InvoiceNotFound
+from utils.reconciler import get_reconciler, start_reconciler, record_status, stored_status
+from utils.reconciler import payment_events, publish_outcome, transaction_state
+from utils.event_hub import StreamSlots, sse_stream
+from utils.phonepe_callbacks import verify_callback, enqueue_callback, get_callback_worker, start_callback_worker, CallbackError
+from utils.qr_codes import QRRenderer, FORMATS as QR_FORMATS
+from utils.pagination import ListSpec, PaginationError, fetch_page, page_headers
+from utils.health import get_health_monitor, start_health_monitor
+from utils.profiler import RequestProfiler
+from utils.metrics import RequestTimer, register_collector, family, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 import logging
+import os
 import time
-import hashlib
-import base64
-import json
-import requests
 import uuid
 
 # ===== SETUP LOGGING =====
@@ -23,19 +36,57 @@ app = Flask(__name__)
 app.config.from_object(Config)
 logger.info("🚀 Flask app initialized")
 
+# ===== REVERSE PROXY =====
+# Behind nginx/a load balancer request.remote_addr is the proxy, so every
+# client would share one login throttle key. Trust exactly TRUSTED_PROXY_COUNT
+# X-Forwarded-For hops (set by our proxies); more would let clients spoof it.
+if Config.TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.TRUSTED_PROXY_COUNT)
+    logger.info(f"✅ Client IP taken from X-Forwarded-For ({Config.TRUSTED_PROXY_COUNT} trusted proxies)")
+
+# ===== BACKGROUND WORKERS =====
+# Workers (reconciler, callback queue, health monitor) start at import, so
+# they run under gunicorn and any other WSGI server. The only process that
+# skips them is the watcher of `python app.py` (debug reloader), which never
+# serves requests; the reloaded child has WERKZEUG_RUN_MAIN set.
+RELOADER_WATCHER = __name__ == '__main__' and app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
 # ===== CORS CONFIGURATION =====
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+CORS(app, resources={r"/api/*": {"origins": "*", "expose_headers": ["X-Next-Cursor", "X-Profile-Id"]}})
 logger.info("✅ CORS enabled")
 
+# ===== REQUEST METRICS =====
+# Registered before the other hooks so their time is included (see /metrics)
+if Config.METRICS_ENABLED:
+    RequestTimer().init_app(app)
+
+# ===== REQUEST PROFILER (OPT-IN) =====
+# Per-request stack samples and db/json/python breakdown, see utils/profiler.py
+if Config.PROFILER_ENABLED:
+    RequestProfiler(
+        Config.PROFILER_OUTPUT_DIR,
+        sample_rate=Config.PROFILER_SAMPLE_RATE,
+        interval_ms=Config.PROFILER_INTERVAL_MS,
+        authorize=lambda: (request_claims() or {}).get('role') == 'admin',
+        secret=Config.PROFILER_SECRET,
+        max_per_minute=Config.PROFILER_MAX_PER_MINUTE,
+        max_files=Config.PROFILER_MAX_FILES
+    ).init_app(app)
+    logger.info(f"🔬 Request profiler enabled (sample rate {Config.PROFILER_SAMPLE_RATE})")
+
+# ===== AUTHENTICATION MIDDLEWARE =====
+# Decodes the bearer token once per request and keeps the claims on flask.g
+# (see utils/auth.py); token_required / portal_required only read them
+app.before_request(authenticate_request)
+
 # ============================================
 # PHONEPE CONFIGURATION (UAT - DEFAULT TEST CREDENTIALS)
 # ============================================
 # Using default PhonePe test credentials (guaranteed to work)
 # Your credentials (M236CBTE7WCEB_2601311616) are not configured in UAT
-PHONEPE_MERCHANT_ID = "PGTESTPAYUAT86"
-PHONEPE_SALT_KEY = "96434309-7796-489d-8924-ab56988a6076"
-PHONEPE_SALT_INDEX = 1
-PHONEPE_PAY_URL = "https://api-preprod.phonepe.com/apis/pg-sandbox/pg/v1/pay"
+# Credentials, timeouts and retry policy live in Config (PHONEPE_*);
+# all gateway calls go through utils/phonepe_client.py
+PHONEPE_MERCHANT_ID = Config.PHONEPE_MERCHANT_ID
 
 # ===== REGISTER BLUEPRINTS =====
 from routes.auth import auth_bp
@@ -87,7 +138,7 @@ logger.info("✅ Frontend serving routes registered")
 @app.route('/api/reports/general-ledger', methods=['POST'])
 @token_required
 def general_ledger_report(current_user):
-    """Generate General Ledger Report"""
+    """Generate General Ledger Report (?stream=ndjson|json for large periods)"""
     try:
         user_id = current_user['id']
         data = request.get_json()
@@ -130,11 +181,19 @@ def general_ledger_report(current_user):
         
         query += " ORDER BY ca.code, je.date, je.id"
         
+        # Large reports: stream rows from a server-side cursor instead
+        stream_format = requested_stream_format(request, data)
+        if stream_format:
+            logger.info(f'🌊 Streaming General Ledger as {stream_format}')
+            return stream_rows(stream_query(query, tuple(params)), stream_format)
+        
         results = execute_query(query, tuple(params))
         
         logger.info(f'✅ General Ledger generated: {len(results)} rows')
         return jsonify(results), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'❌ Error generating general ledger: {str(e)}')
         import traceback
@@ -144,52 +203,56 @@ def general_ledger_report(current_user):
 @app.route('/api/reports/trial-balance', methods=['POST'])
 @token_required
 def trial_balance_report(current_user):
-    """Generate Trial Balance Report"""
+    """Generate Trial Balance Report (?stream=ndjson|json to stream rows)"""
     try:
         user_id = current_user['id']
         data = request.get_json()
         
-        as_of_date = data.get('as_of_date')
-        
-        query = """
-        SELECT 
-            ca.id,
-            ca.code,
-            ca.name,
-            ca.type,
-            COALESCE(SUM(ji.debit), 0) as total_debit,
-            COALESCE(SUM(ji.credit), 0) as total_credit
-        FROM chart_of_accounts ca
-        LEFT JOIN journal_items ji ON ca.id = ji.account_id
-        LEFT JOIN journal_entries je ON ji.entry_id = je.id
-        WHERE ca.user_id = %s
-        """
-        
-        params = [user_id]
+        as_of_date = data.get('as_of_date') or None
         
-        if as_of_date:
-            query += " AND (je.date <= %s OR je.date IS NULL)"
-            params.append(as_of_date)
+        # Monthly snapshots before the as-of month + posted items since
+        query, params = trial_balance_query(user_id, as_of_date)
         
-        query += " AND (je.state = 'posted' OR je.state IS NULL)"
-        query += " GROUP BY ca.id, ca.code, ca.name, ca.type"
-        query += " ORDER BY ca.code"
+        # Large reports: stream rows from a server-side cursor instead
+        stream_format = requested_stream_format(request, data)
+        if stream_format:
+            logger.info(f'🌊 Streaming Trial Balance as {stream_format}')
+            return stream_rows(stream_query(query, params), stream_format)
         
-        results = execute_query(query, tuple(params))
+        results = execute_query(query, params)
         
         logger.info(f'✅ Trial Balance generated: {len(results)} accounts')
         return jsonify(results), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'❌ Error generating trial balance: {str(e)}')
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/reports/balance-snapshots/rebuild', methods=['POST'])
+@token_required
+def rebuild_balance_snapshots(current_user):
+    """Recompute the trial balance snapshots of the current user from the journal"""
+    try:
+        user_id = current_user['id']
+        
+        with transaction() as cur:
+            written = rebuild_snapshots(cur, user_id)
+        
+        logger.info(f'✅ Balance snapshots rebuilt: {written}')
+        return jsonify({'message': 'Balance snapshots rebuilt', 'snapshots': written}), 200
+        
+    except Exception as e:
+        logger.error(f'❌ Error rebuilding balance snapshots: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/reports/analytical', methods=['POST'])
 @token_required
 def analytical_report(current_user):
-    """Generate Analytical Account Report"""
+    """Generate Analytical Account Report (?stream=ndjson|json for large periods)"""
     try:
         user_id = current_user['id']
         data = request.get_json()
@@ -230,11 +293,19 @@ def analytical_report(current_user):
         query += " AND (je.state = 'posted' OR je.state IS NULL)"
         query += " ORDER BY aa.name, je.date"
         
+        # Large reports: stream rows from a server-side cursor instead
+        stream_format = requested_stream_format(request, data)
+        if stream_format:
+            logger.info(f'🌊 Streaming Analytical Report as {stream_format}')
+            return stream_rows(stream_query(query, tuple(params)), stream_format)
+        
         results = execute_query(query, tuple(params))
         
         logger.info(f'✅ Analytical Report generated: {len(results)} rows')
         return jsonify(results), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'❌ Error generating analytical report: {str(e)}')
         import traceback
@@ -247,28 +318,41 @@ logger.info("✅ Reports API routes registered")
 # PURCHASE ORDERS API
 # ============================================
 
+PURCHASE_ORDERS_LIST = ListSpec(
+    fields={
+        'id': 'po.id',
+        'reference': 'po.reference',
+        'date': 'po.date',
+        'vendor_id': 'po.vendor_id',
+        'state': 'po.state',
+        'total': 'po.total',
+        'vendor_name': 'c.name'
+    },
+    from_sql="FROM purchase_orders po LEFT JOIN contacts c ON po.vendor_id = c.id",
+    tenant_column='po.user_id',
+    sort=('po.date', 'date'),
+    id_column='po.id',
+    filters={'state': 'po.state', 'partner_id': 'po.vendor_id'},
+    date_column='po.date'
+)
+
 @app.route('/api/purchase-orders', methods=['GET'])
 @token_required
 def get_purchase_orders(current_user):
-    """Get all purchase orders for current user"""
+    """
+    Get purchase orders for current user (newest first)
+    Query: limit, cursor, fields, state, partner_id, date_from, date_to
+    """
     try:
         user_id = current_user['id']
         
-        query = """
-        SELECT 
-            po.id, po.reference, po.date, po.vendor_id, po.state, po.total,
-            c.name as vendor_name
-        FROM purchase_orders po
-        LEFT JOIN contacts c ON po.vendor_id = c.id
-        WHERE po.user_id = %s
-        ORDER BY po.date DESC, po.id DESC
-        """
-        
-        results = execute_query(query, (user_id,))
+        results, next_cursor = fetch_page(PURCHASE_ORDERS_LIST, user_id, request.args)
         
         logger.info(f'✅ Retrieved {len(results)} purchase orders')
-        return jsonify(results), 200
+        return jsonify(results), 200, page_headers(next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'❌ Error fetching purchase orders: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -277,15 +361,10 @@ def get_purchase_orders(current_user):
 @token_required
 def create_purchase_order(current_user):
     """Create new purchase order"""
-    connection = None
-    cursor = None
     try:
         user_id = current_user['id']
         data = request.get_json()
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        
         # Insert purchase order
         query = """
         INSERT INTO purchase_orders (user_id, reference, date, vendor_id, state, total)
@@ -293,52 +372,35 @@ def create_purchase_order(current_user):
         RETURNING id
         """
         
-        cursor.execute(query, (
-            user_id,
-            data['reference'],
-            data['date'],
-            data['vendor_id'],
-            data.get('state', 'draft'),
-            data.get('total', 0)
-        ))
-        
-        po_id = cursor.fetchone()[0]
-        
-        # Insert purchase order lines
-        if 'lines' in data:
-            for line in data['lines']:
-                line_query = """
-                INSERT INTO purchase_order_lines 
-                (purchase_order_id, product_id, description, quantity, price, subtotal, analytical_account_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                cursor.execute(line_query, (
-                    po_id,
-                    line.get('product_id'),
-                    line.get('description'),
-                    line.get('quantity', 1),
-                    line.get('price', 0),
-                    line.get('subtotal', 0),
-                    line.get('analytical_account_id')
-                ))
-        
-        connection.commit()
+        # Header and lines are committed together
+        with transaction() as cur:
+            cur.execute(query, (
+                user_id,
+                data['reference'],
+                data['date'],
+                data['vendor_id'],
+                data.get('state', 'draft'),
+                data.get('total', 0)
+            ))
+            
+            po_id = cur.fetchone()[0]
+            
+            lines = data.get('lines') or []
+            
+            # Lines without an analytical account get one from the auto analytical rules
+            auto_assigned = assign_analytical_accounts(cur, user_id, data['vendor_id'], lines)
+            
+            # Insert purchase order lines (multi-row INSERT)
+            insert_lines(cur, 'purchase_order', po_id, lines)
         
         logger.info(f'✅ Purchase order created: {po_id}')
-        return jsonify({'id': po_id, 'message': 'Purchase order created'}), 201
+        return jsonify({'id': po_id, 'message': 'Purchase order created', 'auto_assigned_lines': auto_assigned}), 201
         
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f'❌ Error creating purchase order: {str(e)}')
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            release_connection(connection)
 
 @app.route('/api/purchase-orders/<int:po_id>', methods=['GET'])
 @token_required
@@ -355,13 +417,6 @@ def get_purchase_order(current_user, po_id):
         WHERE po.id = %s AND po.user_id = %s
         """
         
-        results = execute_query(query, (po_id, user_id))
-        
-        if not results:
-            return jsonify({'error': 'Purchase order not found'}), 404
-            
-        po = results[0]
-        
         # Get PO lines
         lines_query = """
         SELECT pol.*, p.name as product_name, aa.name as analytical_name
@@ -371,7 +426,15 @@ def get_purchase_order(current_user, po_id):
         WHERE pol.purchase_order_id = %s
         """
         
-        po['lines'] = execute_query(lines_query, (po_id,))
+        with cursor() as cur:
+            results = execute_query(query, (po_id, user_id), cur=cur)
+        
+            if not results:
+                return jsonify({'error': 'Purchase order not found'}), 404
+            
+            po = results[0]
+        
+            po['lines'] = execute_query(lines_query, (po_id,), cur=cur)
         
         return jsonify(po), 200
         
@@ -389,28 +452,41 @@ logger.info("✅ Purchase Orders API routes registered")
 # SALES ORDERS API
 # ============================================
 
+SALES_ORDERS_LIST = ListSpec(
+    fields={
+        'id': 'so.id',
+        'reference': 'so.reference',
+        'date': 'so.date',
+        'customer_id': 'so.customer_id',
+        'state': 'so.state',
+        'total': 'so.total',
+        'customer_name': 'c.name'
+    },
+    from_sql="FROM sales_orders so LEFT JOIN contacts c ON so.customer_id = c.id",
+    tenant_column='so.user_id',
+    sort=('so.date', 'date'),
+    id_column='so.id',
+    filters={'state': 'so.state', 'partner_id': 'so.customer_id'},
+    date_column='so.date'
+)
+
 @app.route('/api/sales-orders', methods=['GET'])
 @token_required
 def get_sales_orders(current_user):
-    """Get all sales orders for current user"""
+    """
+    Get sales orders for current user (newest first)
+    Query: limit, cursor, fields, state, partner_id, date_from, date_to
+    """
     try:
         user_id = current_user['id']
         
-        query = """
-        SELECT 
-            so.id, so.reference, so.date, so.customer_id, so.state, so.total,
-            c.name as customer_name
-        FROM sales_orders so
-        LEFT JOIN contacts c ON so.customer_id = c.id
-        WHERE so.user_id = %s
-        ORDER BY so.date DESC, so.id DESC
-        """
-        
-        results = execute_query(query, (user_id,))
+        results, next_cursor = fetch_page(SALES_ORDERS_LIST, user_id, request.args)
         
         logger.info(f'✅ Retrieved {len(results)} sales orders')
-        return jsonify(results), 200
+        return jsonify(results), 200, page_headers(next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'❌ Error fetching sales orders: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -419,15 +495,10 @@ def get_sales_orders(current_user):
 @token_required
 def create_sales_order(current_user):
     """Create new sales order"""
-    connection = None
-    cursor = None
     try:
         user_id = current_user['id']
         data = request.get_json()
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        
         # Insert sales order
         query = """
         INSERT INTO sales_orders (user_id, reference, date, customer_id, state, total)
@@ -435,52 +506,35 @@ def create_sales_order(current_user):
         RETURNING id
         """
         
-        cursor.execute(query, (
-            user_id,
-            data['reference'],
-            data['date'],
-            data['customer_id'],
-            data.get('state', 'draft'),
-            data.get('total', 0)
-        ))
-        
-        so_id = cursor.fetchone()[0]
-        
-        # Insert sales order lines
-        if 'lines' in data:
-            for line in data['lines']:
-                line_query = """
-                INSERT INTO sales_order_lines 
-                (sales_order_id, product_id, description, quantity, price, subtotal, analytical_account_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                cursor.execute(line_query, (
-                    so_id,
-                    line.get('product_id'),
-                    line.get('description'),
-                    line.get('quantity', 1),
-                    line.get('price', 0),
-                    line.get('subtotal', 0),
-                    line.get('analytical_account_id')
-                ))
-        
-        connection.commit()
+        # Header and lines are committed together
+        with transaction() as cur:
+            cur.execute(query, (
+                user_id,
+                data['reference'],
+                data['date'],
+                data['customer_id'],
+                data.get('state', 'draft'),
+                data.get('total', 0)
+            ))
+            
+            so_id = cur.fetchone()[0]
+            
+            lines = data.get('lines') or []
+            
+            # Lines without an analytical account get one from the auto analytical rules
+            auto_assigned = assign_analytical_accounts(cur, user_id, data['customer_id'], lines)
+            
+            # Insert sales order lines (multi-row INSERT)
+            insert_lines(cur, 'sales_order', so_id, lines)
         
         logger.info(f'✅ Sales order created: {so_id}')
-        return jsonify({'id': so_id, 'message': 'Sales order created'}), 201
+        return jsonify({'id': so_id, 'message': 'Sales order created', 'auto_assigned_lines': auto_assigned}), 201
         
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f'❌ Error creating sales order: {str(e)}')
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            release_connection(connection)
 
 @app.route('/api/sales-orders/<int:so_id>', methods=['GET'])
 @token_required
@@ -497,13 +551,6 @@ def get_sales_order(current_user, so_id):
         WHERE so.id = %s AND so.user_id = %s
         """
         
-        results = execute_query(query, (so_id, user_id))
-        
-        if not results:
-            return jsonify({'error': 'Sales order not found'}), 404
-            
-        so = results[0]
-        
         # Get SO lines
         lines_query = """
         SELECT sol.*, p.name as product_name, aa.name as analytical_name
@@ -513,7 +560,15 @@ def get_sales_order(current_user, so_id):
         WHERE sol.sales_order_id = %s
         """
         
-        so['lines'] = execute_query(lines_query, (so_id,))
+        with cursor() as cur:
+            results = execute_query(query, (so_id, user_id), cur=cur)
+        
+            if not results:
+                return jsonify({'error': 'Sales order not found'}), 404
+            
+            so = results[0]
+        
+            so['lines'] = execute_query(lines_query, (so_id,), cur=cur)
         
         return jsonify(so), 200
         
@@ -527,29 +582,46 @@ logger.info("✅ Sales Orders API routes registered")
 # CUSTOMER INVOICES API
 # ============================================
 
+CUSTOMER_INVOICES_LIST = ListSpec(
+    fields={
+        'id': 'ci.id',
+        'reference': 'ci.reference',
+        'date': 'ci.date',
+        'customer_id': 'ci.customer_id',
+        'state': 'ci.state',
+        'total': 'ci.total',
+        'payment_status': 'ci.payment_status',
+        'paid_via_cash': 'ci.paid_via_cash',
+        'paid_via_bank': 'ci.paid_via_bank',
+        'paid_via_online': 'ci.paid_via_online',
+        'amount_due': 'ci.amount_due',
+        'customer_name': 'c.name'
+    },
+    from_sql="FROM customer_invoices ci LEFT JOIN contacts c ON ci.customer_id = c.id",
+    tenant_column='ci.user_id',
+    sort=('ci.date', 'date'),
+    id_column='ci.id',
+    filters={'state': 'ci.state', 'payment_status': 'ci.payment_status', 'partner_id': 'ci.customer_id'},
+    date_column='ci.date'
+)
+
 @app.route('/api/customer-invoices', methods=['GET'])
 @token_required
 def get_customer_invoices(current_user):
-    """Get all customer invoices for current user"""
+    """
+    Get customer invoices for current user (newest first)
+    Query: limit, cursor, fields, state, payment_status, partner_id, date_from, date_to
+    """
     try:
         user_id = current_user['id']
         
-        query = """
-        SELECT 
-            ci.id, ci.reference, ci.date, ci.customer_id, ci.state, ci.total, ci.payment_status,
-            ci.paid_via_cash, ci.paid_via_bank, ci.paid_via_online, ci.amount_due,
-            c.name as customer_name
-        FROM customer_invoices ci
-        LEFT JOIN contacts c ON ci.customer_id = c.id
-        WHERE ci.user_id = %s
-        ORDER BY ci.date DESC, ci.id DESC
-        """
-        
-        results = execute_query(query, (user_id,))
+        results, next_cursor = fetch_page(CUSTOMER_INVOICES_LIST, user_id, request.args)
         
         logger.info(f'✅ Retrieved {len(results)} customer invoices')
-        return jsonify(results), 200
+        return jsonify(results), 200, page_headers(next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'❌ Error fetching customer invoices: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -558,15 +630,10 @@ def get_customer_invoices(current_user):
 @token_required
 def create_customer_invoice(current_user):
     """Create new customer invoice with payment tracking"""
-    connection = None
-    cursor = None
     try:
         user_id = current_user['id']
         data = request.get_json()
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        
         # Calculate totals
         total = float(data.get('total', 0))
         paid_cash = float(data.get('paid_via_cash', 0))
@@ -591,57 +658,40 @@ def create_customer_invoice(current_user):
         RETURNING id
         """
         
-        cursor.execute(query, (
-            user_id,
-            data['reference'],
-            data['date'],
-            data['customer_id'],
-            data.get('state', 'draft'),
-            total,
-            paid_cash,
-            paid_bank,
-            paid_online,
-            amount_due,
-            payment_status
-        ))
-        
-        invoice_id = cursor.fetchone()[0]
-        
-        # Insert invoice lines
-        if 'lines' in data:
-            for line in data['lines']:
-                line_query = """
-                INSERT INTO customer_invoice_lines 
-                (customer_invoice_id, product_id, description, quantity, price, subtotal, analytical_account_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                cursor.execute(line_query, (
-                    invoice_id,
-                    line.get('product_id'),
-                    line.get('description'),
-                    line.get('quantity', 1),
-                    line.get('price', 0),
-                    line.get('subtotal', 0),
-                    line.get('analytical_account_id')
-                ))
-        
-        connection.commit()
+        # Header and lines are committed together
+        with transaction() as cur:
+            cur.execute(query, (
+                user_id,
+                data['reference'],
+                data['date'],
+                data['customer_id'],
+                data.get('state', 'draft'),
+                total,
+                paid_cash,
+                paid_bank,
+                paid_online,
+                amount_due,
+                payment_status
+            ))
+            
+            invoice_id = cur.fetchone()[0]
+            
+            lines = data.get('lines') or []
+            
+            # Lines without an analytical account get one from the auto analytical rules
+            auto_assigned = assign_analytical_accounts(cur, user_id, data['customer_id'], lines)
+            
+            # Insert invoice lines (multi-row INSERT)
+            insert_lines(cur, 'customer_invoice', invoice_id, lines)
         
         logger.info(f'✅ Customer invoice created: {invoice_id}')
-        return jsonify({'id': invoice_id, 'message': 'Invoice created'}), 201
+        return jsonify({'id': invoice_id, 'message': 'Invoice created', 'auto_assigned_lines': auto_assigned}), 201
         
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f'❌ Error creating customer invoice: {str(e)}')
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            release_connection(connection)
 
 @app.route('/api/customer-invoices/<int:invoice_id>', methods=['GET'])
 @token_required
@@ -658,13 +708,6 @@ def get_customer_invoice(current_user, invoice_id):
         WHERE ci.id = %s AND ci.user_id = %s
         """
         
-        results = execute_query(query, (invoice_id, user_id))
-        
-        if not results:
-            return jsonify({'error': 'Invoice not found'}), 404
-            
-        invoice = results[0]
-        
         # Get invoice lines
         lines_query = """
         SELECT cil.*, p.name as product_name, aa.name as analytical_name
@@ -674,7 +717,15 @@ def get_customer_invoice(current_user, invoice_id):
         WHERE cil.customer_invoice_id = %s
         """
         
-        invoice['lines'] = execute_query(lines_query, (invoice_id,))
+        with cursor() as cur:
+            results = execute_query(query, (invoice_id, user_id), cur=cur)
+        
+            if not results:
+                return jsonify({'error': 'Invoice not found'}), 404
+            
+            invoice = results[0]
+        
+            invoice['lines'] = execute_query(lines_query, (invoice_id,), cur=cur)
         
         return jsonify(invoice), 200
         
@@ -686,84 +737,43 @@ def get_customer_invoice(current_user, invoice_id):
 @token_required
 def record_invoice_payment(current_user, invoice_id):
     """Record payment for invoice"""
-    connection = None
-    cursor = None
     try:
         user_id = current_user['id']
         data = request.get_json()
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        # Get current invoice
-        cursor.execute("""
-            SELECT total, paid_via_cash, paid_via_bank, paid_via_online, customer_id, reference
-            FROM customer_invoices 
-            WHERE id = %s AND user_id = %s
-        """, (invoice_id, user_id))
-        
-        invoice = cursor.fetchone()
-        if not invoice:
-            return jsonify({'error': 'Invoice not found'}), 404
-        
-        total, paid_cash, paid_bank, paid_online, customer_id, inv_reference = invoice
-        
         # Add new payment
         payment_type = data.get('payment_type', 'online')
         amount = float(data.get('amount', 0))
         
-        if payment_type == 'cash':
-            paid_cash += amount
-        elif payment_type == 'bank':
-            paid_bank += amount
-        else:
-            paid_online += amount
-        
-        # Update invoice (trigger will handle payment status)
-        update_query = """
-        UPDATE customer_invoices 
-        SET paid_via_cash = %s, paid_via_bank = %s, paid_via_online = %s
-        WHERE id = %s AND user_id = %s
-        """
-        
-        cursor.execute(update_query, (paid_cash, paid_bank, paid_online, invoice_id, user_id))
-        
-        # Create payment record
-        payment_ref = 'PAY-' + str(int(time.time()))[-8:]
-        
-        payment_query = """
-        INSERT INTO payments 
-        (user_id, reference, date, payment_type, payment_method, amount, invoice_id, customer_id, notes)
-        VALUES (%s, %s, CURRENT_DATE, 'customer', %s, %s, %s, %s, %s)
-        """
-        
-        cursor.execute(payment_query, (
-            user_id,
-            payment_ref,
-            payment_type,
-            amount,
-            invoice_id,
-            customer_id,
-            'Payment via portal'
-        ))
-        
-        connection.commit()
+        # Retries carrying the same Idempotency-Key are recorded once
+        idempotency_key = request_idempotency_key(request, data)
+        
+        # Invoice row is locked and incremented in place (trigger will handle payment status)
+        with transaction() as cur:
+            result = apply_payment(
+                cur, amount,
+                user_id=user_id,
+                invoice_id=invoice_id,
+                idempotency_key=idempotency_key,
+                payment_method=payment_type,
+                reference='PAY-' + str(int(time.time()))[-8:],
+                notes='Payment via portal'
+            )
         
         logger.info(f'✅ Payment recorded for invoice: {invoice_id}')
-        return jsonify({'message': 'Payment recorded successfully'}), 200
+        return jsonify({
+            'message': 'Payment recorded successfully' if result['applied'] else 'Payment already recorded',
+            'payment_id': result['payment_id'],
+            'duplicate': not result['applied']
+        }), 200
         
+    except InvoiceNotFound:
+        return jsonify({'error': 'Invoice not found'}), 404
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f'❌ Error recording payment: {str(e)}')
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            release_connection(connection)
 
 logger.info("✅ Customer Invoices API routes registered")
 
@@ -781,9 +791,6 @@ def portal_login():
         if not email:
             return jsonify({'error': 'Email is required'}), 400
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        
         # Find contact by email
         query = """
         SELECT id, user_id, name, email, contact_type
@@ -791,19 +798,15 @@ def portal_login():
         WHERE email = %s
         """
         
-        cursor.execute(query, (email,))
-        result = cursor.fetchone()
+        with cursor() as cur:
+            cur.execute(query, (email,))
+            result = cur.fetchone()
         
         if not result:
-            cursor.close()
-            release_connection(connection)
             return jsonify({'error': 'Contact not found'}), 404
         
         contact_id, user_id, name, email, contact_type = result
         
-        cursor.close()
-        release_connection(connection)
-        
         # Create portal token (different from admin token)
         from routes.auth import generate_token
         portal_token = generate_token({
@@ -829,29 +832,13 @@ def portal_login():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/portal/invoices', methods=['GET'])
-def get_portal_invoices():
+@portal_required
+def get_portal_invoices(contact):
     """Get invoices for logged-in customer"""
     try:
-        # Get token from Authorization header
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Authorization token required'}), 401
-        
-        token = auth_header.split(' ')[1]
-        
-        # Verify token
-        from routes.auth import verify_token
-        payload = verify_token(token)
-        if not payload:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-        
-        contact_id = payload.get('user_id')  # This is actually contact_id for portal users
-        contact_role = payload.get('role', '')
+        contact_id = contact['id']
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        if 'customer' in contact_role:
+        if contact['type'] == 'customer':
             # Get customer invoices (both draft and posted)
             query = """
             SELECT 
@@ -863,16 +850,9 @@ def get_portal_invoices():
             """
         else:
             # For vendors, we don't have vendor bills yet, return empty
-            cursor.close()
-            release_connection(connection)
             return jsonify([]), 200
         
-        cursor.execute(query, (contact_id,))
-        columns = [desc[0] for desc in cursor.description]
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        
-        cursor.close()
-        release_connection(connection)
+        results = execute_query(query, (contact_id,))
         
         logger.info(f'✅ Portal invoices retrieved: {len(results)}')
         return jsonify(results), 200
@@ -881,65 +861,97 @@ def get_portal_invoices():
         logger.error(f'❌ Portal invoices error: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+# Rendered QR images are cached by (payload, format, size); see utils/qr_codes.py
+qr_renderer = QRRenderer(maxsize=Config.QR_CACHE_SIZE, ttl=Config.QR_CACHE_TTL, workers=Config.QR_RENDER_WORKERS)
+
+def _portal_invoice_upi(contact_id, invoice_id):
+    """
+    UPI payment details of a portal contact's invoice
+    Returns: (details dict, None) or (None, error response)
+    """
+    # Get invoice details
+    query = """
+    SELECT ci.reference, ci.amount_due, u.email as business_email
+    FROM customer_invoices ci
+    JOIN users u ON ci.user_id = u.id
+    WHERE ci.id = %s AND ci.customer_id = %s
+    """
+    
+    with cursor() as cur:
+        cur.execute(query, (invoice_id, contact_id))
+        result = cur.fetchone()
+    
+    if not result:
+        return None, (jsonify({'error': 'Invoice not found'}), 404)
+    
+    reference, amount_due, business_email = result
+    
+    # Generate UPI payment string for PhonePe
+    # Format: upi://pay?pa=UPI_ID&pn=NAME&am=AMOUNT&tn=NOTE
+    upi_id = "shivfurniture@paytm"  # Replace with actual UPI ID
+    business_name = "Shiv Furniture"
+    
+    upi_string = f"upi://pay?pa={upi_id}&pn={business_name}&am={amount_due}&tn=Invoice {reference}&cu=INR"
+    
+    return {
+        'qr_data': upi_string,
+        'amount': float(amount_due),
+        'reference': reference,
+        'upi_id': upi_id
+    }, None
+
 @app.route('/api/portal/invoices/<int:invoice_id>/qr', methods=['GET'])
-def generate_payment_qr(invoice_id):
+@portal_required
+def generate_payment_qr(contact, invoice_id):
     """Generate UPI QR code for invoice payment"""
     try:
-        # Get token from Authorization header
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Authorization token required'}), 401
+        details, error = _portal_invoice_upi(contact['id'], invoice_id)
+        if error:
+            return error
         
-        token = auth_header.split(' ')[1]
+        # Inline SVG data URI: usable as <img src> directly (the qr.<fmt> route
+        # needs the Authorization header, which an <img> tag cannot send)
+        details['qr_image'] = qr_renderer.render_data_uri(details['qr_data'], 'svg', Config.QR_BOX_SIZE)
+        return jsonify(details), 200
         
-        # Verify token
-        from routes.auth import verify_token
-        payload = verify_token(token)
-        if not payload:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-        
-        contact_id = payload.get('user_id')  # This is actually contact_id for portal users
-        
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        # Get invoice details
-        query = """
-        SELECT ci.reference, ci.amount_due, u.email as business_email
-        FROM customer_invoices ci
-        JOIN users u ON ci.user_id = u.id
-        WHERE ci.id = %s AND ci.customer_id = %s
-        """
-        
-        cursor.execute(query, (invoice_id, contact_id))
-        result = cursor.fetchone()
-        
-        if not result:
-            cursor.close()
-            release_connection(connection)
-            return jsonify({'error': 'Invoice not found'}), 404
-        
-        reference, amount_due, business_email = result
+    except Exception as e:
+        logger.error(f'❌ QR generation error: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/portal/invoices/<int:invoice_id>/qr.<fmt>', methods=['GET'])
+@portal_required
+def payment_qr_image(contact, invoice_id, fmt):
+    """
+    Server-rendered UPI QR image (png or svg)
+    Query: size (box size in pixels per module, 2-20)
+    Supports If-None-Match: an unchanged QR costs a 304 and no rendering
+    """
+    try:
+        if fmt not in QR_FORMATS:
+            return jsonify({'error': f"Unsupported format '{fmt}'"}), 400
         
-        # Generate UPI payment string for PhonePe
-        # Format: upi://pay?pa=UPI_ID&pn=NAME&am=AMOUNT&tn=NOTE
-        upi_id = "shivfurniture@paytm"  # Replace with actual UPI ID
-        business_name = "Shiv Furniture"
+        box_size = request.args.get('size', Config.QR_BOX_SIZE, type=int)
+        if not 2 <= box_size <= 20:
+            return jsonify({'error': 'size must be between 2 and 20'}), 400
         
-        upi_string = f"upi://pay?pa={upi_id}&pn={business_name}&am={amount_due}&tn=Invoice {reference}&cu=INR"
+        details, error = _portal_invoice_upi(contact['id'], invoice_id)
+        if error:
+            return error
         
-        cursor.close()
-        release_connection(connection)
+        # The ETag changes with the payload, i.e. when amount_due changes
+        etag = qr_renderer.etag(details['qr_data'], fmt, box_size)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(qr_renderer.render(details['qr_data'], fmt, box_size), mimetype=QR_FORMATS[fmt])
         
-        return jsonify({
-            'qr_data': upi_string,
-            'amount': float(amount_due),
-            'reference': reference,
-            'upi_id': upi_id
-        }), 200
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = Config.QR_HTTP_MAX_AGE
+        return response
         
     except Exception as e:
-        logger.error(f'❌ QR generation error: {str(e)}')
+        logger.error(f'❌ QR image error: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
 logger.info("✅ Portal Authentication API routes registered")
@@ -949,64 +961,52 @@ logger.info("✅ Portal Authentication API routes registered")
 # ============================================
 
 @app.route('/api/phonepe/initiate', methods=['POST'])
-@token_required
-def phonepe_initiate_payment(current_user):
-    """Initiate PhonePe payment"""
+def phonepe_initiate_payment():
+    """Initiate PhonePe payment (portal contact or business user token)"""
     try:
-        # Handle portal authentication differently
-        auth_header = request.headers.get('Authorization')
-        token = auth_header.split(' ')[1] if auth_header else None
-        
-        from routes.auth import verify_token
-        payload = verify_token(token)
+        claims = request_claims()
+        if not claims:
+            return jsonify({'error': 'Authorization token required'}), 401
         
         # Handle both portal and admin users
-        if payload and 'portal' in payload.get('role', ''):
-            contact_id = payload.get('user_id')  # For portal users, user_id is actually contact_id
+        if is_portal(claims):
+            contact_id = claims['user_id']  # For portal users, user_id is actually contact_id
             # Get the actual user_id from contacts table
-            connection = get_connection()
-            cursor = connection.cursor()
-            cursor.execute("SELECT user_id FROM contacts WHERE id = %s", (contact_id,))
-            result = cursor.fetchone()
+            result = execute_query("SELECT user_id FROM contacts WHERE id = %s", (contact_id,))
             if not result:
                 return jsonify({'error': 'Contact not found'}), 404
-            user_id = result[0]
-            cursor.close()
-            release_connection(connection)
+            user_id = result[0]['user_id']
         else:
             # Regular admin user
             contact_id = None
-            user_id = current_user['id']
+            user_id = claims['user_id']
         
         data = request.get_json()
         invoice_id = data.get('invoice_id')
         amount = float(data.get('amount'))
         
-        # Get invoice details
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        if contact_id:
-            # Portal user - verify they own this invoice
-            cursor.execute("""
-                SELECT ci.reference, c.name, c.email, c.phone
-                FROM customer_invoices ci
-                JOIN contacts c ON ci.customer_id = c.id
-                WHERE ci.id = %s AND ci.customer_id = %s
-            """, (invoice_id, contact_id))
-        else:
-            # Admin user - can access any invoice
-            cursor.execute("""
-                SELECT ci.reference, c.name, c.email, c.phone
-                FROM customer_invoices ci
-                JOIN contacts c ON ci.customer_id = c.id
-                WHERE ci.id = %s AND ci.user_id = %s
-            """, (invoice_id, user_id))
-        
-        result = cursor.fetchone()
+        # Get invoice details (connection is released before calling PhonePe)
+        with cursor() as cur:
+            if contact_id:
+                # Portal user - verify they own this invoice
+                cur.execute("""
+                    SELECT ci.reference, c.name, c.email, c.phone
+                    FROM customer_invoices ci
+                    JOIN contacts c ON ci.customer_id = c.id
+                    WHERE ci.id = %s AND ci.customer_id = %s
+                """, (invoice_id, contact_id))
+            else:
+                # Admin user - can access any invoice
+                cur.execute("""
+                    SELECT ci.reference, c.name, c.email, c.phone
+                    FROM customer_invoices ci
+                    JOIN contacts c ON ci.customer_id = c.id
+                    WHERE ci.id = %s AND ci.user_id = %s
+                """, (invoice_id, user_id))
+            
+            result = cur.fetchone()
+        
         if not result:
-            cursor.close()
-            release_connection(connection)
             return jsonify({'error': 'Invoice not found'}), 404
         
         reference, customer_name, customer_email, customer_phone = result
@@ -1023,51 +1023,27 @@ def phonepe_initiate_payment(current_user):
             "amount": int(amount * 100),  # Convert to paise
             "redirectUrl": f"http://127.0.0.1:5000/phonepe-callback.html?invoice_id={invoice_id}&txn_id={txn_id}",
             "redirectMode": "REDIRECT",
+            "callbackUrl": Config.PHONEPE_CALLBACK_URL,
             "paymentInstrument": {
                 "type": "PAY_PAGE"
             }
         }
         
-        # Encode payload to base64
-        payload_json = json.dumps(payload)
-        base64_payload = base64.b64encode(payload_json.encode()).decode()
-        
-        # Generate X-VERIFY header: SHA256(Base64 + "/pg/v1/pay" + SaltKey) + "###" + Index
-        main_string = base64_payload + "/pg/v1/pay" + PHONEPE_SALT_KEY
-        sha256_val = hashlib.sha256(main_string.encode()).hexdigest()
-        x_verify = f"{sha256_val}###{PHONEPE_SALT_INDEX}"
-        
-        # Make API request to PhonePe
-        headers = {
-            "Content-Type": "application/json",
-            "X-VERIFY": x_verify,
-            "accept": "application/json"
-        }
-        
-        phonepe_response = requests.post(
-            PHONEPE_PAY_URL,
-            json={"request": base64_payload},
-            headers=headers
-        )
-        
-        response_data = phonepe_response.json()
+        # Call PhonePe (no DB connection is held here; bounded by timeouts)
+        response_data = get_phonepe_client().pay(payload)
         
         # DEBUG: Print response
         print(f"\n--- PHONEPE DEBUG ---")
-        print(f"Status: {phonepe_response.status_code}")
         print(f"Response: {response_data}")
         print(f"---------------------\n")
         
-        # Store transaction details
-        cursor.execute("""
+        # Store transaction details; the callback normally settles it, the
+        # reconciler only starts polling once the grace period has passed
+        execute_update("""
             INSERT INTO phonepe_transactions 
-            (user_id, invoice_id, merchant_transaction_id, amount, status)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (user_id, invoice_id, txn_id, amount, 'PENDING'))
-        
-        connection.commit()
-        cursor.close()
-        release_connection(connection)
+            (user_id, invoice_id, merchant_transaction_id, amount, status, next_check_at)
+            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+        """, (user_id, invoice_id, txn_id, amount, 'PENDING', Config.PHONEPE_CALLBACK_GRACE))
         
         if response_data.get('success'):
             payment_url = response_data['data']['instrumentResponse']['redirectInfo']['url']
@@ -1083,6 +1059,12 @@ def phonepe_initiate_payment(current_user):
             error_msg = response_data.get('message', 'Payment initiation failed')
             return jsonify({'error': error_msg}), 400
         
+    except GatewayUnavailable as e:
+        logger.error(f'❌ PhonePe initiate error: {str(e)}')
+        return jsonify({'error': str(e)}), 503
+    except GatewayError as e:
+        logger.error(f'❌ PhonePe initiate error: {str(e)}')
+        return jsonify({'error': f'Payment gateway error: {str(e)}'}), 502
     except Exception as e:
         logger.error(f'❌ PhonePe initiate error: {str(e)}')
         import traceback
@@ -1094,72 +1076,34 @@ def phonepe_initiate_payment(current_user):
 def phonepe_verify_payment(current_user, txn_id):
     """Verify PhonePe payment status"""
     try:
-        # Generate X-VERIFY for status check
-        verify_string = f"/pg/v1/status/{PHONEPE_MERCHANT_ID}/{txn_id}{PHONEPE_SALT_KEY}"
-        verify_hash = hashlib.sha256(verify_string.encode()).hexdigest()
-        x_verify = f"{verify_hash}###{PHONEPE_SALT_INDEX}"
-        
-        headers = {
-            "Content-Type": "application/json",
-            "X-VERIFY": x_verify,
-            "accept": "application/json"
-        }
+        # Settled or just-checked transactions are answered from the database
+        # so a polling browser does not hit PhonePe on every request
+        cached_status = stored_status(txn_id)
+        if cached_status:
+            return jsonify(cached_status), 200
         
-        status_url = f"https://api-preprod.phonepe.com/apis/pg-sandbox/pg/v1/status/{PHONEPE_MERCHANT_ID}/{txn_id}"
-        
-        response = requests.get(status_url, headers=headers)
-        status_data = response.json()
+        # Status check happens before any DB connection is taken
+        status_data = get_phonepe_client().status(txn_id)
         
         print(f"\n--- STATUS CHECK ---")
         print(f"Transaction: {txn_id}")
         print(f"Response: {status_data}")
         print(f"--------------------\n")
         
-        # Update database if payment successful
-        if status_data.get('success') and status_data.get('code') == 'PAYMENT_SUCCESS':
-            connection = get_connection()
-            cursor = connection.cursor()
-            
-            # Get transaction details
-            cursor.execute("""
-                SELECT invoice_id, amount, user_id
-                FROM phonepe_transactions
-                WHERE merchant_transaction_id = %s
-            """, (txn_id,))
-            
-            result = cursor.fetchone()
-            if result:
-                invoice_id, amount, user_id = result
-                
-                # Update invoice payment
-                cursor.execute("""
-                    UPDATE customer_invoices 
-                    SET paid_via_online = paid_via_online + %s
-                    WHERE id = %s
-                """, (amount, invoice_id))
-                
-                # Create payment record
-                payment_ref = f"PAY-{txn_id[:8]}"
-                cursor.execute("""
-                    INSERT INTO payments 
-                    (user_id, reference, date, payment_type, payment_method, amount, invoice_id, notes)
-                    VALUES (%s, %s, CURRENT_DATE, 'customer', 'online', %s, %s, %s)
-                """, (user_id, payment_ref, amount, invoice_id, f'PhonePe: {txn_id}'))
-                
-                # Update transaction status
-                cursor.execute("""
-                    UPDATE phonepe_transactions 
-                    SET status = 'SUCCESS', phonepe_transaction_id = %s
-                    WHERE merchant_transaction_id = %s
-                """, (status_data['data']['transactionId'], txn_id))
-                
-                connection.commit()
-            
-            cursor.close()
-            release_connection(connection)
+        # Same idempotent transition the background reconciler uses: the
+        # invoice is credited only by the call that moves the row to SUCCESS
+        with transaction() as cur:
+            outcome = record_status(cur, txn_id, status_data)
+        publish_outcome(txn_id, outcome)
         
         return jsonify(status_data), 200
         
+    except GatewayUnavailable as e:
+        logger.error(f'❌ PhonePe verify error: {str(e)}')
+        return jsonify({'error': str(e)}), 503
+    except GatewayError as e:
+        logger.error(f'❌ PhonePe verify error: {str(e)}')
+        return jsonify({'error': f'Payment gateway error: {str(e)}'}), 502
     except Exception as e:
         logger.error(f'❌ PhonePe verify error: {str(e)}')
         import traceback
@@ -1197,22 +1141,6 @@ def phonepe_test_payment():
             }
         }
         
-        # Encode payload to base64
-        payload_json = json.dumps(payload)
-        base64_payload = base64.b64encode(payload_json.encode()).decode()
-        
-        # Generate X-VERIFY header
-        main_string = base64_payload + "/pg/v1/pay" + PHONEPE_SALT_KEY
-        sha256_val = hashlib.sha256(main_string.encode()).hexdigest()
-        x_verify = f"{sha256_val}###{PHONEPE_SALT_INDEX}"
-        
-        # Make API request to PhonePe
-        headers = {
-            "Content-Type": "application/json",
-            "X-VERIFY": x_verify,
-            "accept": "application/json"
-        }
-        
         print(f"\n--- PHONEPE TEST PAYMENT ---")
         print(f"Invoice ID: {invoice_id}")
         print(f"Amount: ₹{amount}")
@@ -1220,13 +1148,7 @@ def phonepe_test_payment():
         print(f"Merchant ID: {PHONEPE_MERCHANT_ID}")
         print(f"----------------------------\n")
         
-        phonepe_response = requests.post(
-            PHONEPE_PAY_URL,
-            json={"request": base64_payload},
-            headers=headers
-        )
-        
-        response_data = phonepe_response.json()
+        response_data = get_phonepe_client().pay(payload)
         
         print(f"PhonePe Response: {response_data}")
         
@@ -1244,6 +1166,12 @@ def phonepe_test_payment():
             error_msg = response_data.get('message', 'Payment initiation failed')
             return jsonify({'success': False, 'error': error_msg}), 400
         
+    except GatewayUnavailable as e:
+        logger.error(f'❌ PhonePe test payment error: {str(e)}')
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except GatewayError as e:
+        logger.error(f'❌ PhonePe test payment error: {str(e)}')
+        return jsonify({'success': False, 'error': f'Payment gateway error: {str(e)}'}), 502
     except Exception as e:
         logger.error(f'❌ PhonePe test payment error: {str(e)}')
         import traceback
@@ -1260,80 +1188,33 @@ logger.info("✅ PhonePe Test Endpoint registered")
 def phonepe_verify_test(txn_id):
     """Verify PhonePe payment status without authentication"""
     try:
-        # Generate X-VERIFY for status check
-        verify_string = f"/pg/v1/status/{PHONEPE_MERCHANT_ID}/{txn_id}{PHONEPE_SALT_KEY}"
-        verify_hash = hashlib.sha256(verify_string.encode()).hexdigest()
-        x_verify = f"{verify_hash}###{PHONEPE_SALT_INDEX}"
-        
-        headers = {
-            "Content-Type": "application/json",
-            "X-VERIFY": x_verify,
-            "accept": "application/json"
-        }
-        
-        status_url = f"https://api-preprod.phonepe.com/apis/pg-sandbox/pg/v1/status/{PHONEPE_MERCHANT_ID}/{txn_id}"
-        
-        response = requests.get(status_url, headers=headers)
-        status_data = response.json()
+        # Status check happens before any DB connection is taken
+        status_data = get_phonepe_client().status(txn_id)
         
         print(f"\n--- STATUS CHECK (TEST) ---")
         print(f"Transaction: {txn_id}")
         print(f"Response: {status_data}")
         print(f"---------------------------\n")
         
-        # Update invoice if payment successful
-        if status_data.get('success') and status_data.get('code') == 'PAYMENT_SUCCESS':
-            try:
-                connection = get_connection()
-                cursor = connection.cursor()
-                
-                # Get invoice_id from URL params (passed from callback)
-                invoice_id = request.args.get('invoice_id')
-                
-                if invoice_id:
-                    # Get invoice amount
-                    cursor.execute("""
-                        SELECT amount_due, user_id
-                        FROM customer_invoices
-                        WHERE id = %s
-                    """, (invoice_id,))
-                    
-                    result = cursor.fetchone()
-                    if result:
-                        amount_due, user_id = result
-                        amount = status_data['data']['amount'] / 100  # Convert from paise to rupees
-                        
-                        # Update invoice payment
-                        cursor.execute("""
-                            UPDATE customer_invoices 
-                            SET paid_via_online = paid_via_online + %s
-                            WHERE id = %s
-                        """, (amount, invoice_id))
-                        
-                        # Create payment record
-                        payment_ref = f"PHONEPE-{txn_id[:8]}"
-                        cursor.execute("""
-                            INSERT INTO payments 
-                            (user_id, reference, date, payment_type, payment_method, amount, invoice_id, notes)
-                            VALUES (%s, %s, CURRENT_DATE, 'customer', 'online', %s, %s, %s)
-                        """, (user_id, payment_ref, amount, invoice_id, f'PhonePe: {txn_id}'))
-                        
-                        connection.commit()
-                        
-                        print(f"✅ Invoice {invoice_id} updated with payment ₹{amount}")
-                
-                cursor.close()
-                release_connection(connection)
-                
-            except Exception as e:
-                print(f"❌ Error updating invoice: {e}")
-                if connection:
-                    connection.rollback()
+        # The invoice comes from the phonepe_transactions row only (never from
+        # the client); record_status() credits it once, keyed by txn id
+        try:
+            with transaction() as cur:
+                outcome = record_status(cur, txn_id, status_data)
+            publish_outcome(txn_id, outcome)
+        except Exception:
+            logger.exception(f'❌ Could not record PhonePe status for {txn_id}')
         
         logger.info(f'✅ PhonePe test verify: {txn_id} - {status_data.get("code")}')
         
         return jsonify(status_data), 200
         
+    except GatewayUnavailable as e:
+        logger.error(f'❌ PhonePe test verify error: {str(e)}')
+        return jsonify({'error': str(e)}), 503
+    except GatewayError as e:
+        logger.error(f'❌ PhonePe test verify error: {str(e)}')
+        return jsonify({'error': f'Payment gateway error: {str(e)}'}), 502
     except Exception as e:
         logger.error(f'❌ PhonePe test verify error: {str(e)}')
         import traceback
@@ -1342,6 +1223,112 @@ def phonepe_verify_test(txn_id):
 
 logger.info("✅ PhonePe Test Verify Endpoint registered")
 
+# ============================================
+# PHONEPE RECONCILIATION (BACKGROUND WORKER)
+# ============================================
+
+@app.route('/api/phonepe/reconcile', methods=['POST'])
+@token_required
+def phonepe_reconcile(current_user):
+    """Run one reconciliation cycle now (normally done by the background worker)"""
+    try:
+        summary = get_reconciler().run_once()
+        return jsonify({'success': True, 'summary': summary}), 200
+    except Exception as e:
+        logger.error(f'❌ PhonePe reconcile error: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/phonepe/reconciler-stats', methods=['GET'])
+@token_required
+def phonepe_reconciler_stats(current_user):
+    """Reconciler state and outcome counters since startup"""
+    return jsonify({'success': True, 'reconciler': get_reconciler().stats()}), 200
+
+logger.info("✅ PhonePe Reconciliation routes registered")
+
+# ============================================
+# PHONEPE SERVER-TO-SERVER CALLBACK
+# ============================================
+
+@app.route('/api/phonepe/callback', methods=['POST'])
+def phonepe_callback():
+    """
+    PhonePe payment notification (no auth - authenticated by X-VERIFY)
+    Verifies the checksum, queues the event and answers at once;
+    the callback worker applies it to the invoice
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        payload = verify_callback(data.get('response'), request.headers.get('X-VERIFY'))
+        event_id = enqueue_callback(payload)
+        
+        logger.info(f"📨 PhonePe callback queued: {payload['data']['merchantTransactionId']} - {payload.get('code')} (event {event_id})")
+        return jsonify({'success': True}), 200
+        
+    except CallbackError as e:
+        logger.warning(f'⚠️ PhonePe callback rejected: {str(e)}')
+        return jsonify({'success': False, 'error': str(e)}), 401
+    except Exception as e:
+        # Non-2xx makes PhonePe retry the notification later
+        logger.error(f'❌ PhonePe callback error: {str(e)}')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/phonepe/callback-stats', methods=['GET'])
+@token_required
+def phonepe_callback_stats(current_user):
+    """Callback queue worker state and counters"""
+    return jsonify({'success': True, 'worker': get_callback_worker().stats()}), 200
+
+if not RELOADER_WATCHER:
+    if Config.PHONEPE_CALLBACK_WORKER_ENABLED:
+        start_callback_worker()
+    if Config.PHONEPE_RECONCILER_ENABLED:
+        start_reconciler()
+
+logger.info("✅ PhonePe Callback route registered")
+
+# ============================================
+# LIVE PAYMENT STATUS (SERVER-SENT EVENTS)
+# ============================================
+
+# Each open stream holds a worker thread; past the cap clients poll instead
+event_stream_slots = StreamSlots(Config.SSE_MAX_STREAMS)
+
+@app.route('/api/phonepe/events/<txn_id>', methods=['GET'])
+def phonepe_payment_events(txn_id):
+    """
+    Stream a transaction's status as Server-Sent Events (no auth, like verify-test)
+    Pushes the current state, then each change (callback, reconciler or verify)
+    and closes once the payment is settled - replaces client-side polling.
+    404 for unknown transactions; 503 + Retry-After when SSE_MAX_STREAMS are open
+    """
+    if transaction_state(txn_id) is None:
+        return jsonify({'error': 'Transaction not found'}), 404
+    if not event_stream_slots.acquire():
+        logger.warning(f"⚠️ SSE stream limit reached ({Config.SSE_MAX_STREAMS}), refusing {txn_id}")
+        response = jsonify({'error': 'Too many open status streams, poll instead'})
+        response.headers['Retry-After'] = str(Config.SSE_RETRY_AFTER)
+        return response, 503
+
+    stream = sse_stream(
+        payment_events,
+        f'phonepe:{txn_id}',
+        load_state=lambda: transaction_state(txn_id),
+        is_final=lambda state: state['status'] in ('SUCCESS', 'FAILED'),
+        heartbeat=Config.SSE_HEARTBEAT,
+        max_duration=Config.SSE_MAX_DURATION
+    )
+    response = Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs however the response ends (settled, timed out, client gone)
+    response.call_on_close(event_stream_slots.release)
+    return response
+
+logger.info("✅ Payment Events (SSE) route registered")
+
 # ============================================
 # PAYMENT SIMULATOR API
 # ============================================
@@ -1356,41 +1343,29 @@ def payment_simulator_update():
         status = data.get('status')
         amount = float(data.get('amount', 0))
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        if status == 'success':
-            # Update invoice as paid
-            cursor.execute("""
-                UPDATE customer_invoices 
-                SET paid_via_online = paid_via_online + %s
-                WHERE id = %s
-            """, (amount, invoice_id))
-            
-            # Create payment record
-            payment_ref = f"SIM-{txn_id}"
-            cursor.execute("""
-                INSERT INTO payments 
-                (user_id, reference, date, payment_type, payment_method, amount, invoice_id, notes)
-                SELECT user_id, %s, CURRENT_DATE, 'customer', 'online', %s, %s, %s
-                FROM customer_invoices WHERE id = %s
-            """, (payment_ref, amount, invoice_id, f'Simulator: {txn_id}', invoice_id))
+        with transaction() as cur:
+            if status == 'success':
+                # Credit the invoice once per simulator transaction
+                apply_payment(
+                    cur, amount,
+                    invoice_id=invoice_id,
+                    idempotency_key=f'simulator:{txn_id}',
+                    reference=f"SIM-{txn_id}",
+                    notes=f'Simulator: {txn_id}'
+                )
             
-        elif status == 'pending':
-            # Create pending payment record
-            payment_ref = f"PEN-{txn_id}"
-            cursor.execute("""
-                INSERT INTO payments 
-                (user_id, reference, date, payment_type, payment_method, amount, invoice_id, notes)
-                SELECT user_id, %s, CURRENT_DATE, 'customer', 'online', %s, %s, %s
-                FROM customer_invoices WHERE id = %s
-            """, (payment_ref, amount, invoice_id, f'Pending: {txn_id}', invoice_id))
+            elif status == 'pending':
+                # Create pending payment record (invoice is not credited)
+                payment_ref = f"PEN-{txn_id}"
+                cur.execute("""
+                    INSERT INTO payments 
+                    (user_id, reference, date, payment_type, payment_method, amount, invoice_id, notes, idempotency_key)
+                    SELECT user_id, %s, CURRENT_DATE, 'customer', 'online', %s, %s, %s, %s
+                    FROM customer_invoices WHERE id = %s
+                    ON CONFLICT (user_id, idempotency_key) DO NOTHING
+                """, (payment_ref, amount, invoice_id, f'Pending: {txn_id}', f'simulator-pending:{txn_id}', invoice_id))
             
-        # For failed payments, we don't update anything
-        
-        connection.commit()
-        cursor.close()
-        release_connection(connection)
+            # For failed payments, we don't update anything
         
         logger.info(f'✅ Payment simulator updated: {txn_id} - {status}')
         
@@ -1410,46 +1385,56 @@ logger.info("✅ Payment Simulator API routes registered")
 # PAYMENTS API
 # ============================================
 
-@app.route('/api/payments', methods=['GET'])
-@token_required
-def get_payments(current_user):
-    """Get all payments for current user"""
-    try:
-        user_id = current_user['id']
-        
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        query = """
-        SELECT 
-            p.id, p.reference, p.date, p.payment_type, p.payment_method, p.amount,
-            p.notes,
-            CASE 
+PAYMENTS_LIST = ListSpec(
+    fields={
+        'id': 'p.id',
+        'reference': 'p.reference',
+        'date': 'p.date',
+        'payment_type': 'p.payment_type',
+        'payment_method': 'p.payment_method',
+        'amount': 'p.amount',
+        'notes': 'p.notes',
+        'contact_name': """CASE 
                 WHEN p.payment_type = 'customer' THEN c1.name
                 WHEN p.payment_type = 'vendor' THEN c2.name
-            END as contact_name,
-            CASE 
+            END""",
+        'document_reference': """CASE 
                 WHEN p.payment_type = 'customer' THEN ci.reference
                 WHEN p.payment_type = 'vendor' THEN 'VB-' || p.bill_id
-            END as document_reference
-        FROM payments p
+            END"""
+    },
+    from_sql="""FROM payments p
         LEFT JOIN contacts c1 ON p.customer_id = c1.id
         LEFT JOIN contacts c2 ON p.vendor_id = c2.id
-        LEFT JOIN customer_invoices ci ON p.invoice_id = ci.id
-        WHERE p.user_id = %s
-        ORDER BY p.date DESC, p.id DESC
-        """
-        
-        cursor.execute(query, (user_id,))
-        columns = [desc[0] for desc in cursor.description]
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        LEFT JOIN customer_invoices ci ON p.invoice_id = ci.id""",
+    tenant_column='p.user_id',
+    sort=('p.date', 'date'),
+    id_column='p.id',
+    filters={
+        'payment_type': 'p.payment_type',
+        'payment_method': 'p.payment_method',
+        'partner_id': 'COALESCE(p.customer_id, p.vendor_id)'
+    },
+    date_column='p.date'
+)
+
+@app.route('/api/payments', methods=['GET'])
+@token_required
+def get_payments(current_user):
+    """
+    Get payments for current user (newest first)
+    Query: limit, cursor, fields, payment_type, payment_method, partner_id, date_from, date_to
+    """
+    try:
+        user_id = current_user['id']
         
-        cursor.close()
-        release_connection(connection)
+        results, next_cursor = fetch_page(PAYMENTS_LIST, user_id, request.args)
         
         logger.info(f'✅ Retrieved {len(results)} payments')
-        return jsonify(results), 200
+        return jsonify(results), 200, page_headers(next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f'❌ Error fetching payments: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -1458,66 +1443,43 @@ def get_payments(current_user):
 @token_required
 def create_payment(current_user):
     """Create new payment record"""
-    connection = None
-    cursor = None
     try:
         user_id = current_user['id']
         data = request.get_json()
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        # Insert payment
-        query = """
-        INSERT INTO payments 
-        (user_id, reference, date, payment_type, payment_method, amount,
-         invoice_id, bill_id, customer_id, vendor_id, notes)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
-        """
-        
-        cursor.execute(query, (
-            user_id,
-            data['reference'],
-            data['date'],
-            data['payment_type'],
-            data['payment_method'],
-            data['amount'],
-            data.get('invoice_id'),
-            data.get('bill_id'),
-            data.get('customer_id'),
-            data.get('vendor_id'),
-            data.get('notes')
-        ))
-        
-        payment_id = cursor.fetchone()[0]
-        
-        # Update invoice/bill payment status
-        if data.get('invoice_id'):
-            update_query = """
-            UPDATE customer_invoices 
-            SET paid_via_online = paid_via_online + %s
-            WHERE id = %s
-            """
-            cursor.execute(update_query, (data['amount'], data['invoice_id']))
-        
-        connection.commit()
+        # Payment row and invoice balance are committed together;
+        # a retry with the same Idempotency-Key returns the first payment
+        with transaction() as cur:
+            result = apply_payment(
+                cur, data['amount'],
+                user_id=user_id,
+                invoice_id=data.get('invoice_id'),
+                idempotency_key=request_idempotency_key(request, data),
+                payment_method=data['payment_method'],
+                payment_type=data['payment_type'],
+                reference=data['reference'],
+                date=data['date'],
+                bill_id=data.get('bill_id'),
+                customer_id=data.get('customer_id'),
+                vendor_id=data.get('vendor_id'),
+                notes=data.get('notes')
+            )
+        
+        payment_id = result['payment_id']
+        
+        if not result['applied']:
+            return jsonify({'id': payment_id, 'message': 'Payment already recorded', 'duplicate': True}), 200
         
         logger.info(f'✅ Payment created: {payment_id}')
         return jsonify({'id': payment_id, 'message': 'Payment recorded'}), 201
         
+    except InvoiceNotFound:
+        return jsonify({'error': 'Invoice not found'}), 404
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f'❌ Error creating payment: {str(e)}')
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            release_connection(connection)
 
 logger.info("✅ Payments API routes registered")
 
@@ -1535,15 +1497,211 @@ def api_home():
         'status': 'running'
     })
 
+# Dependency checks run on a background thread (utils/health.py); probes
+# are answered from the cached result and never open a connection
+if Config.HEALTH_MONITOR_ENABLED and not RELOADER_WATCHER:
+    start_health_monitor()
+
 @app.route('/api/health')
 def health_check():
     """
-    Health check route for monitoring
+    Health check route for monitoring (cached, see /api/health/ready)
     Returns: JSON with system health status
     """
+    readiness = get_health_monitor().readiness()
+    database = readiness['checks'].get('database', {})
+    return jsonify({
+        'status': 'healthy' if readiness['ready'] else 'unhealthy',
+        'database': 'connected' if database.get('ok') else 'disconnected',
+        'checked_seconds_ago': readiness['age_seconds']
+    }), 200 if readiness['ready'] else 503
+
+@app.route('/api/health/live')
+def liveness_probe():
+    """
+    Liveness probe: the process is up and answering (no dependency checks)
+    Returns: 200 with uptime
+    """
+    return jsonify(get_health_monitor().liveness()), 200
+
+@app.route('/api/health/ready')
+def readiness_probe():
+    """
+    Readiness probe: last cached result of the database, pool and gateway checks
+    Returns: 200 when ready (or degraded), 503 when not ready, starting or stale
+    """
+    readiness = get_health_monitor().readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus scrape endpoint
+    Returns: text exposition of request, gateway, pool, cache and hashing metrics
+    """
+    return Response(render_metrics(), mimetype=METRICS_CONTENT_TYPE)
+
+@register_collector
+def collect_pool_metrics():
+    """Connection pool utilisation and checkout waits"""
+    from utils.db import get_pool_stats
+    stats = get_pool_stats()
+    if stats is None:
+        return []
+    
+    lines = family('db_pool_connections', 'gauge', 'Open pool connections by state',
+                   [(('in_use',), stats['in_use']), (('idle',), stats['idle'])], ('state',))
+    lines += family('db_pool_max_connections', 'gauge', 'Pool size limit', [((), stats['max_size'])])
+    lines += family('db_pool_waiters', 'gauge', 'Threads waiting for a connection', [((), stats['waiters'])])
+    lines += family('db_pool_timeouts_total', 'counter', 'Checkouts that timed out', [((), stats['timeouts'])])
+    
+    # The pool keeps per-bucket counts in milliseconds; Prometheus wants cumulative seconds
+    lines += ['# HELP db_pool_wait_seconds Time spent waiting for a connection',
+              '# TYPE db_pool_wait_seconds histogram']
+    cumulative = 0
+    for bucket, count in stats['wait_time_histogram'].items():
+        cumulative += count
+        if bucket.startswith('le_'):
+            lines.append(f'db_pool_wait_seconds_bucket{{le="{int(bucket[3:-2]) / 1000}"}} {cumulative}')
+    lines.append(f'db_pool_wait_seconds_bucket{{le="+Inf"}} {stats["checkouts"]}')
+    lines.append(f'db_pool_wait_seconds_sum {stats["wait_time_avg_ms"] * stats["checkouts"] / 1000}')
+    lines.append(f'db_pool_wait_seconds_count {stats["checkouts"]}')
+    return lines
+
+@register_collector
+def collect_cache_metrics():
+    """Hit/miss counters of the in-process caches"""
+    from utils.auth import get_user_cache_stats, get_token_cache_stats
+    from routes.stats import get_summary_cache_stats
+    from utils.rule_index import get_rule_index_stats
+    caches = {
+        'users': get_user_cache_stats(),
+        'tokens': get_token_cache_stats(),
+        'stats_summary': get_summary_cache_stats(),
+        'rule_index': get_rule_index_stats(),
+        'qr_images': qr_renderer.stats()
+    }
+    
+    lines = []
+    for name, key, metric_type, documentation in (
+        ('cache_hits_total', 'hits', 'counter', 'Cache lookups answered from memory'),
+        ('cache_misses_total', 'misses', 'counter', 'Cache lookups that had to load'),
+        ('cache_evictions_total', 'evictions', 'counter', 'Entries dropped because the cache was full'),
+        ('cache_entries', 'size', 'gauge', 'Entries currently cached'),
+        ('cache_hit_ratio', 'hit_ratio', 'gauge', 'hits / (hits + misses) since start')
+    ):
+        lines += family(name, metric_type, documentation,
+                        [((cache,), stats.get(key)) for cache, stats in caches.items()], ('cache',))
+    return lines
+
+@register_collector
+def collect_service_metrics():
+    """Password hashing queue, statement totals and PhonePe circuit state"""
+    from utils.passwords import hasher
+    from utils.query_stats import query_stats
+    hashing = hasher.stats()
+    statements = query_stats.summary()
+    
+    lines = family('password_hash_in_flight', 'gauge', 'bcrypt jobs running or queued', [((), hashing['in_flight'])])
+    lines += family('password_hash_rejected_total', 'counter', 'bcrypt jobs refused with 503', [((), hashing['rejected'])])
+    lines += family('db_statements_total', 'counter', 'SQL statements executed', [((), statements['calls'])])
+    lines += family('db_statement_errors_total', 'counter', 'SQL statements that raised', [((), statements['errors'])])
+    lines += family('db_statement_seconds_total', 'counter', 'Time spent executing SQL',
+                    [((), statements['total_ms'] / 1000)])
+    lines += family('phonepe_circuit_open', 'gauge', '1 while the PhonePe circuit breaker is open',
+                    [((), int(get_phonepe_client().breaker.state == 'open'))])
+    return lines
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    """
+    In-process cache statistics
+    Returns: JSON with size and hit/miss counters per cache
+    """
+    from utils.auth import get_user_cache_stats, get_token_cache_stats
+    from routes.stats import get_summary_cache_stats
+    from utils.rule_index import get_rule_index_stats
     return jsonify({
-        'status': 'healthy',
-        'database': 'connected'
+        'success': True,
+        'caches': {
+            'users': get_user_cache_stats(),
+            'tokens': get_token_cache_stats(),
+            'stats_summary': get_summary_cache_stats(),
+            'rule_index': get_rule_index_stats(),
+            'qr_images': qr_renderer.stats()
+        }
+    }), 200
+
+@app.route('/api/pool-stats')
+@admin_required
+def pool_stats(current_user):
+    """
+    Connection pool statistics for capacity planning (admin only)
+    Returns: JSON with in-use/idle/waiters counts and wait-time histogram
+    """
+    from utils.db import get_pool_stats
+    stats = get_pool_stats()
+    if stats is None:
+        return jsonify({
+            'success': False,
+            'message': 'Connection pool not initialized'
+        }), 503
+    return jsonify({
+        'success': True,
+        'pool': stats
+    })
+
+@app.route('/api/metrics/db', methods=['GET'])
+@admin_required
+def db_metrics(current_user):
+    """
+    Per-statement database metrics (admin only)
+    Query: sort (total_ms|avg_ms|max_ms|calls|errors|rows), limit (default 20, 0 = all)
+    Returns: JSON with top statements (latency histogram, rows), recent slow queries and pool waits
+    """
+    from utils.query_stats import query_stats
+    from utils.db import get_pool_stats
+    try:
+        statements = query_stats.snapshot(
+            sort=request.args.get('sort', 'total_ms'),
+            limit=request.args.get('limit', 20, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response = {
+        'success': True,
+        'summary': query_stats.summary(),
+        'statements': statements,
+        'slow_queries': query_stats.slow_queries(),
+        'pool': get_pool_stats()
+    }
+    return jsonify(response)
+
+@app.route('/api/metrics/db/reset', methods=['POST'])
+@admin_required
+def reset_db_metrics(current_user):
+    """Clear the statement statistics and slow-query log (admin only)"""
+    from utils.query_stats import query_stats
+    query_stats.reset()
+    logger.info(f"🧹 Query statistics reset by user {current_user['id']}")
+    return jsonify({'success': True, 'message': 'Query statistics reset'})
+
+@app.route('/api/hasher-stats')
+@admin_required
+def hasher_stats(current_user):
+    """
+    Password hashing pool and login throttle statistics (admin only)
+    Returns: JSON with in-flight/completed/rejected hash jobs and throttled keys
+    """
+    from utils.passwords import hasher, ip_throttle, email_throttle
+    return jsonify({
+        'success': True,
+        'hasher': hasher.stats(),
+        'throttles': {
+            'ip': ip_throttle.stats(),
+            'email': email_throttle.stats()
+        }
     })
 
 @app.route('/api/test-db')
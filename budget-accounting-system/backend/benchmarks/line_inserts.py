@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-line INSERT loop (before) vs utils.document_lines.insert_lines (after)
+
+Writes 10/100/1000-line documents into a temporary table shaped like
+purchase_order_lines and reports the median time per document.
+
+Usage:
+    python benchmarks/line_inserts.py [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from utils.document_lines import LINE_TABLES, insert_lines
+
+LINE_COUNTS = (10, 100, 1000)
+COLUMNS = ('product_id', 'description', 'quantity', 'price', 'subtotal', 'analytical_account_id')
+
+
+def make_lines(count):
+    return [
+        {
+            'product_id': None,
+            'description': f'Line {i}',
+            'quantity': 2,
+            'price': 150.00,
+            'subtotal': 300.00,
+            'analytical_account_id': None
+        }
+        for i in range(count)
+    ]
+
+
+def insert_row_by_row(cur, document_id, lines):
+    """The old handler loop: one execute() per line"""
+    query = """
+        INSERT INTO bench_document_lines
+        (document_id, product_id, description, quantity, price, subtotal, analytical_account_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """
+    for line in lines:
+        cur.execute(query, (document_id,) + tuple(line[column] for column in COLUMNS))
+
+
+def time_document(connection, writer, lines, repeat):
+    timings = []
+    for document_id in range(repeat):
+        cur = connection.cursor()
+        started = time.perf_counter()
+        writer(cur, document_id, lines)
+        connection.commit()
+        timings.append(time.perf_counter() - started)
+        cur.close()
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='documents written per size (median reported)')
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+        database=Config.DB_NAME,
+        user=Config.DB_USER,
+        password=Config.DB_PASSWORD
+    )
+
+    cur = connection.cursor()
+    cur.execute("""
+        CREATE TEMP TABLE bench_document_lines (
+            id SERIAL PRIMARY KEY,
+            document_id INTEGER NOT NULL,
+            product_id INTEGER,
+            description TEXT,
+            quantity DECIMAL(10,2) DEFAULT 1,
+            price DECIMAL(15,2) DEFAULT 0,
+            subtotal DECIMAL(15,2) DEFAULT 0,
+            analytical_account_id INTEGER
+        )
+    """)
+    connection.commit()
+    cur.close()
+
+    # Point a throwaway document type at the temp table
+    LINE_TABLES['benchmark'] = ('bench_document_lines', 'document_id', COLUMNS)
+
+    def bulk(cur, document_id, lines):
+        insert_lines(cur, 'benchmark', document_id, lines)
+
+    print(f"{'lines':>6} | {'row-by-row (ms)':>16} | {'insert_lines (ms)':>17} | {'speedup':>7}")
+    print('-' * 57)
+    for count in LINE_COUNTS:
+        lines = make_lines(count)
+        before = time_document(connection, insert_row_by_row, lines, args.repeat)
+        after = time_document(connection, bulk, lines, args.repeat)
+        print(f"{count:>6} | {before:>16.2f} | {after:>17.2f} | {before / after:>6.1f}x")
+
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Per-request overhead of the /metrics request hook (utils/metrics.py)
+
+Measures:
+    - hook: the work RequestTimer adds to one request (two perf_counter
+      calls, in-flight enter/exit, one histogram observation including its
+      share of the batched flush) without Flask
+    - flask: a trivial route through the Flask test client with and without
+      the hook registered (only when Flask is installed); the difference is
+      the real per-request cost including Flask's hook dispatch
+
+Exits with status 1 when the hook cost exceeds --budget-us, so it can run in CI.
+
+Usage:
+    python benchmarks/metrics_hook.py
+    python benchmarks/metrics_hook.py --requests 200000 --routes 50 --budget-us 1
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.metrics import Histogram, InFlight
+
+
+def bench_hook(requests, routes):
+    """Nanoseconds per request of the hook work alone"""
+    histogram = Histogram('bench_request_duration_seconds', 'bench', ('method', 'route', 'status'))
+    in_flight = InFlight('bench_in_flight', 'bench')
+    route_names = [f'/api/bench/{n}' for n in range(routes)]
+    perf_counter = time.perf_counter
+
+    started = time.perf_counter()
+    for n in range(requests):
+        request_started = perf_counter()
+        in_flight.enter()
+        in_flight.exit()
+        histogram.observe(perf_counter() - request_started, 'GET', route_names[n % routes], '200')
+    histogram.flush()
+    elapsed = time.perf_counter() - started
+
+    # Subtract the bare loop
+    started = time.perf_counter()
+    for n in range(requests):
+        route_names[n % routes]
+    loop = time.perf_counter() - started
+    return (elapsed - loop) / requests * 1e9
+
+
+def bench_flask(requests):
+    """(ns per request without hook, ns per request with hook), or None without Flask"""
+    try:
+        from flask import Flask
+    except ImportError:
+        return None
+    from utils.metrics import RequestTimer
+
+    def build(with_hook):
+        app = Flask(__name__)
+        if with_hook:
+            RequestTimer().init_app(app)
+
+        @app.route('/ping')
+        def ping():
+            return 'ok'
+        return app.test_client()
+
+    results = []
+    for with_hook in (False, True):
+        client = build(with_hook)
+        for _ in range(200):
+            client.get('/ping')
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get('/ping')
+        results.append((time.perf_counter() - started) / requests * 1e9)
+    return tuple(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100000, help='simulated requests for the hook benchmark')
+    parser.add_argument('--flask-requests', type=int, default=5000, help='requests through the Flask test client')
+    parser.add_argument('--routes', type=int, default=20, help='distinct route labels')
+    parser.add_argument('--budget-us', type=float, default=1.0, help='allowed hook cost per request (microseconds)')
+    args = parser.parse_args()
+
+    hook_ns = bench_hook(args.requests, args.routes)
+    print(f"⏱️ Hook cost: {hook_ns:.0f} ns/request ({args.requests} requests, {args.routes} routes)")
+
+    flask_ns = bench_flask(args.flask_requests)
+    if flask_ns is None:
+        print("ℹ️ Flask not installed, skipping the end-to-end comparison")
+    else:
+        without, with_hook = flask_ns
+        print(f"⏱️ Flask test client: {without / 1000:.1f} µs without hook, {with_hook / 1000:.1f} µs with hook "
+              f"(+{(with_hook - without) / 1000:.2f} µs)")
+
+    if hook_ns > args.budget_us * 1000:
+        print(f"❌ Hook cost above the {args.budget_us} µs budget")
+        return 1
+    print(f"✅ Within the {args.budget_us} µs budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
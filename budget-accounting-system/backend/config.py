@@ -21,6 +21,84 @@ class Config:
     DB_USER = 'postgres'
     DB_PASSWORD = 'parshva123'
     
+    # ===== CONNECTION POOL CONFIGURATION =====
+    DB_POOL_MIN_SIZE = 2  # Connections opened at startup
+    DB_POOL_MAX_SIZE = 10  # Hard cap on open connections
+    DB_POOL_TIMEOUT = 10  # Seconds a request waits for a free connection
+    DB_POOL_HEALTH_CHECK_INTERVAL = 30  # Ping idle connections older than this (seconds)
+    
+    # ===== HEALTH PROBES =====
+    HEALTH_MONITOR_ENABLED = True  # Run the background dependency checks (probes report 'starting' without them)
+    HEALTH_CHECK_INTERVAL = 5  # Seconds between background dependency checks
+    HEALTH_STALE_AFTER = 30  # Seconds after which a cached check result reports not ready
+    HEALTH_DB_TIMEOUT = 2  # Seconds the database check waits for a pooled connection
+    HEALTH_POOL_SATURATION = 1.0  # Share of connections in use that, with queued waiters, means not ready
+    HEALTH_GATEWAY_CRITICAL = False  # An open PhonePe circuit makes the instance not ready (else only 'degraded')
+    
+    # ===== REQUEST METRICS =====
+    METRICS_ENABLED = True  # Time every request for /metrics (per-route latency histograms)
+    
+    # ===== REQUEST PROFILER =====
+    PROFILER_ENABLED = False  # Register the sampling profiler hooks (nothing runs per request when False)
+    PROFILER_SAMPLE_RATE = 0.0  # Share of requests profiled without the header (0 = header only)
+    PROFILER_SECRET = None  # 'X-Profile: <secret>' profiles any request; 'X-Profile: 1' needs an admin token
+    PROFILER_MAX_PER_MINUTE = 30  # Profiles taken per minute (header or sampled), the rest are skipped
+    PROFILER_MAX_FILES = 200  # Profiles kept in PROFILER_OUTPUT_DIR (oldest are deleted)
+    PROFILER_INTERVAL_MS = 5  # Stack sampling interval of a profiled request
+    PROFILER_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')  # .folded / .json dumps
+    
+    # ===== QUERY INSTRUMENTATION =====
+    DB_SLOW_QUERY_MS = 200  # Statements at or above this go to the 'slow_queries' log
+    DB_SLOW_LOG_SIZE = 100  # Recent slow statements kept for /api/metrics/db
+    DB_QUERY_STATS_MAX = 500  # Distinct statement fingerprints tracked per process
+    DB_EXPLAIN_SLOW = False  # Re-run slow SELECTs under EXPLAIN ANALYZE and keep the plan
+    DB_EXPLAIN_INTERVAL = 300  # Seconds between EXPLAIN captures of one fingerprint
+    
+    # ===== AUTH USER CACHE =====
+    USER_CACHE_SIZE = 1024  # Users kept per process (LRU beyond this)
+    USER_CACHE_TTL = 60  # Seconds before a cached user is re-read from the database
+    TOKEN_CACHE_SIZE = 4096  # Decoded JWTs kept per process
+    TOKEN_CACHE_TTL = 30  # Seconds a decoded JWT skips signature verification
+    
+    # ===== DASHBOARD STATS =====
+    STATS_CACHE_SIZE = 1024  # Tenants kept in the summary cache
+    STATS_CACHE_TTL = 15  # Seconds a tenant's dashboard summary is reused
+    STATS_SUMMARY_SOURCE = 'live'  # 'live' (aggregate query) or 'counters' (needs migrations/optional/010_enable_tenant_counters.sql)
+    
+    # ===== LIST ENDPOINTS =====
+    LIST_DEFAULT_LIMIT = None  # Rows per page when ?limit is omitted (None = whole list, for older clients)
+    LIST_MAX_LIMIT = 500  # Upper bound for ?limit
+    
+    # ===== STREAMING REPORTS =====
+    STREAM_ITERSIZE = 2000  # Rows fetched per round trip by server-side cursors
+    
+    # ===== AUTO ANALYTICAL RULE INDEX =====
+    RULE_INDEX_CACHE_SIZE = 1024  # Tenants whose compiled rules are kept in memory
+    RULE_INDEX_TTL = 300  # Seconds before a tenant's rules are reloaded (bounds staleness across processes)
+    
+    # ===== LIVE PAYMENT EVENTS (SSE) =====
+    SSE_HEARTBEAT = 15  # Seconds between keep-alives (the status is re-checked at each one)
+    SSE_MAX_DURATION = 300  # Seconds before a stream is closed (EventSource reconnects)
+    SSE_MAX_STREAMS = 16  # Open streams per process (keep below the server's threads); more get 503
+    SSE_RETRY_AFTER = 30  # Retry-After seconds sent with that 503
+    
+    # ===== QR CODES =====
+    QR_CACHE_SIZE = 512  # Rendered QR images kept in memory
+    QR_CACHE_TTL = 3600  # Seconds a rendered image is reused
+    QR_RENDER_WORKERS = 0  # Processes for rendering (0 = render in the request thread)
+    QR_BOX_SIZE = 8  # Default pixels per QR module
+    QR_HTTP_MAX_AGE = 300  # Cache-Control max-age of QR images (private)
+    
+    # ===== PASSWORD HASHING =====
+    PASSWORD_HASH_ROUNDS = 12  # bcrypt cost for new hashes (older costs are re-hashed on login)
+    PASSWORD_HASH_WORKERS = 2  # Processes doing bcrypt work (0 = hash in the request thread)
+    PASSWORD_HASH_MAX_QUEUE = 32  # Hash jobs allowed to wait for a worker
+    PASSWORD_HASH_QUEUE_TIMEOUT = 2  # Seconds a request waits for a slot before a 503
+    AUTH_THROTTLE_WINDOW = 300  # Seconds of history used by the login/signup throttles
+    AUTH_IP_ATTEMPT_LIMIT = 30  # Failed logins/signups per client IP per window
+    AUTH_EMAIL_FAILURE_LIMIT = 5  # Failed logins per email per window
+    TRUSTED_PROXY_COUNT = 0  # Reverse proxies in front of the app; >0 reads the client IP from X-Forwarded-For
+    
     # ===== JWT CONFIGURATION =====
     JWT_SECRET_KEY = 'jwt-secret-key-change-in-production'
     JWT_EXPIRATION_HOURS = 24
@@ -28,6 +106,38 @@ class Config:
     # ===== CORS CONFIGURATION =====
     CORS_ORIGINS = '*'  # Allow all origins for development
     
+    # ===== PHONEPE CONFIGURATION (UAT - DEFAULT TEST CREDENTIALS) =====
+    PHONEPE_MERCHANT_ID = "PGTESTPAYUAT86"
+    PHONEPE_SALT_KEY = "96434309-7796-489d-8924-ab56988a6076"
+    PHONEPE_SALT_INDEX = 1
+    PHONEPE_BASE_URL = "https://api-preprod.phonepe.com/apis/pg-sandbox"
+    PHONEPE_CONNECT_TIMEOUT = 3  # Seconds to establish the TCP/TLS connection
+    PHONEPE_READ_TIMEOUT = 10  # Seconds to wait for PhonePe's response
+    PHONEPE_MAX_RETRIES = 2  # Extra attempts after the first one
+    PHONEPE_RETRY_BACKOFF = 0.5  # Base backoff in seconds (doubles per attempt)
+    PHONEPE_BREAKER_THRESHOLD = 5  # Consecutive failures that open the circuit
+    PHONEPE_BREAKER_RESET = 30  # Seconds the circuit stays open before a trial call
+    PHONEPE_HTTP_POOL_SIZE = 10  # Keep-alive connections to PhonePe
+    
+    # ===== PHONEPE RECONCILER =====
+    PHONEPE_RECONCILER_ENABLED = True  # Poll PENDING transactions in a background thread
+    PHONEPE_RECONCILE_INTERVAL = 30  # Seconds between reconciliation cycles
+    PHONEPE_RECONCILE_BATCH_SIZE = 50  # Due transactions claimed per cycle
+    PHONEPE_RECONCILE_RATE = 5  # Max status calls per second
+    PHONEPE_RECONCILE_BACKOFF = 30  # Seconds before the first re-check (doubles per attempt)
+    PHONEPE_RECONCILE_MAX_BACKOFF = 1800  # Cap on the re-check delay
+    PHONEPE_PENDING_EXPIRY_MINUTES = 120  # PENDING transactions older than this are marked EXPIRED
+    PHONEPE_VERIFY_MIN_INTERVAL = 5  # Seconds between gateway checks of one transaction from the verify endpoint
+    
+    # ===== PHONEPE CALLBACKS =====
+    PHONEPE_CALLBACK_URL = "http://127.0.0.1:5000/api/phonepe/callback"  # Server-to-server URL sent with each pay request
+    PHONEPE_CALLBACK_GRACE = 300  # Seconds the reconciler waits for the callback before polling a new transaction
+    PHONEPE_CALLBACK_WORKER_ENABLED = True  # Apply queued callbacks in a background thread
+    PHONEPE_CALLBACK_POLL_INTERVAL = 5  # Seconds between queue scans (events from this process wake the worker at once)
+    PHONEPE_CALLBACK_BATCH_SIZE = 100  # Events applied per scan
+    PHONEPE_CALLBACK_MAX_ATTEMPTS = 5  # Failed applications before an event is parked as 'failed'
+    PHONEPE_CALLBACK_RETRY_DELAY = 10  # Seconds before the first retry (doubles per attempt)
+    
     # ===== RAZORPAY CONFIGURATION (TEST MODE) =====
     RAZORPAY_KEY_ID = 'rzp_test_YOUR_KEY_ID'
     RAZORPAY_KEY_SECRET = 'YOUR_KEY_SECRET'
@@ -0,0 +1,34 @@
+-- =====================================================
+-- Migration: 009_budget_achievements.sql
+-- Purpose: Support journal-driven budget achievement engine
+-- =====================================================
+
+-- Budget header total (written by utils/budget_engine.py)
+ALTER TABLE budgets ADD COLUMN IF NOT EXISTS total_achieved DECIMAL(15,2) DEFAULT 0.00;
+
+-- Handlers write 'confirm', 006 only allowed 'confirmed'
+ALTER TABLE budgets DROP CONSTRAINT IF EXISTS budgets_status_check;
+ALTER TABLE budgets ADD CONSTRAINT budgets_status_check
+    CHECK (status IN ('draft', 'confirm', 'confirmed', 'revised', 'archived'));
+
+-- Lookups used by the recomputation
+CREATE INDEX IF NOT EXISTS idx_budgets_user_status ON budgets(user_id, status);
+CREATE INDEX IF NOT EXISTS idx_budget_lines_budget_analytical ON budget_lines(budget_id, analytical_account_id);
+
+DO $$
+BEGIN
+    IF to_regclass('journal_items') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS idx_journal_items_analytical_entry
+            ON journal_items(analytical_account_id, entry_id);
+    END IF;
+    IF to_regclass('journal_entries') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS idx_journal_entries_user_state_date
+            ON journal_entries(user_id, state, date);
+    END IF;
+END $$;
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 009_budget_achievements.sql completed successfully';
+END $$;
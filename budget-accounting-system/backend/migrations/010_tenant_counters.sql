@@ -0,0 +1,37 @@
+-- =====================================================
+-- Migration: 010_tenant_counters.sql
+-- Purpose: Dashboard counters table per tenant
+--          (read by /api/stats/summary when STATS_SUMMARY_SOURCE = 'counters')
+--
+-- Only the table is created here. The triggers that keep it current and
+-- the backfill are opt-in: optional/010_enable_tenant_counters.sql (run
+-- it by hand, run_migrations.py does not). They make every insert/delete
+-- on a tenant's budgets, contacts, products, orders, invoices and payments
+-- update that tenant's single tenant_counters row, whose row lock is held
+-- until commit - all of a tenant's concurrent writes to those tables are
+-- serialized on it. Enable them only together with 'counters' mode, when
+-- cheaper dashboard reads are worth that.
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS tenant_counters (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    budgets INTEGER NOT NULL DEFAULT 0,
+    contacts INTEGER NOT NULL DEFAULT 0,
+    products INTEGER NOT NULL DEFAULT 0,
+    purchase_orders INTEGER NOT NULL DEFAULT 0,
+    sales_orders INTEGER NOT NULL DEFAULT 0,
+    customer_invoices INTEGER NOT NULL DEFAULT 0,
+    invoice_total DECIMAL(15,2) NOT NULL DEFAULT 0,
+    invoice_amount_due DECIMAL(15,2) NOT NULL DEFAULT 0,
+    payments INTEGER NOT NULL DEFAULT 0,
+    payments_total DECIMAL(15,2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE tenant_counters IS 'Dashboard counters per tenant, kept current by triggers (optional/010_enable_tenant_counters.sql)';
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 010_tenant_counters.sql completed successfully';
+END $$;
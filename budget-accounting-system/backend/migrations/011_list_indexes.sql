@@ -0,0 +1,34 @@
+-- =====================================================
+-- Migration: 011_list_indexes.sql
+-- Purpose: Composite indexes backing keyset pagination of list endpoints
+--          (WHERE user_id = ? ORDER BY <sort> DESC, id DESC LIMIT n)
+-- =====================================================
+
+-- Contacts / products: newest first
+CREATE INDEX IF NOT EXISTS idx_contacts_user_created ON contacts(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_contacts_user_type_created ON contacts(user_id, contact_type, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_user_created ON products(user_id, created_at DESC, id DESC);
+
+-- Analytical accounts: by code
+CREATE INDEX IF NOT EXISTS idx_analytical_accounts_user_code ON analytical_accounts(user_id, code, id);
+
+-- Documents: by date, optionally filtered by state or partner
+CREATE INDEX IF NOT EXISTS idx_po_user_date ON purchase_orders(user_id, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_po_user_state_date ON purchase_orders(user_id, state, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_po_user_vendor_date ON purchase_orders(user_id, vendor_id, date DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_so_user_date ON sales_orders(user_id, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_so_user_state_date ON sales_orders(user_id, state, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_so_user_customer_date ON sales_orders(user_id, customer_id, date DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_ci_user_date ON customer_invoices(user_id, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_ci_user_state_date ON customer_invoices(user_id, state, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_ci_user_customer_date ON customer_invoices(user_id, customer_id, date DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_payments_user_date ON payments(user_id, date DESC, id DESC);
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 011_list_indexes.sql completed successfully';
+END $$;
@@ -0,0 +1,154 @@
+-- =====================================================
+-- Migration: 012_account_balance_snapshots.sql
+-- Purpose: Monthly debit/credit rollups per account, kept current by
+--          triggers, used by the trial balance (utils/ledger_snapshots.py)
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS account_period_balances (
+    user_id INTEGER NOT NULL,
+    account_id INTEGER NOT NULL REFERENCES chart_of_accounts(id) ON DELETE CASCADE,
+    period_start DATE NOT NULL,
+    debit DECIMAL(15,2) NOT NULL DEFAULT 0,
+    credit DECIMAL(15,2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, account_id, period_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_apb_account_period ON account_period_balances(account_id, period_start);
+
+-- Used by rebuild_snapshots() and the trial balance delta
+CREATE INDEX IF NOT EXISTS idx_journal_items_account_entry ON journal_items(account_id, entry_id);
+CREATE INDEX IF NOT EXISTS idx_journal_entries_user_state_date ON journal_entries(user_id, state, date);
+
+COMMENT ON TABLE account_period_balances IS 'Posted debit/credit per account and calendar month (period_start = 1st of month)';
+
+-- ===== APPLY ONE ITEM TO ITS (ACCOUNT, MONTH) =====
+-- Triggers add NEW and subtract OLD (p_sign 1 / -1) instead of recomputing
+-- the month from journal_items: a recompute runs in the writer's own
+-- snapshot and misses a concurrent transaction's uncommitted items, so the
+-- later commit would overwrite the earlier one's totals. The DO UPDATE
+-- below adds to the latest committed row version, so concurrent postings
+-- to one account and month add up. rebuild_snapshots() in
+-- utils/ledger_snapshots.py recomputes everything from the journal.
+CREATE OR REPLACE FUNCTION apply_account_period_delta(
+    p_user_id INTEGER, p_account_id INTEGER, p_day DATE,
+    p_debit DECIMAL, p_credit DECIMAL, p_sign INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_user_id IS NULL OR p_account_id IS NULL OR p_day IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO account_period_balances AS apb (user_id, account_id, period_start, debit, credit, updated_at)
+    VALUES (p_user_id, p_account_id, date_trunc('month', p_day)::date,
+            p_sign * COALESCE(p_debit, 0), p_sign * COALESCE(p_credit, 0), CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id, account_id, period_start) DO UPDATE
+    SET debit = apb.debit + EXCLUDED.debit,
+        credit = apb.credit + EXCLUDED.credit,
+        updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replaced by the delta function above (earlier version of this migration)
+DROP FUNCTION IF EXISTS refresh_account_period_balance(INTEGER, INTEGER, DATE);
+
+-- ===== JOURNAL ITEM CHANGES =====
+CREATE OR REPLACE FUNCTION journal_items_refresh_balances()
+RETURNS TRIGGER AS $$
+DECLARE
+    entry RECORD;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT user_id, date, state INTO entry FROM journal_entries WHERE id = OLD.entry_id;
+        -- Entry already gone (cascade delete): its BEFORE DELETE trigger removed the items
+        IF FOUND AND entry.state = 'posted' THEN
+            PERFORM apply_account_period_delta(entry.user_id, OLD.account_id, entry.date, OLD.debit, OLD.credit, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT user_id, date, state INTO entry FROM journal_entries WHERE id = NEW.entry_id;
+        IF FOUND AND entry.state = 'posted' THEN
+            PERFORM apply_account_period_delta(entry.user_id, NEW.account_id, entry.date, NEW.debit, NEW.credit, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_items_balances ON journal_items;
+CREATE TRIGGER journal_items_balances
+    AFTER INSERT OR UPDATE OF account_id, debit, credit, entry_id OR DELETE ON journal_items
+    FOR EACH ROW EXECUTE FUNCTION journal_items_refresh_balances();
+
+-- ===== JOURNAL ENTRY CHANGES (posting, cancelling, re-dating) =====
+CREATE OR REPLACE FUNCTION journal_entries_refresh_balances()
+RETURNS TRIGGER AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    IF OLD.state IS DISTINCT FROM 'posted' AND NEW.state IS DISTINCT FROM 'posted' THEN
+        RETURN NULL;
+    END IF;
+    -- Remove the items from the month the entry was in, add them where it is now
+    FOR item IN SELECT account_id, debit, credit FROM journal_items WHERE entry_id = NEW.id LOOP
+        IF OLD.state = 'posted' THEN
+            PERFORM apply_account_period_delta(OLD.user_id, item.account_id, OLD.date, item.debit, item.credit, -1);
+        END IF;
+        IF NEW.state = 'posted' THEN
+            PERFORM apply_account_period_delta(NEW.user_id, item.account_id, NEW.date, item.debit, item.credit, 1);
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_entries_balances ON journal_entries;
+CREATE TRIGGER journal_entries_balances
+    AFTER UPDATE OF state, date, user_id ON journal_entries
+    FOR EACH ROW EXECUTE FUNCTION journal_entries_refresh_balances();
+
+-- ===== JOURNAL ENTRY DELETION =====
+-- BEFORE DELETE, while the items still exist (they may be removed by cascade)
+CREATE OR REPLACE FUNCTION journal_entries_remove_balances()
+RETURNS TRIGGER AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    IF OLD.state = 'posted' THEN
+        FOR item IN SELECT account_id, debit, credit FROM journal_items WHERE entry_id = OLD.id LOOP
+            PERFORM apply_account_period_delta(OLD.user_id, item.account_id, OLD.date, item.debit, item.credit, -1);
+        END LOOP;
+    END IF;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_entries_balances_delete ON journal_entries;
+CREATE TRIGGER journal_entries_balances_delete
+    BEFORE DELETE ON journal_entries
+    FOR EACH ROW EXECUTE FUNCTION journal_entries_remove_balances();
+
+-- ===== BACKFILL =====
+INSERT INTO account_period_balances (user_id, account_id, period_start, debit, credit)
+SELECT
+    je.user_id,
+    ji.account_id,
+    date_trunc('month', je.date)::date,
+    COALESCE(SUM(ji.debit), 0),
+    COALESCE(SUM(ji.credit), 0)
+FROM journal_items ji
+JOIN journal_entries je ON je.id = ji.entry_id
+WHERE je.state = 'posted'
+  AND ji.account_id IS NOT NULL
+GROUP BY je.user_id, ji.account_id, date_trunc('month', je.date)
+ON CONFLICT (user_id, account_id, period_start) DO UPDATE
+SET debit = EXCLUDED.debit,
+    credit = EXCLUDED.credit,
+    updated_at = CURRENT_TIMESTAMP;
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 012_account_balance_snapshots.sql completed successfully';
+END $$;
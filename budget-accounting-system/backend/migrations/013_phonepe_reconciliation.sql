@@ -0,0 +1,47 @@
+-- =====================================================
+-- Migration: 013_phonepe_reconciliation.sql
+-- Purpose: Scheduling columns for the PhonePe reconciler
+--          (utils/reconciler.py polls PENDING transactions in the background)
+-- =====================================================
+
+-- Table was first created by create_phonepe_table.sql; keep this migration self-contained
+CREATE TABLE IF NOT EXISTS phonepe_transactions (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    invoice_id INTEGER NOT NULL REFERENCES customer_invoices(id),
+    merchant_transaction_id VARCHAR(100) UNIQUE NOT NULL,
+    phonepe_transaction_id VARCHAR(100),
+    amount DECIMAL(15,2) NOT NULL,
+    status VARCHAR(50) DEFAULT 'PENDING',
+    response_data TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ===== RECONCILIATION STATE =====
+ALTER TABLE phonepe_transactions ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE phonepe_transactions ADD COLUMN IF NOT EXISTS next_check_at TIMESTAMP;
+ALTER TABLE phonepe_transactions ADD COLUMN IF NOT EXISTS last_checked_at TIMESTAMP;
+ALTER TABLE phonepe_transactions ADD COLUMN IF NOT EXISTS last_error TEXT;
+
+COMMENT ON COLUMN phonepe_transactions.status IS 'PENDING, SUCCESS, FAILED or EXPIRED';
+COMMENT ON COLUMN phonepe_transactions.attempts IS 'Status checks made while PENDING (drives the backoff)';
+COMMENT ON COLUMN phonepe_transactions.next_check_at IS 'Earliest time the reconciler polls this transaction again';
+
+-- Existing rows become due immediately; new rows are due as soon as they are created
+UPDATE phonepe_transactions
+SET next_check_at = COALESCE(created_at, CURRENT_TIMESTAMP)
+WHERE next_check_at IS NULL;
+
+ALTER TABLE phonepe_transactions ALTER COLUMN next_check_at SET DEFAULT CURRENT_TIMESTAMP;
+
+-- Reconciler scan: only PENDING rows, in due order
+CREATE INDEX IF NOT EXISTS idx_phonepe_pending_due
+ON phonepe_transactions(next_check_at)
+WHERE status = 'PENDING';
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 013_phonepe_reconciliation.sql completed successfully';
+END $$;
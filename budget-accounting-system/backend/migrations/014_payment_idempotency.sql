@@ -0,0 +1,19 @@
+-- =====================================================
+-- Migration: 014_payment_idempotency.sql
+-- Purpose: Idempotency keys on payments so each gateway transaction /
+--          client retry is applied exactly once (utils/payments.py)
+-- =====================================================
+
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(150);
+
+COMMENT ON COLUMN payments.idempotency_key IS 'phonepe:<txn>, simulator:<txn> or client:<Idempotency-Key>; NULL = not deduplicated';
+
+-- Keys are unique per tenant; rows without a key (NULL) never conflict
+CREATE UNIQUE INDEX IF NOT EXISTS uq_payments_idempotency_key
+ON payments(user_id, idempotency_key);
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 014_payment_idempotency.sql completed successfully';
+END $$;
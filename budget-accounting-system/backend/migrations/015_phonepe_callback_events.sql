@@ -0,0 +1,37 @@
+-- =====================================================
+-- Migration: 015_phonepe_callback_events.sql
+-- Purpose: Durable queue of verified PhonePe server-to-server callbacks
+--          (written by /api/phonepe/callback, drained by utils/phonepe_callbacks.py)
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS phonepe_callback_events (
+    id SERIAL PRIMARY KEY,
+    merchant_transaction_id VARCHAR(100) NOT NULL,
+    code VARCHAR(50),
+    payload JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'processing', 'done', 'failed')),
+    outcome VARCHAR(20),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    claimed_at TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+COMMENT ON TABLE phonepe_callback_events IS 'PhonePe callbacks whose X-VERIFY checked out, applied asynchronously';
+COMMENT ON COLUMN phonepe_callback_events.outcome IS 'record_status() result: success, failed, pending, expired, mismatch or unchanged';
+
+-- Worker scan: queued events in arrival order
+CREATE INDEX IF NOT EXISTS idx_phonepe_callback_queued
+ON phonepe_callback_events(next_attempt_at, id)
+WHERE status = 'queued';
+
+CREATE INDEX IF NOT EXISTS idx_phonepe_callback_txn
+ON phonepe_callback_events(merchant_transaction_id);
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 015_phonepe_callback_events.sql completed successfully';
+END $$;
@@ -0,0 +1,158 @@
+-- =====================================================
+-- Migration: 016_budget_achievement_triggers.sql
+-- Purpose: Keep confirmed budgets' achieved amounts current when journal
+--          items are posted, edited, cancelled or deleted
+--          (same approach as account_period_balances in migration 012)
+-- =====================================================
+
+-- The triggers apply signed deltas (+NEW, -OLD) instead of recomputing
+-- from journal_items. A recompute runs in the writer's own snapshot and
+-- misses a concurrent transaction's uncommitted items, so the second commit
+-- would overwrite the first one's contribution. "achieved_amount =
+-- achieved_amount + delta" is re-evaluated on the latest row version after
+-- the row lock, so concurrent postings add up. recompute_budget() /
+-- recompute_tenant() in utils/budget_engine.py still rebuild from scratch.
+
+-- ===== APPLY ONE ITEM TO THE LINES COVERING (ANALYTICAL ACCOUNT, DAY) =====
+-- p_sign: 1 to add the item, -1 to remove it.
+-- Statuses must match CONFIRMED_STATUSES in utils/budget_engine.py.
+CREATE OR REPLACE FUNCTION apply_budget_achievement_delta(
+    p_user_id INTEGER, p_analytical_account_id INTEGER, p_day DATE,
+    p_debit DECIMAL, p_credit DECIMAL, p_sign INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_user_id IS NULL OR p_analytical_account_id IS NULL OR p_day IS NULL THEN
+        RETURN;
+    END IF;
+
+    UPDATE budget_lines bl
+    SET achieved_amount = COALESCE(bl.achieved_amount, 0) + p_sign * (
+        CASE WHEN bl.type = 'income'
+             THEN COALESCE(p_credit, 0) - COALESCE(p_debit, 0)
+             ELSE COALESCE(p_debit, 0) - COALESCE(p_credit, 0)
+        END
+    )
+    FROM budgets b
+    WHERE b.id = bl.budget_id
+      AND b.user_id = p_user_id
+      AND b.status IN ('confirm', 'confirmed')
+      AND p_day BETWEEN b.start_date AND b.end_date
+      AND bl.analytical_account_id = p_analytical_account_id;
+
+    UPDATE budgets b
+    SET total_achieved = COALESCE(b.total_achieved, 0) + p_sign * (
+        SELECT COALESCE(SUM(
+            CASE WHEN bl.type = 'income'
+                 THEN COALESCE(p_credit, 0) - COALESCE(p_debit, 0)
+                 ELSE COALESCE(p_debit, 0) - COALESCE(p_credit, 0)
+            END
+        ), 0)
+        FROM budget_lines bl
+        WHERE bl.budget_id = b.id AND bl.analytical_account_id = p_analytical_account_id
+    )
+    WHERE b.user_id = p_user_id
+      AND b.status IN ('confirm', 'confirmed')
+      AND p_day BETWEEN b.start_date AND b.end_date
+      AND EXISTS (
+          SELECT 1 FROM budget_lines
+          WHERE budget_id = b.id AND analytical_account_id = p_analytical_account_id
+      );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replaced by the delta function above (earlier version of this migration)
+DROP FUNCTION IF EXISTS refresh_budget_achievements(INTEGER, INTEGER, DATE);
+
+-- ===== JOURNAL ITEM CHANGES =====
+CREATE OR REPLACE FUNCTION journal_items_refresh_budgets()
+RETURNS TRIGGER AS $$
+DECLARE
+    entry RECORD;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT user_id, date, state INTO entry FROM journal_entries WHERE id = OLD.entry_id;
+        -- Entry already gone (cascade delete): its BEFORE DELETE trigger removed the items
+        IF FOUND AND entry.state = 'posted' THEN
+            PERFORM apply_budget_achievement_delta(entry.user_id, OLD.analytical_account_id, entry.date,
+                                                   OLD.debit, OLD.credit, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT user_id, date, state INTO entry FROM journal_entries WHERE id = NEW.entry_id;
+        IF FOUND AND entry.state = 'posted' THEN
+            PERFORM apply_budget_achievement_delta(entry.user_id, NEW.analytical_account_id, entry.date,
+                                                   NEW.debit, NEW.credit, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_items_budgets ON journal_items;
+CREATE TRIGGER journal_items_budgets
+    AFTER INSERT OR UPDATE OF analytical_account_id, debit, credit, entry_id OR DELETE ON journal_items
+    FOR EACH ROW EXECUTE FUNCTION journal_items_refresh_budgets();
+
+-- ===== JOURNAL ENTRY CHANGES (posting, cancelling, re-dating) =====
+CREATE OR REPLACE FUNCTION journal_entries_refresh_budgets()
+RETURNS TRIGGER AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    IF OLD.state IS DISTINCT FROM 'posted' AND NEW.state IS DISTINCT FROM 'posted' THEN
+        RETURN NULL;
+    END IF;
+    -- Remove the items where the entry was, add them where it is now
+    FOR item IN
+        SELECT analytical_account_id, debit, credit FROM journal_items
+        WHERE entry_id = NEW.id AND analytical_account_id IS NOT NULL
+    LOOP
+        IF OLD.state = 'posted' THEN
+            PERFORM apply_budget_achievement_delta(OLD.user_id, item.analytical_account_id, OLD.date,
+                                                   item.debit, item.credit, -1);
+        END IF;
+        IF NEW.state = 'posted' THEN
+            PERFORM apply_budget_achievement_delta(NEW.user_id, item.analytical_account_id, NEW.date,
+                                                   item.debit, item.credit, 1);
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_entries_budgets ON journal_entries;
+CREATE TRIGGER journal_entries_budgets
+    AFTER UPDATE OF state, date, user_id ON journal_entries
+    FOR EACH ROW EXECUTE FUNCTION journal_entries_refresh_budgets();
+
+-- ===== JOURNAL ENTRY DELETION =====
+-- BEFORE DELETE, while the items still exist (they may be removed by cascade)
+CREATE OR REPLACE FUNCTION journal_entries_remove_budgets()
+RETURNS TRIGGER AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    IF OLD.state = 'posted' THEN
+        FOR item IN
+            SELECT analytical_account_id, debit, credit FROM journal_items
+            WHERE entry_id = OLD.id AND analytical_account_id IS NOT NULL
+        LOOP
+            PERFORM apply_budget_achievement_delta(OLD.user_id, item.analytical_account_id, OLD.date,
+                                                   item.debit, item.credit, -1);
+        END LOOP;
+    END IF;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS journal_entries_budgets_delete ON journal_entries;
+CREATE TRIGGER journal_entries_budgets_delete
+    BEFORE DELETE ON journal_entries
+    FOR EACH ROW EXECUTE FUNCTION journal_entries_remove_budgets();
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 016_budget_achievement_triggers.sql completed successfully';
+END $$;
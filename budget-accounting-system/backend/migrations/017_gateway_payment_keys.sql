@@ -0,0 +1,17 @@
+-- =====================================================
+-- Migration: 017_gateway_payment_keys.sql
+-- Purpose: Gateway idempotency keys are unique across tenants, so one
+--          PhonePe transaction can only ever credit one invoice
+--          (migration 014 only made keys unique per tenant)
+-- =====================================================
+
+-- Must match GATEWAY_KEY_PATTERN in utils/payments.py
+CREATE UNIQUE INDEX IF NOT EXISTS uq_payments_gateway_key
+ON payments(idempotency_key)
+WHERE idempotency_key LIKE 'phonepe:%';
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Migration 017_gateway_payment_keys.sql completed successfully';
+END $$;
@@ -0,0 +1,173 @@
+-- =====================================================
+-- Optional migration: optional/010_enable_tenant_counters.sql
+-- Purpose: Triggers + backfill for tenant_counters (migration 010).
+--          Not run by run_migrations.py; run it by hand together with
+--          STATS_SUMMARY_SOURCE = 'counters':
+--              psql -d budget_system -f migrations/optional/010_enable_tenant_counters.sql
+--
+-- Trade-off: every insert/delete on budgets, contacts, products, orders,
+-- customer_invoices and payments updates the tenant's one tenant_counters
+-- row, and that row lock is held until commit. A tenant's concurrent
+-- writes to these tables therefore run one after another. In exchange the
+-- dashboard summary is a primary-key read instead of an aggregate.
+--
+-- To turn it off again (then switch back to 'live'):
+--     DROP TRIGGER IF EXISTS budgets_tenant_counter ON budgets;
+--     DROP TRIGGER IF EXISTS contacts_tenant_counter ON contacts;
+--     DROP TRIGGER IF EXISTS products_tenant_counter ON products;
+--     DROP TRIGGER IF EXISTS purchase_orders_tenant_counter ON purchase_orders;
+--     DROP TRIGGER IF EXISTS sales_orders_tenant_counter ON sales_orders;
+--     DROP TRIGGER IF EXISTS customer_invoices_tenant_counter ON customer_invoices;
+--     DROP TRIGGER IF EXISTS payments_tenant_counter ON payments;
+-- =====================================================
+
+-- ===== ROW COUNT TRIGGER (budgets, contacts, products, orders) =====
+-- TG_ARGV[0] = counter column to bump
+CREATE OR REPLACE FUNCTION bump_tenant_counter()
+RETURNS TRIGGER AS $$
+DECLARE
+    counter TEXT := TG_ARGV[0];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_counters (user_id) VALUES (NEW.user_id) ON CONFLICT (user_id) DO NOTHING;
+        EXECUTE format('UPDATE tenant_counters SET %I = %I + 1, updated_at = CURRENT_TIMESTAMP WHERE user_id = $1', counter, counter)
+            USING NEW.user_id;
+        RETURN NEW;
+    ELSIF TG_OP = 'DELETE' THEN
+        EXECUTE format('UPDATE tenant_counters SET %I = GREATEST(%I - 1, 0), updated_at = CURRENT_TIMESTAMP WHERE user_id = $1', counter, counter)
+            USING OLD.user_id;
+        RETURN OLD;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===== CUSTOMER INVOICES (count, total, amount due) =====
+-- Fires on every UPDATE: amount_due also changes through columns that are
+-- not in the SET list (paid_via_*) and through BEFORE triggers, so the
+-- values themselves are compared instead of relying on UPDATE OF
+CREATE OR REPLACE FUNCTION bump_invoice_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.user_id IS NOT DISTINCT FROM NEW.user_id
+       AND OLD.total IS NOT DISTINCT FROM NEW.total
+       AND OLD.amount_due IS NOT DISTINCT FROM NEW.amount_due THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE tenant_counters
+        SET customer_invoices = GREATEST(customer_invoices - 1, 0),
+            invoice_total = invoice_total - COALESCE(OLD.total, 0),
+            invoice_amount_due = invoice_amount_due - COALESCE(OLD.amount_due, 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = OLD.user_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO tenant_counters (user_id) VALUES (NEW.user_id) ON CONFLICT (user_id) DO NOTHING;
+        UPDATE tenant_counters
+        SET customer_invoices = customer_invoices + 1,
+            invoice_total = invoice_total + COALESCE(NEW.total, 0),
+            invoice_amount_due = invoice_amount_due + COALESCE(NEW.amount_due, 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = NEW.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===== PAYMENTS (count, amount) =====
+CREATE OR REPLACE FUNCTION bump_payment_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE tenant_counters
+        SET payments = GREATEST(payments - 1, 0),
+            payments_total = payments_total - COALESCE(OLD.amount, 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = OLD.user_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO tenant_counters (user_id) VALUES (NEW.user_id) ON CONFLICT (user_id) DO NOTHING;
+        UPDATE tenant_counters
+        SET payments = payments + 1,
+            payments_total = payments_total + COALESCE(NEW.amount, 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = NEW.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===== TRIGGERS =====
+DROP TRIGGER IF EXISTS budgets_tenant_counter ON budgets;
+CREATE TRIGGER budgets_tenant_counter
+    AFTER INSERT OR DELETE ON budgets
+    FOR EACH ROW EXECUTE FUNCTION bump_tenant_counter('budgets');
+
+DROP TRIGGER IF EXISTS contacts_tenant_counter ON contacts;
+CREATE TRIGGER contacts_tenant_counter
+    AFTER INSERT OR DELETE ON contacts
+    FOR EACH ROW EXECUTE FUNCTION bump_tenant_counter('contacts');
+
+DROP TRIGGER IF EXISTS products_tenant_counter ON products;
+CREATE TRIGGER products_tenant_counter
+    AFTER INSERT OR DELETE ON products
+    FOR EACH ROW EXECUTE FUNCTION bump_tenant_counter('products');
+
+DROP TRIGGER IF EXISTS purchase_orders_tenant_counter ON purchase_orders;
+CREATE TRIGGER purchase_orders_tenant_counter
+    AFTER INSERT OR DELETE ON purchase_orders
+    FOR EACH ROW EXECUTE FUNCTION bump_tenant_counter('purchase_orders');
+
+DROP TRIGGER IF EXISTS sales_orders_tenant_counter ON sales_orders;
+CREATE TRIGGER sales_orders_tenant_counter
+    AFTER INSERT OR DELETE ON sales_orders
+    FOR EACH ROW EXECUTE FUNCTION bump_tenant_counter('sales_orders');
+
+DROP TRIGGER IF EXISTS customer_invoices_tenant_counter ON customer_invoices;
+CREATE TRIGGER customer_invoices_tenant_counter
+    AFTER INSERT OR UPDATE OR DELETE ON customer_invoices
+    FOR EACH ROW EXECUTE FUNCTION bump_invoice_counters();
+
+DROP TRIGGER IF EXISTS payments_tenant_counter ON payments;
+CREATE TRIGGER payments_tenant_counter
+    AFTER INSERT OR UPDATE OF amount, user_id OR DELETE ON payments
+    FOR EACH ROW EXECUTE FUNCTION bump_payment_counters();
+
+-- ===== BACKFILL =====
+INSERT INTO tenant_counters (
+    user_id, budgets, contacts, products, purchase_orders, sales_orders,
+    customer_invoices, invoice_total, invoice_amount_due, payments, payments_total
+)
+SELECT
+    u.id,
+    (SELECT COUNT(*) FROM budgets WHERE user_id = u.id),
+    (SELECT COUNT(*) FROM contacts WHERE user_id = u.id),
+    (SELECT COUNT(*) FROM products WHERE user_id = u.id),
+    (SELECT COUNT(*) FROM purchase_orders WHERE user_id = u.id),
+    (SELECT COUNT(*) FROM sales_orders WHERE user_id = u.id),
+    (SELECT COUNT(*) FROM customer_invoices WHERE user_id = u.id),
+    (SELECT COALESCE(SUM(total), 0) FROM customer_invoices WHERE user_id = u.id),
+    (SELECT COALESCE(SUM(amount_due), 0) FROM customer_invoices WHERE user_id = u.id),
+    (SELECT COUNT(*) FROM payments WHERE user_id = u.id),
+    (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE user_id = u.id)
+FROM users u
+ON CONFLICT (user_id) DO UPDATE SET
+    budgets = EXCLUDED.budgets,
+    contacts = EXCLUDED.contacts,
+    products = EXCLUDED.products,
+    purchase_orders = EXCLUDED.purchase_orders,
+    sales_orders = EXCLUDED.sales_orders,
+    customer_invoices = EXCLUDED.customer_invoices,
+    invoice_total = EXCLUDED.invoice_total,
+    invoice_amount_due = EXCLUDED.invoice_amount_due,
+    payments = EXCLUDED.payments,
+    payments_total = EXCLUDED.payments_total,
+    updated_at = CURRENT_TIMESTAMP;
+
+-- Migration completed
+DO $$
+BEGIN
+    RAISE NOTICE '✅ optional/010_enable_tenant_counters.sql completed successfully';
+END $$;
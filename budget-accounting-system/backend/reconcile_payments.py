@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Run the PhonePe reconciler outside the web app
+
+Usage:
+    python reconcile_payments.py --once                      # one cycle, then exit
+    python reconcile_payments.py                             # keep polling every PHONEPE_RECONCILE_INTERVAL
+    python reconcile_payments.py --once --gateway http://127.0.0.1:8090   # against tools/phonepe_stub_gateway.py
+"""
+import argparse
+import json
+import logging
+import time
+
+from utils.phonepe_client import PhonePeClient
+from utils.reconciler import PaymentReconciler
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile PENDING PhonePe transactions')
+    parser.add_argument('--once', action='store_true', help='run a single cycle and exit')
+    parser.add_argument('--gateway', help='PhonePe base URL (defaults to Config.PHONEPE_BASE_URL)')
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--rate', type=float, help='max status calls per second')
+    args = parser.parse_args()
+
+    reconciler = PaymentReconciler(
+        client=PhonePeClient(base_url=args.gateway),
+        batch_size=args.batch_size,
+        rate=args.rate
+    )
+
+    if args.once:
+        summary = reconciler.run_once()
+        print(json.dumps(summary, indent=2))
+        return
+
+    reconciler.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("🛑 Stopping reconciler...")
+        reconciler.stop()
+
+
+if __name__ == '__main__':
+    main()
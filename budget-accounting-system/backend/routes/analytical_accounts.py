@@ -6,8 +6,10 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.db import execute_query, execute_insert, execute_update
+from utils.db import execute_query, execute_insert, execute_update, transaction
 from utils.auth import token_required
+from utils.pagination import ListSpec, PaginationError, fetch_page, page_headers
+from utils.rule_index import invalidate_rule_index
 import logging
 
 # ===== BLUEPRINT SETUP =====
@@ -17,33 +19,46 @@ logger = logging.getLogger(__name__)
 # ===== HELPER FUNCTIONS =====
 # (No helper functions needed - using @token_required decorator)
 
+# ===== LIST DEFINITION =====
+ANALYTICAL_ACCOUNTS_LIST = ListSpec(
+    fields={
+        'id': 'id',
+        'name': 'name',
+        'code': 'code',
+        'created_at': 'created_at'
+    },
+    from_sql="FROM analytical_accounts",
+    tenant_column='user_id',
+    sort=('code', 'text'),
+    id_column='id',
+    descending=False
+)
+
 # ===== ANALYTICAL ACCOUNTS ENDPOINTS =====
 
 @analytical_accounts_bp.route('/analytical-accounts', methods=['GET'])
 @token_required
 def get_analytical_accounts(current_user):
     """
-    Get all analytical accounts for logged-in user
-    Returns: JSON with accounts array
+    Get analytical accounts for logged-in user (by code)
+    Query: limit, cursor, fields
+    Returns: JSON with accounts array and next_cursor
     """
     try:
         user_id = current_user['id']
         
-        query = """
-            SELECT id, name, code, created_at
-            FROM analytical_accounts
-            WHERE user_id = %s
-            ORDER BY code ASC
-        """
-        accounts = execute_query(query, (user_id,))
+        accounts, next_cursor = fetch_page(ANALYTICAL_ACCOUNTS_LIST, user_id, request.args)
         
         logger.info(f"📋 Retrieved {len(accounts)} analytical accounts for user {user_id}")
         
         return jsonify({
             'success': True,
-            'accounts': accounts
-        }), 200
+            'accounts': accounts,
+            'next_cursor': next_cursor
+        }), 200, page_headers(next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"❌ Error getting analytical accounts: {str(e)}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -78,12 +93,6 @@ def create_analytical_account(current_user):
         
         # Check if code already exists for this user
         check_query = "SELECT id FROM analytical_accounts WHERE code = %s AND user_id = %s"
-        existing = execute_query(check_query, (code, user_id))
-        
-        if existing:
-            return jsonify({'success': False, 'message': 'Account code already exists'}), 400
-        
-        logger.info(f"✅ Validated - Code: {code}, Name: {name}")
         
         # Insert analytical account
         query = """
@@ -92,7 +101,16 @@ def create_analytical_account(current_user):
             RETURNING id
         """
         params = (user_id, name, code)
-        result = execute_insert(query, params)
+        
+        with transaction() as cur:
+            existing = execute_query(check_query, (code, user_id), cur=cur)
+            
+            if existing:
+                return jsonify({'success': False, 'message': 'Account code already exists'}), 400
+            
+            logger.info(f"✅ Validated - Code: {code}, Name: {name}")
+            
+            result = execute_insert(query, params, cur=cur)
         
         if result:
             account_id = result[0]['id']
@@ -124,13 +142,6 @@ def update_analytical_account(current_user, account_id):
     try:
         user_id = current_user['id']
         
-        # Check if account belongs to user
-        check_query = "SELECT id FROM analytical_accounts WHERE id = %s AND user_id = %s"
-        existing = execute_query(check_query, (account_id, user_id))
-        
-        if not existing:
-            return jsonify({'success': False, 'message': 'Analytical account not found'}), 404
-        
         data = request.get_json()
         
         # Validate required fields with None checks
@@ -148,10 +159,6 @@ def update_analytical_account(current_user, account_id):
         
         # Check if code already exists for this user (excluding current account)
         check_query = "SELECT id FROM analytical_accounts WHERE code = %s AND user_id = %s AND id != %s"
-        existing_code = execute_query(check_query, (code, user_id, account_id))
-        
-        if existing_code:
-            return jsonify({'success': False, 'message': 'Account code already exists'}), 400
         
         # Update analytical account
         query = """
@@ -160,8 +167,19 @@ def update_analytical_account(current_user, account_id):
             WHERE id = %s AND user_id = %s
         """
         params = (name, code, account_id, user_id)
-        execute_update(query, params)
         
+        with transaction() as cur:
+            existing_code = execute_query(check_query, (code, user_id, account_id), cur=cur)
+            
+            if existing_code:
+                return jsonify({'success': False, 'message': 'Account code already exists'}), 400
+            
+            # The ownership check is the UPDATE's own WHERE clause
+            if not execute_update(query, params, cur=cur):
+                return jsonify({'success': False, 'message': 'Analytical account not found'}), 404
+        
+        # Auto analytical rules carry the account name/code
+        invalidate_rule_index(user_id)
         logger.info(f"✅ Analytical account updated: ID {account_id}, Code: {code}, Name: {name}")
         
         return jsonify({
@@ -184,9 +202,11 @@ def delete_analytical_account(current_user, account_id):
     try:
         user_id = current_user['id']
         
-        # Check if account belongs to user and get details for logging
-        check_query = "SELECT name, code FROM analytical_accounts WHERE id = %s AND user_id = %s"
-        existing = execute_query(check_query, (account_id, user_id))
+        # Delete analytical account (returns details for logging; empty if not owned by user)
+        query = "DELETE FROM analytical_accounts WHERE id = %s AND user_id = %s RETURNING name, code"
+        
+        with transaction() as cur:
+            existing = execute_query(query, (account_id, user_id), cur=cur)
         
         if not existing:
             return jsonify({'success': False, 'message': 'Analytical account not found'}), 404
@@ -194,10 +214,8 @@ def delete_analytical_account(current_user, account_id):
         account_name = existing[0]['name']
         account_code = existing[0]['code']
         
-        # Delete analytical account
-        query = "DELETE FROM analytical_accounts WHERE id = %s AND user_id = %s"
-        execute_update(query, (account_id, user_id))
-        
+        # Auto analytical rules carry the account name/code
+        invalidate_rule_index(user_id)
         logger.info(f"🗑️ Analytical account deleted: ID {account_id}, Code: {account_code}, Name: {account_name}")
         
         return jsonify({
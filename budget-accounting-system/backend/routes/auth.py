@@ -1,6 +1,5 @@
 # ===== AUTHENTICATION ROUTES =====
 from flask import Blueprint, request, jsonify
-import bcrypt
 import jwt
 from datetime import datetime, timedelta
 import sys
@@ -11,7 +10,8 @@ import re
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import Config
-from utils.db import execute_query, execute_update, execute_insert
+from utils.db import execute_query, execute_update, execute_insert, transaction
+from utils.passwords import hasher, ip_throttle, email_throttle, HasherBusy
 import logging
 
 # ===== BLUEPRINT SETUP =====
@@ -21,21 +21,54 @@ logger = logging.getLogger(__name__)
 # ===== HELPER FUNCTIONS =====
 
 def hash_password(password):
-    """Hash password using bcrypt"""
-    salt = bcrypt.gensalt(rounds=12)
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    """Hash password using bcrypt (in the hashing pool, at Config.PASSWORD_HASH_ROUNDS)"""
+    return hasher.hash(password)
 
 def verify_password(password, password_hash):
-    """Verify password against hash"""
+    """Verify password against hash (in the hashing pool)"""
+    return hasher.verify(password, password_hash)
+
+def rehash_if_needed(user_id, password, password_hash):
+    """Upgrade a hash made with another bcrypt cost, now that the password is known"""
+    if not hasher.needs_rehash(password_hash):
+        return
     try:
-        return bcrypt.checkpw(
-            password.encode('utf-8'), 
-            password_hash.encode('utf-8')
+        new_hash = hash_password(password)
+        # Conditional: a concurrent password change wins over the upgrade
+        execute_update(
+            "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+            (new_hash, user_id, password_hash)
         )
+        logger.info(f"🔐 Password hash of user {user_id} upgraded to cost {hasher.rounds}")
     except Exception as e:
-        logger.error(f"❌ Password verification error: {str(e)}")
-        return False
+        # The login itself already succeeded; try again next time
+        logger.warning(f"⚠️ Password rehash skipped for user {user_id}: {str(e)}")
+
+def throttled_response(retry_after):
+    """429 for a client IP / email that made too many attempts"""
+    response = jsonify({
+        'success': False,
+        'message': 'Too many attempts, please try again later'
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def signup_rejected(client_ip, message):
+    """400 for a failed signup; only failures count against the client IP"""
+    ip_throttle.record(client_ip)
+    return jsonify({
+        'success': False,
+        'message': message
+    }), 400
+
+def busy_response():
+    """503 when the hashing pool is saturated"""
+    response = jsonify({
+        'success': False,
+        'message': 'Server busy, please retry shortly'
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 def generate_token(user_data):
     """
@@ -93,10 +126,17 @@ def validate_email(email):
 def signup():
     """Register new user account"""
     try:
+        # Throttle per client IP before any bcrypt work (failed signups count)
+        client_ip = request.remote_addr
+        retry_after = ip_throttle.retry_after(client_ip)
+        if retry_after:
+            logger.warning(f"⚠️ Signup throttled for {client_ip}")
+            return throttled_response(retry_after)
+        
         # Get request data
         data = request.get_json()
         
-        logger.info(f"📝 Signup attempt - Data received: {data}")
+        logger.info(f"📝 Signup attempt for: {data.get('email') if data else None}")
         
         # Get and validate required fields
         name = data.get('name', '').strip() if data.get('name') else ''
@@ -111,34 +151,19 @@ def signup():
         
         # Validate required fields
         if not name:
-            return jsonify({
-                'success': False,
-                'message': 'Name is required'
-            }), 400
+            return signup_rejected(client_ip, 'Name is required')
         
         if not email:
-            return jsonify({
-                'success': False,
-                'message': 'Email is required'
-            }), 400
+            return signup_rejected(client_ip, 'Email is required')
         
         if '@' not in email:
-            return jsonify({
-                'success': False,
-                'message': 'Invalid email format'
-            }), 400
+            return signup_rejected(client_ip, 'Invalid email format')
         
         if not password:
-            return jsonify({
-                'success': False,
-                'message': 'Password is required'
-            }), 400
+            return signup_rejected(client_ip, 'Password is required')
         
         if len(password) < 6:
-            return jsonify({
-                'success': False,
-                'message': 'Password must be at least 6 characters'
-            }), 400
+            return signup_rejected(client_ip, 'Password must be at least 6 characters')
         
         # Check if email already exists
         check_query = "SELECT id FROM users WHERE email = %s"
@@ -146,12 +171,9 @@ def signup():
         
         if existing_user and len(existing_user) > 0:
             logger.warning(f"⚠️ Email already exists: {email}")
-            return jsonify({
-                'success': False,
-                'message': 'Email already registered'
-            }), 400
+            return signup_rejected(client_ip, 'Email already registered')
         
-        # Hash password
+        # Hash password (outside the transaction - no connection held while hashing)
         logger.info("🔐 Hashing password...")
         hashed_password = hash_password(password)
         
@@ -164,12 +186,22 @@ def signup():
         params = (name, email, hashed_password, company_name, gstin, 'portal_user')
         
         logger.info("💾 Inserting user into database...")
-        result = execute_insert(insert_query, params)
+        with transaction() as cur:
+            # Re-check inside the transaction to close the race with a concurrent signup
+            if execute_query(check_query, (email,), cur=cur):
+                logger.warning(f"⚠️ Email already exists: {email}")
+                return signup_rejected(client_ip, 'Email already registered')
+            
+            result = execute_insert(insert_query, params, cur=cur)
         
         if result and len(result) > 0:
             user_id = result[0]['id']
             logger.info(f"✅ User created successfully with ID: {user_id}")
             
+            # Imported here: utils.auth imports this module
+            from utils.auth import invalidate_user
+            invalidate_user(user_id)
+            
             return jsonify({
                 'success': True,
                 'message': 'Account created successfully',
@@ -178,6 +210,8 @@ def signup():
         else:
             raise Exception("Failed to retrieve user ID after insert")
         
+    except HasherBusy:
+        return busy_response()
     except Exception as e:
         logger.error(f"❌ Signup error: {str(e)}")
         import traceback
@@ -206,12 +240,22 @@ def login():
                 'message': 'Email and password are required'
             }), 400
         
+        # Throttle per client IP and per email before any bcrypt work
+        client_ip = request.remote_addr
+        email_key = email.strip().lower()
+        retry_after = max(ip_throttle.retry_after(client_ip), email_throttle.retry_after(email_key))
+        if retry_after:
+            logger.warning(f"⚠️ Login throttled for {email} from {client_ip}")
+            return throttled_response(retry_after)
+        
         # Check if user exists
         query = "SELECT id, name, email, password_hash, role FROM users WHERE email = %s"
         result = execute_query(query, (email,))
         
         if not result or len(result) == 0:
             logger.warning(f"⚠️ User not found: {email}")
+            ip_throttle.record(client_ip)
+            email_throttle.record(email_key)
             return jsonify({
                 'success': False,
                 'message': 'Invalid email or password'
@@ -220,21 +264,21 @@ def login():
         user = result[0]
         logger.info(f"✅ User found: {user['email']}")
         
-        # Debug: Print password hash (remove in production!)
-        logger.info(f"🔍 Password hash from DB: {user['password_hash'][:50]}...")
-        logger.info(f"🔍 Password to verify: {password}")
-        
         # Verify password
         is_valid = verify_password(password, user['password_hash'])
-        logger.info(f"🔍 Password verification result: {is_valid}")
         
         if not is_valid:
             logger.warning(f"❌ Invalid password for: {email}")
+            ip_throttle.record(client_ip)
+            email_throttle.record(email_key)
             return jsonify({
                 'success': False,
                 'message': 'Invalid email or password'
             }), 401
         
+        email_throttle.reset(email_key)
+        rehash_if_needed(user['id'], password, user['password_hash'])
+        
         # Generate token
         user_data = {
             'user_id': user['id'],
@@ -243,6 +287,10 @@ def login():
         }
         token = generate_token(user_data)
         
+        # Start the session from a fresh users row
+        from utils.auth import invalidate_user
+        invalidate_user(user['id'])
+        
         logger.info(f"✅ Login successful for: {email}")
         
         return jsonify({
@@ -257,6 +305,8 @@ def login():
             }
         }), 200
         
+    except HasherBusy:
+        return busy_response()
     except Exception as e:
         logger.error(f"❌ Login error: {str(e)}")
         return jsonify({
@@ -277,45 +327,33 @@ def verify():
         JSON response with user data if token is valid
     """
     try:
-        # Get token from Authorization header
-        auth_header = request.headers.get('Authorization')
+        # Claims decoded once per request by the auth middleware
+        # (imported here: utils.auth imports this module)
+        from utils.auth import bearer_token, request_claims, is_portal, load_user
         
-        if not auth_header:
+        if not bearer_token():
             return jsonify({
                 'success': False,
                 'message': 'Authorization header missing'
             }), 401
         
-        # Extract token from "Bearer <token>"
-        try:
-            token = auth_header.split(' ')[1]
-        except IndexError:
-            return jsonify({
-                'success': False,
-                'message': 'Invalid authorization header format'
-            }), 401
-        
-        # Verify token
-        payload = verify_token(token)
+        payload = request_claims()
         
-        if not payload:
+        if not payload or is_portal(payload):
             return jsonify({
                 'success': False,
                 'message': 'Invalid or expired token'
             }), 401
         
-        # Get user details from database
-        user_query = "SELECT id, name, email, role FROM users WHERE id = %s"
-        users = execute_query(user_query, (payload['user_id'],))
+        # Get user details (cached)
+        user = load_user(payload['user_id'])
         
-        if not users:
+        if not user:
             return jsonify({
                 'success': False,
                 'message': 'User not found'
             }), 401
         
-        user = users[0]
-        
         logger.info(f"✅ 🔐 Token verified for user: {user['email']}")
         
         return jsonify({
@@ -6,34 +6,15 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.db import execute_query, execute_insert, execute_update
-from routes.auth import verify_token
+from utils.db import execute_query, execute_insert, execute_update, transaction
+from utils.auth import current_user_id
+from utils.rule_index import get_rule_index, invalidate_rule_index
 import logging
 
 # ===== BLUEPRINT SETUP =====
 auto_analytical_models_bp = Blueprint('auto_analytical_models', __name__)
 logger = logging.getLogger(__name__)
 
-# ===== HELPER FUNCTIONS =====
-
-def get_user_from_token():
-    """
-    Extract user_id from JWT token in Authorization header
-    Returns: user_id if valid, None if invalid
-    """
-    try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return None
-        
-        token = auth_header.split(' ')[1]
-        payload = verify_token(token)
-        
-        return payload['user_id'] if payload else None
-    except Exception as e:
-        logger.error(f"❌ Error getting user from token: {str(e)}")
-        return None
-
 # ===== AUTO ANALYTICAL MODELS ENDPOINTS =====
 
 @auto_analytical_models_bp.route('/auto-analytical-models', methods=['GET'])
@@ -43,7 +24,7 @@ def get_auto_analytical_models():
     Returns: JSON with models array including partner and analytical account names
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
@@ -85,7 +66,7 @@ def create_auto_analytical_model():
     Returns: JSON with success status and model_id
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
@@ -98,29 +79,17 @@ def create_auto_analytical_model():
         if not analytical_account_id:
             return jsonify({'success': False, 'message': 'Analytical account is required'}), 400
         
-        # Verify analytical account belongs to user
-        check_query = "SELECT id FROM analytical_accounts WHERE id = %s AND user_id = %s"
-        account_exists = execute_query(check_query, (analytical_account_id, user_id))
-        if not account_exists:
-            return jsonify({'success': False, 'message': 'Invalid analytical account'}), 400
-        
         # Optional fields
         partner_id = data.get('partner_id') or None
         product_category = data.get('product_category') or None
         status = data.get('status', 'draft')
         
-        # Validate partner if provided
-        if partner_id:
-            partner_check = "SELECT id FROM contacts WHERE id = %s AND user_id = %s"
-            partner_exists = execute_query(partner_check, (partner_id, user_id))
-            if not partner_exists:
-                return jsonify({'success': False, 'message': 'Invalid partner'}), 400
-        
         # Validate status
         if status not in ['draft', 'confirm', 'cancelled']:
             status = 'draft'
         
-        logger.info(f"✅ Validated - Partner: {partner_id}, Category: {product_category}, Analytics: {analytical_account_id}")
+        check_query = "SELECT id FROM analytical_accounts WHERE id = %s AND user_id = %s"
+        partner_check = "SELECT id FROM contacts WHERE id = %s AND user_id = %s"
         
         # Insert auto analytical model
         query = """
@@ -129,10 +98,26 @@ def create_auto_analytical_model():
             RETURNING id
         """
         params = (user_id, partner_id, product_category, analytical_account_id, status)
-        result = execute_insert(query, params)
+        
+        with transaction() as cur:
+            # Verify analytical account belongs to user
+            account_exists = execute_query(check_query, (analytical_account_id, user_id), cur=cur)
+            if not account_exists:
+                return jsonify({'success': False, 'message': 'Invalid analytical account'}), 400
+            
+            # Validate partner if provided
+            if partner_id:
+                partner_exists = execute_query(partner_check, (partner_id, user_id), cur=cur)
+                if not partner_exists:
+                    return jsonify({'success': False, 'message': 'Invalid partner'}), 400
+            
+            logger.info(f"✅ Validated - Partner: {partner_id}, Category: {product_category}, Analytics: {analytical_account_id}")
+            
+            result = execute_insert(query, params, cur=cur)
         
         if result:
             model_id = result[0]['id']
+            invalidate_rule_index(user_id)
             logger.info(f"✅ Auto analytical model created: ID {model_id}")
             
             return jsonify({
@@ -158,46 +143,27 @@ def update_auto_analytical_model(model_id):
     Returns: JSON with success status
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
-        # Check if model belongs to user
-        check_query = "SELECT id FROM auto_analytical_models WHERE id = %s AND user_id = %s"
-        existing = execute_query(check_query, (model_id, user_id))
-        
-        if not existing:
-            return jsonify({'success': False, 'message': 'Auto analytical model not found'}), 404
-        
         data = request.get_json()
         
-        # Validate required fields
         analytical_account_id = data.get('analytical_account_id')
-        if not analytical_account_id:
-            return jsonify({'success': False, 'message': 'Analytical account is required'}), 400
-        
-        # Verify analytical account belongs to user
-        account_check = "SELECT id FROM analytical_accounts WHERE id = %s AND user_id = %s"
-        account_exists = execute_query(account_check, (analytical_account_id, user_id))
-        if not account_exists:
-            return jsonify({'success': False, 'message': 'Invalid analytical account'}), 400
         
         # Optional fields
         partner_id = data.get('partner_id') or None
         product_category = data.get('product_category') or None
         status = data.get('status', 'draft')
         
-        # Validate partner if provided
-        if partner_id:
-            partner_check = "SELECT id FROM contacts WHERE id = %s AND user_id = %s"
-            partner_exists = execute_query(partner_check, (partner_id, user_id))
-            if not partner_exists:
-                return jsonify({'success': False, 'message': 'Invalid partner'}), 400
-        
         # Validate status
         if status not in ['draft', 'confirm', 'cancelled']:
             status = 'draft'
         
+        check_query = "SELECT id FROM auto_analytical_models WHERE id = %s AND user_id = %s FOR UPDATE"
+        account_check = "SELECT id FROM analytical_accounts WHERE id = %s AND user_id = %s"
+        partner_check = "SELECT id FROM contacts WHERE id = %s AND user_id = %s"
+        
         # Update auto analytical model
         query = """
             UPDATE auto_analytical_models
@@ -205,8 +171,32 @@ def update_auto_analytical_model(model_id):
             WHERE id = %s AND user_id = %s
         """
         params = (partner_id, product_category, analytical_account_id, status, model_id, user_id)
-        execute_update(query, params)
         
+        with transaction() as cur:
+            # Check if model belongs to user
+            existing = execute_query(check_query, (model_id, user_id), cur=cur)
+            
+            if not existing:
+                return jsonify({'success': False, 'message': 'Auto analytical model not found'}), 404
+            
+            # Validate required fields
+            if not analytical_account_id:
+                return jsonify({'success': False, 'message': 'Analytical account is required'}), 400
+            
+            # Verify analytical account belongs to user
+            account_exists = execute_query(account_check, (analytical_account_id, user_id), cur=cur)
+            if not account_exists:
+                return jsonify({'success': False, 'message': 'Invalid analytical account'}), 400
+            
+            # Validate partner if provided
+            if partner_id:
+                partner_exists = execute_query(partner_check, (partner_id, user_id), cur=cur)
+                if not partner_exists:
+                    return jsonify({'success': False, 'message': 'Invalid partner'}), 400
+            
+            execute_update(query, params, cur=cur)
+        
+        invalidate_rule_index(user_id)
         logger.info(f"✅ Auto analytical model updated: ID {model_id}")
         
         return jsonify({
@@ -226,21 +216,17 @@ def delete_auto_analytical_model(model_id):
     Returns: JSON with success status
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
-        # Check if model belongs to user
-        check_query = "SELECT id FROM auto_analytical_models WHERE id = %s AND user_id = %s"
-        existing = execute_query(check_query, (model_id, user_id))
+        # Delete auto analytical model (ownership check is the DELETE's own WHERE clause)
+        query = "DELETE FROM auto_analytical_models WHERE id = %s AND user_id = %s"
         
-        if not existing:
+        if not execute_update(query, (model_id, user_id)):
             return jsonify({'success': False, 'message': 'Auto analytical model not found'}), 404
         
-        # Delete auto analytical model
-        query = "DELETE FROM auto_analytical_models WHERE id = %s AND user_id = %s"
-        execute_update(query, (model_id, user_id))
-        
+        invalidate_rule_index(user_id)
         logger.info(f"🗑️ Auto analytical model deleted: ID {model_id}")
         
         return jsonify({
@@ -260,7 +246,7 @@ def match_auto_analytical_model():
     Returns: Best matching model with highest score
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
@@ -270,68 +256,13 @@ def match_auto_analytical_model():
         
         logger.info(f"🔍 Matching request - Partner: {partner_id}, Category: {product_category}")
         
-        # Get all confirmed models for user
-        query = """
-            SELECT 
-                aam.id,
-                aam.partner_id,
-                aam.product_category,
-                aam.analytical_account_id,
-                aa.name as analytical_account_name,
-                aa.code as analytical_account_code
-            FROM auto_analytical_models aam
-            LEFT JOIN analytical_accounts aa ON aam.analytical_account_id = aa.id
-            WHERE aam.user_id = %s AND aam.status = 'confirm'
-        """
-        models = execute_query(query, (user_id,))
-        
-        if not models:
-            logger.info("ℹ️ No confirmed models found")
-            return jsonify({
-                'success': True,
-                'match': None,
-                'message': 'No matching rules found'
-            }), 200
-        
-        # Score each model
-        best_match = None
-        best_score = 0
-        
-        for model in models:
-            score = 0
-            
-            # Score partner match
-            if model['partner_id']:
-                if partner_id and str(model['partner_id']) == str(partner_id):
-                    score += 1
-                else:
-                    # If model specifies partner but doesn't match, skip this model
-                    continue
-            
-            # Score product category match
-            if model['product_category']:
-                if product_category and model['product_category'] == product_category:
-                    score += 1
-                else:
-                    # If model specifies category but doesn't match, skip this model
-                    continue
-            
-            # Update best match if this score is higher
-            if score > best_score:
-                best_score = score
-                best_match = model
+        match = get_rule_index(user_id).match(partner_id, product_category)
         
-        if best_match:
-            logger.info(f"✅ Best match found: Model ID {best_match['id']}, Score: {best_score}")
+        if match:
+            logger.info(f"✅ Best match found: Model ID {match['model_id']}, Score: {match['score']}")
             return jsonify({
                 'success': True,
-                'match': {
-                    'model_id': best_match['id'],
-                    'analytical_account_id': best_match['analytical_account_id'],
-                    'analytical_account_name': best_match['analytical_account_name'],
-                    'analytical_account_code': best_match['analytical_account_code'],
-                    'score': best_score
-                }
+                'match': match
             }), 200
         else:
             logger.info("ℹ️ No matching rules found")
@@ -343,4 +274,39 @@ def match_auto_analytical_model():
         
     except Exception as e:
         logger.error(f"❌ Error matching auto analytical model: {str(e)}")
-        return jsonify({'success': False, 'message': 'Server error'}), 500
\ No newline at end of file
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
+@auto_analytical_models_bp.route('/auto-analytical-models/match-batch', methods=['POST'])
+def match_auto_analytical_models_batch():
+    """
+    Match many transactions in one call
+    Expected JSON: {"items": [{"partner_id": .., "product_category": ..}, ...]}
+    Returns: JSON with matches (same order as items, null when nothing matches)
+    """
+    try:
+        user_id = current_user_id()
+        if not user_id:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+        
+        data = request.get_json(silent=True) or {}
+        items = data.get('items')
+        
+        if not isinstance(items, list):
+            return jsonify({'success': False, 'message': 'items must be a list'}), 400
+        
+        index = get_rule_index(user_id)
+        matches = [
+            index.match(item.get('partner_id'), item.get('product_category')) if isinstance(item, dict) else None
+            for item in items
+        ]
+        
+        logger.info(f"🔍 Batch match for user {user_id}: {sum(1 for m in matches if m)}/{len(items)} matched")
+        
+        return jsonify({
+            'success': True,
+            'matches': matches
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"❌ Error batch matching auto analytical models: {str(e)}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
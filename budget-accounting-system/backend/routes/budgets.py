@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from utils.auth import token_required
-from utils.db import execute_query, execute_insert, execute_update
+from utils.db import execute_query, execute_insert, execute_update, transaction, cursor
+from utils.document_lines import insert_lines
+from utils.budget_engine import recompute_budget, recompute_tenant, refresh_for_entries
 import logging
 from datetime import datetime
 
@@ -14,14 +16,43 @@ budgets_bp = Blueprint('budgets', __name__)
 @budgets_bp.route('/budgets', methods=['GET'])
 @token_required
 def get_budgets(current_user):
-    """Get all budgets filtered by status (draft/confirm/revised/archived)"""
+    """
+    Get all budgets filtered by status (draft/confirm/revised/archived)
+
+    Lines and totals come back from a single query. Pass ?include_lines=false
+    to get only the header and totals (list views).
+    """
     try:
         user_id = current_user['id']
         status = request.args.get('status', 'draft')
+        include_lines = request.args.get('include_lines', 'true').lower() not in ('false', '0', 'no')
         
         logger.info(f"📊 Getting budgets for user {user_id}, status: {status}")
         
-        query = """
+        # One pass over budget_lines per budget (LATERAL), lines aggregated to JSON
+        lines_json = """
+                    COALESCE(
+                        json_agg(
+                            json_build_object(
+                                'id', bl.id,
+                                'analytical_account_id', bl.analytical_account_id,
+                                'analytical_account_code', aa.code,
+                                'analytical_account_name', aa.name,
+                                'type', bl.type,
+                                'planned_amount', bl.planned_amount::float,
+                                'achieved_amount', COALESCE(bl.achieved_amount, 0)::float,
+                                'achieved_percentage', CASE
+                                    WHEN bl.planned_amount > 0
+                                    THEN ROUND(COALESCE(bl.achieved_amount, 0) / bl.planned_amount * 100, 2)::float
+                                    ELSE 0
+                                END,
+                                'amount_to_achieve', ROUND(bl.planned_amount - COALESCE(bl.achieved_amount, 0), 2)::float
+                            ) ORDER BY bl.id
+                        ) FILTER (WHERE bl.id IS NOT NULL),
+                        '[]'::json
+                    ) as lines,""" if include_lines else ""
+        
+        query = f"""
             SELECT 
                 b.id,
                 b.name,
@@ -29,58 +60,23 @@ def get_budgets(current_user):
                 TO_CHAR(b.end_date, 'YYYY-MM-DD') as end_date,
                 b.status,
                 b.revision_of,
-                TO_CHAR(b.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
+                TO_CHAR(b.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
+                l.*
             FROM budgets b
+            CROSS JOIN LATERAL (
+                SELECT {lines_json}
+                    COUNT(bl.id) as line_count,
+                    ROUND(COALESCE(SUM(bl.planned_amount), 0), 2)::float as total_planned,
+                    ROUND(COALESCE(SUM(COALESCE(bl.achieved_amount, 0)), 0), 2)::float as total_achieved
+                FROM budget_lines bl
+                JOIN analytical_accounts aa ON bl.analytical_account_id = aa.id
+                WHERE bl.budget_id = b.id
+            ) l
             WHERE b.user_id = %s AND b.status = %s
             ORDER BY b.created_at DESC
         """
         
-        budgets = execute_query(query, (user_id, status))
-        
-        if not budgets:
-            return jsonify([]), 200
-        
-        # Get lines for each budget
-        result = []
-        for budget in budgets:
-            lines_query = """
-                SELECT 
-                    bl.id,
-                    bl.analytical_account_id,
-                    aa.code as analytical_account_code,
-                    aa.name as analytical_account_name,
-                    bl.type,
-                    bl.planned_amount::float as planned_amount,
-                    COALESCE(bl.achieved_amount, 0)::float as achieved_amount
-                FROM budget_lines bl
-                JOIN analytical_accounts aa ON bl.analytical_account_id = aa.id
-                WHERE bl.budget_id = %s
-                ORDER BY bl.id
-            """
-            
-            lines = execute_query(lines_query, (budget['id'],))
-            
-            # Calculate totals
-            total_planned = sum(float(line['planned_amount']) for line in lines)
-            total_achieved = sum(float(line['achieved_amount']) for line in lines)
-            
-            # Add calculated fields to lines
-            for line in lines:
-                planned = float(line['planned_amount'])
-                achieved = float(line['achieved_amount'])
-                
-                if planned > 0:
-                    line['achieved_percentage'] = round((achieved / planned) * 100, 2)
-                else:
-                    line['achieved_percentage'] = 0
-                
-                line['amount_to_achieve'] = round(planned - achieved, 2)
-            
-            budget['lines'] = lines
-            budget['total_planned'] = round(total_planned, 2)
-            budget['total_achieved'] = round(total_achieved, 2)
-            
-            result.append(budget)
+        result = execute_query(query, (user_id, status))
         
         logger.info(f"✅ Found {len(result)} budgets")
         return jsonify(result), 200
@@ -113,13 +109,6 @@ def get_budget(current_user, budget_id):
             WHERE id = %s AND user_id = %s
         """
         
-        budgets = execute_query(query, (budget_id, user_id))
-        
-        if not budgets:
-            return jsonify({'error': 'Budget not found'}), 404
-        
-        budget = budgets[0]
-        
         # Get lines
         lines_query = """
             SELECT 
@@ -136,7 +125,14 @@ def get_budget(current_user, budget_id):
             ORDER BY bl.id
         """
         
-        lines = execute_query(lines_query, (budget_id,))
+        with cursor() as cur:
+            budgets = execute_query(query, (budget_id, user_id), cur=cur)
+            
+            if not budgets:
+                return jsonify({'error': 'Budget not found'}), 404
+            
+            budget = budgets[0]
+            lines = execute_query(lines_query, (budget_id,), cur=cur)
         
         # Add calculated fields
         for line in lines:
@@ -203,33 +199,30 @@ def create_budget(current_user):
             RETURNING id
         """
         
-        budget_result = execute_insert(budget_query, (
-            user_id,
-            data['name'],
-            data['start_date'],
-            data['end_date'],
-            data.get('status', 'draft')
-        ))
-        
-        budget_id = budget_result[0]['id'] if budget_result else None
-        if not budget_id:
-            raise Exception("Failed to create budget")
-        
-        # Insert lines
-        for line in valid_lines:
-            line_query = """
-                INSERT INTO budget_lines 
-                (budget_id, analytical_account_id, type, planned_amount, achieved_amount)
-                VALUES (%s, %s, %s, %s, %s)
-            """
+        # Header and lines are committed together (no partial budgets)
+        with transaction() as cur:
+            budget_result = execute_insert(budget_query, (
+                user_id,
+                data['name'],
+                data['start_date'],
+                data['end_date'],
+                data.get('status', 'draft')
+            ), cur=cur)
             
-            execute_insert(line_query, (
-                budget_id,
-                int(line['analytical_account_id']),
-                line['type'],
-                float(line['planned_amount']),
-                0.00
-            ))
+            budget_id = budget_result[0]['id'] if budget_result else None
+            if not budget_id:
+                raise Exception("Failed to create budget")
+            
+            # Insert lines (multi-row INSERT)
+            insert_lines(cur, 'budget', budget_id, [
+                {
+                    'analytical_account_id': int(line['analytical_account_id']),
+                    'type': line['type'],
+                    'planned_amount': float(line['planned_amount']),
+                    'achieved_amount': 0.00
+                }
+                for line in valid_lines
+            ])
         
         logger.info(f"✅ Budget created: {budget_id}")
         return jsonify({'id': budget_id, 'message': 'Budget created successfully'}), 201
@@ -259,35 +252,35 @@ def update_budget(current_user, budget_id):
             WHERE id = %s AND user_id = %s
         """
         
-        execute_update(budget_query, (
-            data['name'],
-            data['start_date'],
-            data['end_date'],
-            data.get('status', 'draft'),
-            budget_id,
-            user_id
-        ))
-        
-        # Delete existing lines
-        execute_update("DELETE FROM budget_lines WHERE budget_id = %s", (budget_id,))
-        
-        # Insert new lines
         valid_lines = [l for l in data.get('lines', []) if float(l.get('planned_amount', 0)) > 0]
         
-        for line in valid_lines:
-            line_query = """
-                INSERT INTO budget_lines 
-                (budget_id, analytical_account_id, type, planned_amount, achieved_amount)
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            
-            execute_insert(line_query, (
+        # Header update and line replacement are committed together
+        with transaction() as cur:
+            updated = execute_update(budget_query, (
+                data['name'],
+                data['start_date'],
+                data['end_date'],
+                data.get('status', 'draft'),
                 budget_id,
-                int(line['analytical_account_id']),
-                line['type'],
-                float(line['planned_amount']),
-                float(line.get('achieved_amount', 0))
-            ))
+                user_id
+            ), cur=cur)
+            
+            if not updated:
+                return jsonify({'error': 'Budget not found'}), 404
+            
+            # Delete existing lines
+            execute_update("DELETE FROM budget_lines WHERE budget_id = %s", (budget_id,), cur=cur)
+            
+            # Insert new lines (multi-row INSERT)
+            insert_lines(cur, 'budget', budget_id, [
+                {
+                    'analytical_account_id': int(line['analytical_account_id']),
+                    'type': line['type'],
+                    'planned_amount': float(line['planned_amount']),
+                    'achieved_amount': float(line.get('achieved_amount', 0))
+                }
+                for line in valid_lines
+            ])
         
         logger.info(f"✅ Budget updated: {budget_id}")
         return jsonify({'message': 'Budget updated successfully'}), 200
@@ -310,20 +303,6 @@ def delete_budget(current_user, budget_id):
         
         # Check if budget exists and get its status
         check_query = "SELECT status, name FROM budgets WHERE id = %s AND user_id = %s"
-        budget_info = execute_query(check_query, (budget_id, user_id))
-        
-        if not budget_info:
-            return jsonify({'error': 'Budget not found'}), 404
-        
-        budget_status = budget_info[0]['status']
-        budget_name = budget_info[0]['name']
-        
-        # Only allow deleting draft budgets
-        if budget_status != 'draft':
-            logger.warning(f"❌ Attempted to delete non-draft budget: {budget_id} (status: {budget_status})")
-            return jsonify({
-                'error': f'Cannot delete {budget_status} budgets. Only draft budgets can be deleted.'
-            }), 400
         
         # Archive the budget (soft delete)
         query = """
@@ -332,7 +311,23 @@ def delete_budget(current_user, budget_id):
             WHERE id = %s AND user_id = %s AND status = 'draft'
         """
         
-        execute_update(query, (budget_id, user_id))
+        with transaction() as cur:
+            budget_info = execute_query(check_query, (budget_id, user_id), cur=cur)
+            
+            if not budget_info:
+                return jsonify({'error': 'Budget not found'}), 404
+            
+            budget_status = budget_info[0]['status']
+            budget_name = budget_info[0]['name']
+            
+            # Only allow deleting draft budgets
+            if budget_status != 'draft':
+                logger.warning(f"❌ Attempted to delete non-draft budget: {budget_id} (status: {budget_status})")
+                return jsonify({
+                    'error': f'Cannot delete {budget_status} budgets. Only draft budgets can be deleted.'
+                }), 400
+            
+            execute_update(query, (budget_id, user_id), cur=cur)
         
         logger.info(f"✅ Budget archived: {budget_id} ({budget_name})")
         return jsonify({'message': f'Budget "{budget_name}" archived successfully'}), 200
@@ -359,7 +354,10 @@ def confirm_budget(current_user, budget_id):
             WHERE id = %s AND user_id = %s AND status = 'draft'
         """
         
-        execute_update(query, (budget_id, user_id))
+        with transaction() as cur:
+            if execute_update(query, (budget_id, user_id), cur=cur):
+                # Confirmed budgets are kept current from here on
+                recompute_budget(cur, user_id, budget_id)
         
         logger.info(f"✅ Budget confirmed: {budget_id}")
         return jsonify({'message': 'Budget confirmed successfully'}), 200
@@ -380,26 +378,6 @@ def revise_budget(current_user, budget_id):
         
         logger.info(f"🔄 Creating revision of budget {budget_id}")
         
-        # Get original budget
-        original = execute_query(
-            "SELECT * FROM budgets WHERE id = %s AND user_id = %s", 
-            (budget_id, user_id)
-        )
-        
-        if not original:
-            return jsonify({'error': 'Budget not found'}), 404
-        
-        original = original[0]
-        
-        # Count existing revisions
-        revision_count = execute_query(
-            "SELECT COUNT(*) as count FROM budgets WHERE revision_of = %s",
-            (budget_id,)
-        )[0]['count']
-        
-        # Create new name with revision number
-        new_name = f"{original['name']}.r{revision_count + 1}"
-        
         # Create new budget
         new_budget_query = """
             INSERT INTO budgets (user_id, name, start_date, end_date, status, revision_of)
@@ -407,18 +385,6 @@ def revise_budget(current_user, budget_id):
             RETURNING id
         """
         
-        new_budget_result = execute_insert(new_budget_query, (
-            user_id,
-            new_name,
-            original['start_date'],
-            original['end_date'],
-            budget_id
-        ))
-        
-        new_budget_id = new_budget_result[0]['id'] if new_budget_result else None
-        if not new_budget_id:
-            raise Exception("Failed to create budget revision")
-        
         # Copy lines with achieved amounts reset to 0
         copy_query = """
             INSERT INTO budget_lines (budget_id, analytical_account_id, type, planned_amount, achieved_amount)
@@ -427,13 +393,50 @@ def revise_budget(current_user, budget_id):
             WHERE budget_id = %s
         """
         
-        execute_query(copy_query, (new_budget_id, budget_id))
-        
-        # Mark original as revised
-        execute_update(
-            "UPDATE budgets SET status = 'revised' WHERE id = %s", 
-            (budget_id,)
-        )
+        # Revision header, copied lines and status change are committed together
+        with transaction() as cur:
+            # Get original budget (locked so concurrent revisions get distinct numbers)
+            original = execute_query(
+                "SELECT * FROM budgets WHERE id = %s AND user_id = %s FOR UPDATE", 
+                (budget_id, user_id),
+                cur=cur
+            )
+            
+            if not original:
+                return jsonify({'error': 'Budget not found'}), 404
+            
+            original = original[0]
+            
+            # Count existing revisions
+            revision_count = execute_query(
+                "SELECT COUNT(*) as count FROM budgets WHERE revision_of = %s",
+                (budget_id,),
+                cur=cur
+            )[0]['count']
+            
+            # Create new name with revision number
+            new_name = f"{original['name']}.r{revision_count + 1}"
+            
+            new_budget_result = execute_insert(new_budget_query, (
+                user_id,
+                new_name,
+                original['start_date'],
+                original['end_date'],
+                budget_id
+            ), cur=cur)
+            
+            new_budget_id = new_budget_result[0]['id'] if new_budget_result else None
+            if not new_budget_id:
+                raise Exception("Failed to create budget revision")
+            
+            execute_update(copy_query, (new_budget_id, budget_id), cur=cur)
+            
+            # Mark original as revised
+            execute_update(
+                "UPDATE budgets SET status = 'revised' WHERE id = %s", 
+                (budget_id,),
+                cur=cur
+            )
         
         logger.info(f"✅ Revision created: {budget_id} → {new_budget_id}")
         return jsonify({
@@ -452,75 +455,74 @@ def revise_budget(current_user, budget_id):
 @budgets_bp.route('/budgets/<int:budget_id>/calculate-achievements', methods=['POST'])
 @token_required
 def calculate_budget_achievements(current_user, budget_id):
-    """Calculate achieved amounts for budget lines from journal entries"""
+    """Calculate achieved amounts for budget lines from posted journal items"""
     try:
         user_id = current_user['id']
         
         logger.info(f"🔄 Calculating achievements for budget {budget_id}")
         
-        # Get budget
-        budget = execute_query(
-            "SELECT * FROM budgets WHERE id = %s AND user_id = %s", 
-            (budget_id, user_id)
-        )
-        
-        if not budget:
-            return jsonify({'error': 'Budget not found'}), 404
-        
-        budget = budget[0]
+        with transaction() as cur:
+            budget = execute_query(
+                "SELECT id FROM budgets WHERE id = %s AND user_id = %s", 
+                (budget_id, user_id),
+                cur=cur
+            )
         
-        # Get all lines for this budget
-        lines = execute_query(
-            "SELECT * FROM budget_lines WHERE budget_id = %s", 
-            (budget_id,)
-        )
+            if not budget:
+                return jsonify({'error': 'Budget not found'}), 404
+            
+            result = recompute_budget(cur, user_id, budget_id)
         
-        if not lines:
-            return jsonify({'message': 'No budget lines to calculate'}), 200
+        logger.info(f"✅ Budget {budget_id} achievements calculated: {result['total_achieved']}")
         
-        # Calculate achieved for each line
-        total_achieved = 0
-        lines_updated = 0
+        return jsonify({
+            'message': 'Achievements calculated successfully',
+            'total_achieved': result['total_achieved'],
+            'lines_updated': result['lines_updated']
+        }), 200
         
-        for line in lines:
-            # Note: This is a placeholder calculation since we don't have journal entries table yet
-            # In a real implementation, you would query journal entries for this analytical account
-            # within the budget period and sum the amounts
-            
-            # For now, we'll simulate some achieved amounts (you can replace this with actual logic)
-            # achieved = get_journal_entries_sum(line['analytical_account_id'], budget['start_date'], budget['end_date'])
-            
-            # Placeholder: Set achieved to 70% of planned for demo purposes
-            achieved = float(line['planned_amount']) * 0.7
-            
-            # Update line achieved amount
-            execute_update(
-                "UPDATE budget_lines SET achieved_amount = %s WHERE id = %s",
-                (achieved, line['id'])
-            )
-            
-            total_achieved += achieved
-            lines_updated += 1
+    except Exception as e:
+        logger.error(f"❌ Error calculating achievements: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# ============================================
+# REFRESH ACHIEVEMENTS (All Confirmed Budgets)
+# ============================================
+@budgets_bp.route('/budgets/refresh-achievements', methods=['POST'])
+@token_required
+def refresh_budget_achievements(current_user):
+    """
+    Bring confirmed budgets in line with the ledger
+
+    Journal triggers (migration 016) normally keep them current; this is for
+    repairs. Body (optional): {"entry_ids": [..]} - only recompute the lines
+    these journal entries currently fall in. Without it every confirmed
+    budget is recomputed.
+    """
+    try:
+        user_id = current_user['id']
+        data = request.get_json(silent=True) or {}
+        entry_ids = data.get('entry_ids')
         
-        # Update budget total achieved
-        execute_update(
-            "UPDATE budgets SET total_achieved = %s WHERE id = %s",
-            (total_achieved, budget_id)
-        )
+        if entry_ids is not None and not isinstance(entry_ids, list):
+            return jsonify({'error': 'entry_ids must be a list'}), 400
         
-        logger.info(f"✅ Budget {budget_id} achievements calculated: {total_achieved}")
+        with transaction() as cur:
+            if entry_ids is not None:
+                result = refresh_for_entries(cur, user_id, [int(entry_id) for entry_id in entry_ids])
+            else:
+                result = recompute_tenant(cur, user_id)
         
-        # Ensure lines_updated is always a valid number
-        lines_count = lines_updated if lines_updated is not None else 0
+        logger.info(f"✅ Refreshed achievements for user {user_id}: {result['lines_updated']} lines")
         
         return jsonify({
-            'message': 'Achievements calculated successfully',
-            'total_achieved': float(total_achieved),
-            'lines_updated': lines_count
+            'message': 'Achievements refreshed successfully',
+            'lines_updated': result['lines_updated'],
+            'budgets_updated': len(result['budget_ids'])
         }), 200
         
     except Exception as e:
-        logger.error(f"❌ Error calculating achievements: {str(e)}", exc_info=True)
+        logger.error(f"❌ Error refreshing achievements: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 # ============================================
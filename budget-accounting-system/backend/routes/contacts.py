@@ -6,8 +6,9 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.db import execute_query, execute_insert, execute_update
+from utils.db import execute_query, execute_insert, execute_update, transaction
 from utils.auth import token_required
+from utils.pagination import ListSpec, PaginationError, fetch_page, page_headers
 import logging
 
 # ===== BLUEPRINT SETUP =====
@@ -17,33 +18,50 @@ logger = logging.getLogger(__name__)
 # ===== HELPER FUNCTIONS =====
 # (No helper functions needed - using @token_required decorator)
 
+# ===== LIST DEFINITION =====
+CONTACTS_LIST = ListSpec(
+    fields={
+        'id': 'id',
+        'type': 'contact_type',
+        'name': 'name',
+        'email': 'email',
+        'phone': 'phone',
+        'company_name': 'company_name',
+        'gstin': 'gstin',
+        'created_at': 'created_at'
+    },
+    from_sql="FROM contacts",
+    tenant_column='user_id',
+    sort=('created_at', 'timestamp'),
+    id_column='id',
+    filters={'type': 'contact_type'}
+)
+
 # ===== CONTACTS ENDPOINTS =====
 
 @contacts_bp.route('/contacts', methods=['GET'])
 @token_required
 def get_contacts(current_user):
     """
-    Get all contacts for logged-in user
-    Returns: JSON with contacts array
+    Get contacts for logged-in user (newest first)
+    Query: limit, cursor, fields, type
+    Returns: JSON with contacts array and next_cursor
     """
     try:
         user_id = current_user['id']
         
-        query = """
-            SELECT id, contact_type as type, name, email, phone, company_name, gstin, created_at
-            FROM contacts
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-        """
-        contacts = execute_query(query, (user_id,))
+        contacts, next_cursor = fetch_page(CONTACTS_LIST, user_id, request.args)
         
         logger.info(f"📋 Retrieved {len(contacts)} contacts for user {user_id}")
         
         return jsonify({
             'success': True,
-            'contacts': contacts
-        }), 200
+            'contacts': contacts,
+            'next_cursor': next_cursor
+        }), 200, page_headers(next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"❌ Error getting contacts: {str(e)}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -130,13 +148,6 @@ def update_contact(current_user, contact_id):
     try:
         user_id = current_user['id']
         
-        # Check if contact belongs to user
-        check_query = "SELECT id FROM contacts WHERE id = %s AND user_id = %s"
-        existing = execute_query(check_query, (contact_id, user_id))
-        
-        if not existing:
-            return jsonify({'success': False, 'message': 'Contact not found'}), 404
-        
         data = request.get_json()
         
         # Validate required fields with None checks
@@ -173,7 +184,10 @@ def update_contact(current_user, contact_id):
             WHERE id = %s AND user_id = %s
         """
         params = (contact_type, name, email, phone, company_name, gstin, contact_id, user_id)
-        execute_update(query, params)
+        
+        # The ownership check is the UPDATE's own WHERE clause (one round trip)
+        if not execute_update(query, params):
+            return jsonify({'success': False, 'message': 'Contact not found'}), 404
         
         logger.info(f"✅ Contact updated: ID {contact_id}, Name: {name}")
         
@@ -197,19 +211,17 @@ def delete_contact(current_user, contact_id):
     try:
         user_id = current_user['id']
         
-        # Check if contact belongs to user and get name for logging
-        check_query = "SELECT name FROM contacts WHERE id = %s AND user_id = %s"
-        existing = execute_query(check_query, (contact_id, user_id))
+        # Delete contact (returns the name for logging; empty if not owned by user)
+        query = "DELETE FROM contacts WHERE id = %s AND user_id = %s RETURNING name"
+        
+        with transaction() as cur:
+            existing = execute_query(query, (contact_id, user_id), cur=cur)
         
         if not existing:
             return jsonify({'success': False, 'message': 'Contact not found'}), 404
         
         contact_name = existing[0]['name']
         
-        # Delete contact
-        query = "DELETE FROM contacts WHERE id = %s AND user_id = %s"
-        execute_update(query, (contact_id, user_id))
-        
         logger.info(f"🗑️ Contact deleted: ID {contact_id}, Name: {contact_name}")
         
         return jsonify({
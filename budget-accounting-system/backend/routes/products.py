@@ -6,62 +6,58 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.db import execute_query, execute_insert, execute_update
-from routes.auth import verify_token
+from utils.db import execute_query, execute_insert, execute_update, transaction
+from utils.auth import current_user_id
+from utils.pagination import ListSpec, PaginationError, fetch_page, page_headers
 import logging
 
 # ===== BLUEPRINT SETUP =====
 products_bp = Blueprint('products', __name__)
 logger = logging.getLogger(__name__)
 
-# ===== HELPER FUNCTIONS =====
-
-def get_user_from_token():
-    """
-    Extract user_id from JWT token in Authorization header
-    Returns: user_id if valid, None if invalid
-    """
-    try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return None
-        
-        token = auth_header.split(' ')[1]
-        payload = verify_token(token)
-        
-        return payload['user_id'] if payload else None
-    except Exception as e:
-        logger.error(f"❌ Error getting user from token: {str(e)}")
-        return None
+# ===== LIST DEFINITION =====
+PRODUCTS_LIST = ListSpec(
+    fields={
+        'id': 'id',
+        'name': 'name',
+        'category': 'category',
+        'cost_price': 'cost_price',
+        'sales_price': 'sales_price',
+        'created_at': 'created_at'
+    },
+    from_sql="FROM products",
+    tenant_column='user_id',
+    sort=('created_at', 'timestamp'),
+    id_column='id',
+    filters={'category': 'category'}
+)
 
 # ===== PRODUCTS ENDPOINTS =====
 
 @products_bp.route('/products', methods=['GET'])
 def get_products():
     """
-    Get all products for logged-in user
-    Returns: JSON with products array
+    Get products for logged-in user (newest first)
+    Query: limit, cursor, fields, category
+    Returns: JSON with products array and next_cursor
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
-        query = """
-            SELECT id, name, category, cost_price, sales_price, created_at
-            FROM products
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-        """
-        products = execute_query(query, (user_id,))
+        products, next_cursor = fetch_page(PRODUCTS_LIST, user_id, request.args)
         
         logger.info(f"📋 Retrieved {len(products)} products for user {user_id}")
         
         return jsonify({
             'success': True,
-            'products': products
-        }), 200
+            'products': products,
+            'next_cursor': next_cursor
+        }), 200, page_headers(next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"❌ Error getting products: {str(e)}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -74,7 +70,7 @@ def create_product():
     Returns: JSON with success status and product_id
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
@@ -142,17 +138,10 @@ def update_product(product_id):
     Returns: JSON with success status
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
-        # Check if product belongs to user
-        check_query = "SELECT id FROM products WHERE id = %s AND user_id = %s"
-        existing = execute_query(check_query, (product_id, user_id))
-        
-        if not existing:
-            return jsonify({'success': False, 'message': 'Product not found'}), 404
-        
         data = request.get_json()
         
         # Validate required fields with None checks
@@ -184,7 +173,10 @@ def update_product(product_id):
             WHERE id = %s AND user_id = %s
         """
         params = (name, category, cost_price, sales_price, product_id, user_id)
-        execute_update(query, params)
+        
+        # The ownership check is the UPDATE's own WHERE clause (one round trip)
+        if not execute_update(query, params):
+            return jsonify({'success': False, 'message': 'Product not found'}), 404
         
         logger.info(f"✅ Product updated: ID {product_id}, Name: {name}")
         
@@ -205,23 +197,21 @@ def delete_product(product_id):
     Returns: JSON with success status
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
-        # Check if product belongs to user and get name for logging
-        check_query = "SELECT name FROM products WHERE id = %s AND user_id = %s"
-        existing = execute_query(check_query, (product_id, user_id))
+        # Delete product (returns the name for logging; empty if not owned by user)
+        query = "DELETE FROM products WHERE id = %s AND user_id = %s RETURNING name"
+        
+        with transaction() as cur:
+            existing = execute_query(query, (product_id, user_id), cur=cur)
         
         if not existing:
             return jsonify({'success': False, 'message': 'Product not found'}), 404
         
         product_name = existing[0]['name']
         
-        # Delete product
-        query = "DELETE FROM products WHERE id = %s AND user_id = %s"
-        execute_update(query, (product_id, user_id))
-        
         logger.info(f"🗑️ Product deleted: ID {product_id}, Name: {product_name}")
         
         return jsonify({
@@ -7,35 +7,15 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.db import execute_query
-from routes.auth import verify_token
+from utils.cache import TTLCache
+from utils.auth import current_user_id
+from config import Config
 import logging
 
 # ===== BLUEPRINT SETUP =====
 stats_bp = Blueprint('stats', __name__)
 logger = logging.getLogger(__name__)
 
-# ===== HELPER FUNCTIONS =====
-
-def get_user_from_token():
-    """
-    Extract user_id from JWT token in Authorization header
-    Returns: user_id if valid, None if invalid
-    """
-    try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return None
-        
-        token = auth_header.split(' ')[1]
-        payload = verify_token(token)
-        
-        if payload:
-            return payload['user_id']
-        return None
-    except Exception as e:
-        logger.error(f"❌ Error getting user from token: {str(e)}")
-        return None
-
 # ===== STATISTICS ENDPOINTS =====
 
 @stats_bp.route('/budgets/count', methods=['GET'])
@@ -45,7 +25,7 @@ def get_budgets_count():
     Returns: JSON with count
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
@@ -68,7 +48,7 @@ def get_contacts_count():
     Returns: JSON with count
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
@@ -91,7 +71,7 @@ def get_products_count():
     Returns: JSON with count
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
@@ -114,7 +94,7 @@ def get_purchase_orders_count():
     Returns: JSON with count
     """
     try:
-        user_id = get_user_from_token()
+        user_id = current_user_id()
         if not user_id:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
@@ -128,4 +108,111 @@ def get_purchase_orders_count():
         
     except Exception as e:
         logger.error(f"❌ Error getting purchase orders count: {str(e)}")
-        return jsonify({'success': False, 'message': 'Server error'}), 500
\ No newline at end of file
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+# ===== DASHBOARD SUMMARY =====
+
+# Per-tenant cache of the summary; counters may lag writes by at most the TTL
+_summary_cache = TTLCache(maxsize=Config.STATS_CACHE_SIZE, ttl=Config.STATS_CACHE_TTL)
+
+# Every dashboard counter in one round trip
+LIVE_SUMMARY_QUERY = """
+    SELECT
+        (SELECT COUNT(*) FROM budgets WHERE user_id = %(user_id)s) as budgets,
+        (SELECT COUNT(*) FROM contacts WHERE user_id = %(user_id)s) as contacts,
+        (SELECT COUNT(*) FROM products WHERE user_id = %(user_id)s) as products,
+        (SELECT COUNT(*) FROM purchase_orders WHERE user_id = %(user_id)s) as purchase_orders,
+        (SELECT COUNT(*) FROM sales_orders WHERE user_id = %(user_id)s) as sales_orders,
+        inv.customer_invoices,
+        inv.invoice_total,
+        inv.invoice_amount_due,
+        pay.payments,
+        pay.payments_total
+    FROM (
+        SELECT
+            COUNT(*) as customer_invoices,
+            COALESCE(SUM(total), 0)::float as invoice_total,
+            COALESCE(SUM(amount_due), 0)::float as invoice_amount_due
+        FROM customer_invoices
+        WHERE user_id = %(user_id)s
+    ) inv
+    CROSS JOIN (
+        SELECT
+            COUNT(*) as payments,
+            COALESCE(SUM(amount), 0)::float as payments_total
+        FROM payments
+        WHERE user_id = %(user_id)s
+    ) pay
+"""
+
+# Same columns, read from the trigger-maintained table (migration 010)
+COUNTERS_SUMMARY_QUERY = """
+    SELECT
+        budgets, contacts, products, purchase_orders, sales_orders,
+        customer_invoices,
+        invoice_total::float as invoice_total,
+        invoice_amount_due::float as invoice_amount_due,
+        payments,
+        payments_total::float as payments_total
+    FROM tenant_counters
+    WHERE user_id = %(user_id)s
+"""
+
+SUMMARY_COUNTS = ('budgets', 'contacts', 'products', 'purchase_orders', 'sales_orders', 'customer_invoices', 'payments')
+SUMMARY_TOTALS = ('invoice_total', 'invoice_amount_due', 'payments_total')
+
+def load_summary(user_id):
+    """
+    Read the dashboard counters for a tenant
+    Source is Config.STATS_SUMMARY_SOURCE ('live' or 'counters')
+    """
+    source = Config.STATS_SUMMARY_SOURCE
+    rows = []
+    
+    if source == 'counters':
+        rows = execute_query(COUNTERS_SUMMARY_QUERY, {'user_id': user_id})
+        if not rows:
+            # Tenant has no counters row yet (nothing written since migration)
+            source = 'live'
+    
+    if not rows:
+        rows = execute_query(LIVE_SUMMARY_QUERY, {'user_id': user_id})
+    
+    row = rows[0]
+    return {
+        'counts': {key: row[key] for key in SUMMARY_COUNTS},
+        'totals': {key: round(row[key], 2) for key in SUMMARY_TOTALS},
+        'source': source
+    }
+
+def get_summary_cache_stats():
+    """Hit/miss counters of the dashboard summary cache"""
+    return _summary_cache.stats()
+
+@stats_bp.route('/stats/summary', methods=['GET'])
+def get_stats_summary():
+    """
+    Get every dashboard counter (and invoice/payment totals) in one call
+    Query: ?refresh=true bypasses the cache
+    Returns: JSON with counts, totals, source and cached flag
+    """
+    try:
+        user_id = current_user_id()
+        if not user_id:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+        
+        summary = None
+        if request.args.get('refresh', '').lower() != 'true':
+            summary = _summary_cache.get(user_id)
+        
+        cached = summary is not None
+        if not cached:
+            summary = load_summary(user_id)
+            _summary_cache.set(user_id, summary)
+        
+        logger.info(f"📊 Dashboard summary for user {user_id} ({'cache' if cached else summary['source']})")
+        
+        return jsonify({'success': True, 'cached': cached, **summary}), 200
+        
+    except Exception as e:
+        logger.error(f"❌ Error getting dashboard summary: {str(e)}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
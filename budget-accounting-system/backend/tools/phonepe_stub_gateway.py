@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the PhonePe PG v1 API (pay + status), for exercising the
+reconciler and the verify endpoints without the sandbox
+
+Behaviour:
+    - X-VERIFY is checked with the configured salt key (401 when wrong)
+    - every transaction reports PAYMENT_PENDING for --pending-polls status
+      calls, then PAYMENT_SUCCESS
+    - ids starting with FAIL report PAYMENT_ERROR
+    - --error-rate of calls answer HTTP 500, --latency adds a delay
+    - POST /stub/transactions/<txn_id> {"code": ..., "amount": paise} forces an outcome
+    - with --callback-delay, a signed PAYMENT_SUCCESS callback is POSTed to the
+      pay request's callbackUrl that many seconds after initiation
+    - GET /stub/stats shows call counts and the peak calls per second seen
+
+Usage:
+    python tools/phonepe_stub_gateway.py --port 8090 --pending-polls 2
+    python reconcile_payments.py --once --gateway http://127.0.0.1:8090
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import requests
+from flask import Flask, jsonify, request
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+app = Flask(__name__)
+
+settings = {'pending_polls': 2, 'error_rate': 0.0, 'latency': 0.0, 'callback_delay': None}
+transactions = {}  # txn_id -> {'amount': paise, 'polls': int, 'code': forced code or None}
+calls = Counter()
+calls_per_second = Counter()
+lock = threading.Lock()
+
+
+def expected_x_verify(data):
+    digest = hashlib.sha256((data + Config.PHONEPE_SALT_KEY).encode()).hexdigest()
+    return f"{digest}###{Config.PHONEPE_SALT_INDEX}"
+
+
+def send_callback(url, merchant_id, txn_id, amount):
+    body = {
+        'success': True,
+        'code': 'PAYMENT_SUCCESS',
+        'message': 'Your payment is successful.',
+        'data': {
+            'merchantId': merchant_id,
+            'merchantTransactionId': txn_id,
+            'transactionId': 'T' + hashlib.md5(txn_id.encode()).hexdigest()[:16].upper(),
+            'amount': amount,
+            'state': 'COMPLETED',
+            'responseCode': 'SUCCESS'
+        }
+    }
+    encoded = base64.b64encode(json.dumps(body).encode()).decode()
+    try:
+        response = requests.post(url, json={'response': encoded},
+                                 headers={'X-VERIFY': expected_x_verify(encoded)}, timeout=5)
+        print(f"📨 Callback for {txn_id} -> HTTP {response.status_code}")
+    except requests.RequestException as e:
+        print(f"❌ Callback for {txn_id} failed: {e}")
+    with lock:
+        calls['callback'] += 1
+
+
+def simulate_network(kind):
+    with lock:
+        calls[kind] += 1
+        calls_per_second[int(time.time())] += 1
+    if settings['latency']:
+        time.sleep(settings['latency'])
+    return random.random() < settings['error_rate']
+
+
+@app.route('/pg/v1/pay', methods=['POST'])
+def pay():
+    if simulate_network('pay'):
+        return jsonify({'success': False, 'code': 'INTERNAL_SERVER_ERROR'}), 500
+
+    encoded = (request.get_json() or {}).get('request', '')
+    if request.headers.get('X-VERIFY') != expected_x_verify(encoded + '/pg/v1/pay'):
+        return jsonify({'success': False, 'code': 'KEY_NOT_CONFIGURED', 'message': 'Bad checksum'}), 401
+
+    payload = json.loads(base64.b64decode(encoded))
+    txn_id = payload['merchantTransactionId']
+    with lock:
+        transactions[txn_id] = {'amount': payload.get('amount'), 'polls': 0, 'code': None}
+
+    if settings['callback_delay'] is not None and payload.get('callbackUrl'):
+        threading.Timer(settings['callback_delay'], send_callback, args=(
+            payload['callbackUrl'], payload.get('merchantId'), txn_id, payload.get('amount')
+        )).start()
+
+    return jsonify({
+        'success': True,
+        'code': 'PAYMENT_INITIATED',
+        'message': 'Payment initiated',
+        'data': {
+            'merchantId': payload.get('merchantId'),
+            'merchantTransactionId': txn_id,
+            'instrumentResponse': {
+                'type': 'PAY_PAGE',
+                'redirectInfo': {'url': f"{request.host_url}stub/pay-page/{txn_id}", 'method': 'GET'}
+            }
+        }
+    }), 200
+
+
+@app.route('/pg/v1/status/<merchant_id>/<txn_id>', methods=['GET'])
+def status(merchant_id, txn_id):
+    if simulate_network('status'):
+        return jsonify({'success': False, 'code': 'INTERNAL_SERVER_ERROR'}), 500
+
+    path = f"/pg/v1/status/{merchant_id}/{txn_id}"
+    if request.headers.get('X-VERIFY') != expected_x_verify(path):
+        return jsonify({'success': False, 'code': 'KEY_NOT_CONFIGURED', 'message': 'Bad checksum'}), 401
+
+    with lock:
+        txn = transactions.setdefault(txn_id, {'amount': None, 'polls': 0, 'code': None})
+        txn['polls'] += 1
+        if txn['code']:
+            code = txn['code']
+        elif txn_id.startswith('FAIL'):
+            code = 'PAYMENT_ERROR'
+        elif txn['polls'] <= settings['pending_polls']:
+            code = 'PAYMENT_PENDING'
+        else:
+            code = 'PAYMENT_SUCCESS'
+        amount = txn['amount']
+
+    data = {'merchantId': merchant_id, 'merchantTransactionId': txn_id, 'state': code}
+    if code == 'PAYMENT_SUCCESS':
+        data['transactionId'] = 'T' + hashlib.md5(txn_id.encode()).hexdigest()[:16].upper()
+        data['responseCode'] = 'SUCCESS'
+    if amount is not None:
+        data['amount'] = amount
+
+    return jsonify({
+        'success': code in ('PAYMENT_SUCCESS', 'PAYMENT_PENDING'),
+        'code': code,
+        'message': code.replace('_', ' ').title(),
+        'data': data
+    }), 200
+
+
+@app.route('/stub/transactions/<txn_id>', methods=['POST'])
+def force_outcome(txn_id):
+    body = request.get_json() or {}
+    with lock:
+        txn = transactions.setdefault(txn_id, {'amount': None, 'polls': 0, 'code': None})
+        txn['code'] = body.get('code', txn['code'])
+        txn['amount'] = body.get('amount', txn['amount'])
+    return jsonify({'success': True, 'transaction': txn}), 200
+
+
+@app.route('/stub/stats', methods=['GET'])
+def stub_stats():
+    with lock:
+        return jsonify({
+            'calls': dict(calls),
+            'peak_calls_per_second': max(calls_per_second.values(), default=0),
+            'transactions': len(transactions)
+        }), 200
+
+
+@app.route('/stub/pay-page/<txn_id>', methods=['GET'])
+def pay_page(txn_id):
+    return f"<h3>Stub PhonePe payment page for {txn_id}</h3>"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--pending-polls', type=int, default=2, help='status calls answered PENDING before SUCCESS')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with HTTP 500')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--callback-delay', type=float, help='send a success callback this many seconds after pay')
+    args = parser.parse_args()
+
+    settings.update(pending_polls=args.pending_polls, error_rate=args.error_rate, latency=args.latency,
+                    callback_delay=args.callback_delay)
+    print(f"🧪 PhonePe stub gateway on http://127.0.0.1:{args.port} ({settings})")
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,16 +2,146 @@
 Authentication utilities for the Budget Accounting System
 """
 from functools import wraps
-from flask import request, jsonify
+from flask import g, request, jsonify
 from routes.auth import verify_token
 from utils.db import execute_query
+from utils.cache import TTLCache
+from config import Config
+import hashlib
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# ===== AUTHENTICATED USER CACHE =====
+# Per-process cache of the users row, so protected routes don't hit the
+# database just to authenticate. Call invalidate_user() whenever a user
+# row changes; the TTL bounds staleness across processes.
+_user_cache = TTLCache(maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)
+
+USER_QUERY = """
+    SELECT id, name, email, company_name, role
+    FROM users 
+    WHERE id = %s
+"""
+
+def load_user(user_id):
+    """
+    Get user data by id, from the cache when possible
+    
+    Returns:
+        dict: User data (a copy, safe to modify), None if not found
+    """
+    def fetch():
+        users = execute_query(USER_QUERY, (user_id,))
+        return users[0] if users else None
+    
+    user = _user_cache.get_or_load(user_id, fetch)
+    return dict(user) if user else None
+
+def invalidate_user(user_id):
+    """Drop a user from the cache (call after login, signup or profile changes)"""
+    if _user_cache.invalidate(user_id):
+        logger.info(f"🧹 User {user_id} removed from cache")
+
+def get_user_cache_stats():
+    """Hit/miss counters of the authenticated user cache"""
+    return _user_cache.stats()
+
+# ===== REQUEST AUTHENTICATION =====
+# authenticate_request() runs before every request (app.before_request):
+# the bearer token is decoded once and the verified claims are kept on
+# flask.g, so decorators and helpers never re-parse the header. Successful
+# decodes are also cached briefly under a hash of the token, so a client's
+# burst of calls skips the signature check; an entry never outlives the
+# token's own expiry.
+#
+# Two kinds of tokens exist:
+#   - business users (users table, role 'admin' / 'portal_user'): user_id is users.id
+#   - portal contacts (/api/portal/login, role 'portal_customer' / 'portal_vendor'):
+#     user_id is contacts.id
+PORTAL_ROLES = ('portal_customer', 'portal_vendor')
+
+_token_cache = TTLCache(maxsize=Config.TOKEN_CACHE_SIZE, ttl=Config.TOKEN_CACHE_TTL)
+
+def bearer_token():
+    """Token from the 'Authorization: Bearer <token>' header, None if absent"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return auth_header.split(' ')[1]
+
+def decode_token(token):
+    """
+    verify_token() with a short-lived cache of successful decodes
+    
+    Returns:
+        dict or None: Decoded claims if valid, None if invalid or expired
+    """
+    key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    claims = _token_cache.get(key)
+    if claims is not None and claims.get('exp', 0) > time.time():
+        return claims
+    
+    claims = verify_token(token)
+    if claims:
+        remaining = claims.get('exp', 0) - time.time()
+        _token_cache.set(key, claims, ttl=min(Config.TOKEN_CACHE_TTL, max(remaining, 0)))
+    return claims
+
+def authenticate_request():
+    """before_request hook: decode the bearer token once and keep the claims on g"""
+    g.auth_claims = None
+    token = bearer_token()
+    g.auth_token_present = token is not None
+    if token:
+        try:
+            g.auth_claims = decode_token(token)
+        except Exception as e:
+            logger.error(f"❌ Token decode error: {str(e)}")
+
+def request_claims():
+    """
+    Verified claims of the current request
+    
+    Returns:
+        dict: user_id, email, role, exp - None without a valid token
+    """
+    if 'auth_claims' not in g:
+        authenticate_request()
+    return g.auth_claims
+
+def is_portal(claims):
+    """True for a portal contact token (user_id is a contacts.id)"""
+    return bool(claims) and claims.get('role') in PORTAL_ROLES
+
+def current_user_id():
+    """users.id of a business user token, None for portal or missing tokens"""
+    claims = request_claims()
+    if not claims or is_portal(claims):
+        return None
+    return claims['user_id']
+
+def current_contact_id():
+    """contacts.id of a portal token, None otherwise"""
+    claims = request_claims()
+    return claims['user_id'] if is_portal(claims) else None
+
+def get_token_cache_stats():
+    """Hit/miss counters of the decoded token cache"""
+    return _token_cache.stats()
+
+def _auth_error():
+    """401 response for a missing or invalid token (None when the request is authenticated)"""
+    if not g.get('auth_token_present'):
+        return jsonify({'error': 'Authorization token required'}), 401
+    if not request_claims():
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    return None
+
 def token_required(f):
     """
-    Decorator to require JWT token authentication
+    Decorator to require a business user's JWT token
     
     Usage:
         @token_required
@@ -22,32 +152,20 @@ def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         try:
-            # Get token from Authorization header
-            auth_header = request.headers.get('Authorization')
-            if not auth_header or not auth_header.startswith('Bearer '):
-                return jsonify({'error': 'Authorization token required'}), 401
-            
-            token = auth_header.split(' ')[1]
-            
-            # Verify token
-            payload = verify_token(token)
-            if not payload:
-                return jsonify({'error': 'Invalid or expired token'}), 401
+            claims = request_claims()
+            error = _auth_error()
+            if error:
+                return error
             
-            # Get user data from database
-            user_query = """
-                SELECT id, name, email, company_name, role
-                FROM users 
-                WHERE id = %s
-            """
+            if is_portal(claims):
+                return jsonify({'error': 'Portal tokens cannot access this endpoint'}), 403
             
-            users = execute_query(user_query, (payload['user_id'],))
+            # Get user data (cached)
+            current_user = load_user(claims['user_id'])
             
-            if not users:
+            if not current_user:
                 return jsonify({'error': 'User not found'}), 401
             
-            current_user = users[0]
-            
             # Call the original function with current_user
             return f(current_user, *args, **kwargs)
             
@@ -57,33 +175,66 @@ def token_required(f):
     
     return decorated
 
+def admin_required(f):
+    """
+    Decorator for operator endpoints (metrics, profiles): a business user
+    whose role is 'admin'
+    
+    Usage:
+        @admin_required
+        def operator_route(current_user):
+            pass
+    """
+    @token_required
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if current_user.get('role') != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(current_user, *args, **kwargs)
+    
+    return decorated
+
+def portal_required(f):
+    """
+    Decorator to require a portal contact's JWT token
+    
+    Usage:
+        @portal_required
+        def portal_route(contact):
+            # contact: {'id': contacts.id, 'email', 'role', 'type': 'customer'/'vendor'}
+            pass
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        claims = request_claims()
+        error = _auth_error()
+        if error:
+            return error
+        
+        if not is_portal(claims):
+            return jsonify({'error': 'Portal token required'}), 403
+        
+        contact = {
+            'id': claims['user_id'],
+            'email': claims.get('email'),
+            'role': claims['role'],
+            'type': claims['role'][len('portal_'):]
+        }
+        return f(contact, *args, **kwargs)
+    
+    return decorated
+
 def get_current_user():
     """
-    Get current user from JWT token without decorator
+    Get current business user from the request's token without decorator
     
     Returns:
         dict: User data if authenticated, None if not
     """
     try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return None
-        
-        token = auth_header.split(' ')[1]
-        payload = verify_token(token)
-        
-        if not payload:
-            return None
-        
-        user_query = """
-            SELECT id, name, email, company_name, role
-            FROM users 
-            WHERE id = %s
-        """
-        
-        users = execute_query(user_query, (payload['user_id'],))
-        return users[0] if users else None
+        user_id = current_user_id()
+        return load_user(user_id) if user_id else None
         
     except Exception as e:
         logger.error(f"❌ Get current user error: {str(e)}")
-        return None
\ No newline at end of file
+        return None
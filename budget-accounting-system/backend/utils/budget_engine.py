@@ -0,0 +1,149 @@
+# ========================================
+# FILE: utils/budget_engine.py
+# PURPOSE: Compute budget achieved amounts from posted journal items
+# ========================================
+
+from utils.db import execute_query, execute_update
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Budgets kept current when the ledger changes: triggers on journal_items /
+# journal_entries (migration 016) add or subtract each posted, edited,
+# cancelled or deleted item on the lines of confirmed budgets covering it.
+# The functions below rebuild from the journal on demand (confirming a
+# budget, repairs).
+#
+# Handlers write 'confirm'; the sample data in migration 006 uses 'confirmed'.
+# Keep in sync with apply_budget_achievement_delta() in migration 016.
+CONFIRMED_STATUSES = ('confirm', 'confirmed')
+
+# Achieved amount of every target line, in one pass over journal_items:
+#   income line  -> credit - debit
+#   expense line -> debit - credit
+# for posted entries of the tenant dated inside the budget period.
+# Lines are recomputed from scratch, so running it twice is harmless.
+RECOMPUTE_LINES_SQL = """
+    WITH targets AS (
+        SELECT bl.id, bl.budget_id, bl.analytical_account_id, bl.type, b.start_date, b.end_date
+        FROM budget_lines bl
+        JOIN budgets b ON b.id = bl.budget_id
+        WHERE b.user_id = %(user_id)s AND {scope}
+    ),
+    actuals AS (
+        SELECT
+            t.id,
+            COALESCE(SUM(
+                CASE WHEN t.type = 'income'
+                     THEN ji.credit - ji.debit
+                     ELSE ji.debit - ji.credit
+                END
+            ), 0) as achieved
+        FROM targets t
+        LEFT JOIN (
+            journal_items ji
+            JOIN journal_entries je
+              ON je.id = ji.entry_id
+             AND je.user_id = %(user_id)s
+             AND je.state = 'posted'
+        )
+          ON ji.analytical_account_id = t.analytical_account_id
+         AND je.date BETWEEN t.start_date AND t.end_date
+        GROUP BY t.id
+    )
+    UPDATE budget_lines bl
+    SET achieved_amount = a.achieved
+    FROM actuals a
+    WHERE bl.id = a.id
+      AND bl.achieved_amount IS DISTINCT FROM a.achieved
+    RETURNING bl.budget_id
+"""
+
+REFRESH_TOTALS_SQL = """
+    UPDATE budgets b
+    SET total_achieved = s.total
+    FROM (
+        SELECT budget_id, COALESCE(SUM(achieved_amount), 0) as total
+        FROM budget_lines
+        WHERE budget_id = ANY(%(budget_ids)s)
+        GROUP BY budget_id
+    ) s
+    WHERE b.id = s.budget_id
+"""
+
+# Lines touched by a set of journal entries: same analytical account and the
+# entry date falls inside the (confirmed) budget period
+AFFECTED_BY_ENTRIES_SCOPE = """
+    b.status = ANY(%(statuses)s)
+    AND EXISTS (
+        SELECT 1
+        FROM journal_entries je
+        JOIN journal_items ji ON ji.entry_id = je.id
+        WHERE je.id = ANY(%(entry_ids)s)
+          AND je.user_id = %(user_id)s
+          AND ji.analytical_account_id = bl.analytical_account_id
+          AND je.date BETWEEN b.start_date AND b.end_date
+    )
+"""
+
+
+def _recompute(cur, user_id, scope, params):
+    """Recompute the lines matched by `scope` and refresh their budgets' totals"""
+    params = dict(params, user_id=user_id)
+
+    changed = execute_query(RECOMPUTE_LINES_SQL.format(scope=scope), params, cur=cur)
+    lines_updated = len(changed)
+    budget_ids = sorted({row['budget_id'] for row in changed})
+
+    if budget_ids:
+        execute_update(REFRESH_TOTALS_SQL, {'budget_ids': budget_ids}, cur=cur)
+
+    return {'lines_updated': lines_updated, 'budget_ids': budget_ids}
+
+
+def recompute_budget(cur, user_id, budget_id):
+    """
+    Full recomputation of one budget (any status)
+
+    Returns:
+        dict: lines_updated, total_achieved
+    """
+    result = _recompute(cur, user_id, "b.id = %(budget_id)s", {'budget_id': budget_id})
+
+    # Keep the header total in sync even when no line changed
+    execute_update(REFRESH_TOTALS_SQL, {'budget_ids': [budget_id]}, cur=cur)
+    total = execute_query(
+        "SELECT COALESCE(SUM(achieved_amount), 0) as total FROM budget_lines WHERE budget_id = %s",
+        (budget_id,),
+        cur=cur
+    )[0]['total']
+
+    logger.info(f"🔄 Budget {budget_id}: {result['lines_updated']} lines changed")
+    return {'lines_updated': result['lines_updated'], 'total_achieved': float(total)}
+
+
+def recompute_tenant(cur, user_id):
+    """Full recomputation of every confirmed budget of a tenant"""
+    result = _recompute(cur, user_id, "b.status = ANY(%(statuses)s)", {'statuses': list(CONFIRMED_STATUSES)})
+    logger.info(f"🔄 Tenant {user_id}: {result['lines_updated']} budget lines changed")
+    return result
+
+
+def refresh_for_entries(cur, user_id, entry_ids):
+    """
+    Recompute the confirmed budget lines the given entries currently fall in
+
+    Only lines whose analytical account and period match an item of the
+    entries as they are now are recomputed; lines an entry has moved out of
+    are not found here (the migration 016 triggers handle those as the
+    change happens, recompute_tenant() repairs everything).
+    """
+    if not entry_ids:
+        return {'lines_updated': 0, 'budget_ids': []}
+
+    result = _recompute(cur, user_id, AFFECTED_BY_ENTRIES_SCOPE, {
+        'statuses': list(CONFIRMED_STATUSES),
+        'entry_ids': list(entry_ids),
+    })
+    logger.info(f"🔄 Entries {list(entry_ids)}: {result['lines_updated']} budget lines changed")
+    return result
@@ -7,10 +7,14 @@ import psycopg2
 from psycopg2 import pool, Error
 import sys
 import os
+import uuid
+from contextlib import contextmanager
 
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import Config
+from utils.pool import BoundedConnectionPool, PoolTimeout
+from utils.query_stats import InstrumentedCursor
 
 import logging
 
@@ -35,14 +39,19 @@ def initialize_pool():
             connection_pool.closeall()
             logger.info("🔄 Closed existing connection pool")
         
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
-            1,  # Minimum connections
-            10,  # Maximum connections (reduced from 20)
+        # Thread-safe pool: blocks up to DB_POOL_TIMEOUT when exhausted
+        connection_pool = BoundedConnectionPool(
+            Config.DB_POOL_MIN_SIZE,
+            Config.DB_POOL_MAX_SIZE,
+            timeout=Config.DB_POOL_TIMEOUT,
+            health_check_interval=Config.DB_POOL_HEALTH_CHECK_INTERVAL,
             host=Config.DB_HOST,
             port=Config.DB_PORT,
             database=Config.DB_NAME,
             user=Config.DB_USER,
-            password=Config.DB_PASSWORD
+            password=Config.DB_PASSWORD,
+            # Every statement is timed and fingerprinted (utils/query_stats.py)
+            cursor_factory=InstrumentedCursor
         )
         
         if connection_pool:
@@ -82,6 +91,9 @@ def get_connection():
         logger.debug("📊 Database connection acquired from pool")
         return connection
         
+    except PoolTimeout as e:
+        logger.error(f"❌ Connection pool exhausted: {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"❌ Error getting connection: {str(e)}")
         raise
@@ -107,118 +119,210 @@ def close_connection(connection):
         logger.error(f"❌ Error returning connection to pool: {str(e)}")
 
 
-def execute_query(query, params=None):
-    """Execute SELECT queries and return results as list of dictionaries"""
-    connection = None
-    cursor = None
+# ===== TRANSACTIONS =====
+
+@contextmanager
+def transaction():
+    """
+    Run several statements on one pooled connection with a single COMMIT
+    
+    Usage:
+        with transaction() as cur:
+            rows = execute_insert(query, params, cur=cur)
+            execute_update(other_query, other_params, cur=cur)
+    
+    Commits when the block exits normally, rolls back on any exception.
+    """
+    connection = get_connection()
+    cur = connection.cursor()
     
     try:
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        logger.info(f"🔍 Executing query: {query[:100]}...")
-        
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        
-        # Get column names
-        columns = [desc[0] for desc in cursor.description]
-        
-        # Convert rows to list of dictionaries
-        results = []
-        for row in cursor.fetchall():
-            results.append(dict(zip(columns, row)))
+        yield cur
+        connection.commit()
         
-        logger.info(f"✅ Query executed successfully. Rows returned: {len(results)}")
-        return results
+    except Exception:
+        connection.rollback()
+        logger.error("❌ Transaction rolled back")
+        raise
+    finally:
+        cur.close()
+        release_connection(connection)
+
+
+@contextmanager
+def cursor():
+    """
+    Borrow one pooled connection for several read-only queries
+    
+    Usage:
+        with cursor() as cur:
+            header = execute_query(query, params, cur=cur)
+            lines = execute_query(lines_query, params, cur=cur)
+    
+    Nothing is committed; the implicit read transaction is rolled back on exit.
+    """
+    connection = get_connection()
+    cur = connection.cursor()
+    
+    try:
+        yield cur
+    finally:
+        cur.close()
+        try:
+            connection.rollback()
+        except Exception:
+            pass
+        release_connection(connection)
+
+
+def _rows_as_dicts(cur):
+    """Convert the current result set of a cursor to a list of dictionaries"""
+    if cur.description is None:
+        return []
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+# ===== QUERY HELPERS =====
+# Each helper runs on `cur` when given (inside transaction()/cursor()),
+# otherwise it checks out its own connection and commits on its own.
+# Per-statement timing lives in the cursor (InstrumentedCursor), so the
+# helpers only log at DEBUG; see /api/metrics/db and the 'slow_queries' log.
+
+def execute_query(query, params=None, cur=None):
+    """Execute SELECT queries and return results as list of dictionaries"""
+    if cur is not None:
+        cur.execute(query, params)
+        return _rows_as_dicts(cur)
+    
+    try:
+        with cursor() as own_cur:
+            logger.debug(f"🔍 Executing query: {query[:100]}...")
+            
+            results = execute_query(query, params, cur=own_cur)
+            
+            logger.debug(f"✅ Query executed successfully. Rows returned: {len(results)}")
+            return results
         
     except Exception as e:
         logger.error(f"❌ Error executing query: {str(e)}")
         raise
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            release_connection(connection)
 
 
-def execute_update(query, params=None):
+def execute_update(query, params=None, cur=None):
     """Execute INSERT, UPDATE, DELETE queries"""
-    connection = None
-    cursor = None
+    if cur is not None:
+        cur.execute(query, params)
+        return cur.rowcount
     
     try:
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        logger.info(f"✏️ Executing update: {query[:100]}...")
-        
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        
-        connection.commit()
-        rows_affected = cursor.rowcount
+        with transaction() as own_cur:
+            logger.debug(f"✏️ Executing update: {query[:100]}...")
+            
+            rows_affected = execute_update(query, params, cur=own_cur)
         
-        logger.info(f"✅ Update executed successfully. Rows affected: {rows_affected}")
+        logger.debug(f"✅ Update executed successfully. Rows affected: {rows_affected}")
         return rows_affected
         
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f"❌ Error executing update: {str(e)}")
         raise
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            release_connection(connection)
 
-def execute_insert(query, params=None):
+
+def execute_insert(query, params=None, cur=None):
     """Execute INSERT queries with RETURNING clause and commit"""
-    connection = None
-    cursor = None
+    if cur is not None:
+        cur.execute(query, params)
+        if cur.description:
+            row = cur.fetchone()
+            if row:
+                columns = [desc[0] for desc in cur.description]
+                return [dict(zip(columns, row))]  # Return as list for consistency
+        return []
     
     try:
-        connection = get_connection()
-        cursor = connection.cursor()
+        with transaction() as own_cur:
+            logger.debug(f"➕ Executing insert: {query[:100]}...")
+            
+            result = execute_insert(query, params, cur=own_cur)
         
-        logger.info(f"➕ Executing insert: {query[:100]}...")
+        logger.debug(f"✅ Insert committed to database. Returned: {result}")
+        return result
         
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
+    except Exception as e:
+        logger.error(f"❌ Error executing insert: {str(e)}")
+        raise
+
+
+def stream_query(query, params=None, itersize=None):
+    """
+    Yield SELECT results one dictionary at a time
+    
+    Uses a server-side (named) cursor, so only `itersize` rows are held in
+    memory at once. The pooled connection stays checked out until the
+    generator is exhausted or closed.
+    """
+    connection = get_connection()
+    cur = None
+    
+    try:
+        cur = connection.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cur.itersize = itersize or Config.STREAM_ITERSIZE
         
-        # COMMIT the transaction
-        connection.commit()
-        logger.info("✅ Insert committed to database")
+        logger.debug(f"🌊 Streaming query: {query[:100]}...")
+        cur.execute(query, params)
         
-        # Get the returned row
-        if cursor.description:
-            columns = [desc[0] for desc in cursor.description]
-            row = cursor.fetchone()
-            if row:
-                result = dict(zip(columns, row))
-                logger.info(f"✅ Insert successful. Returned: {result}")
-                return [result]  # Return as list for consistency
+        columns = None
+        rows_streamed = 0
+        for row in cur:
+            if columns is None:
+                columns = [desc[0] for desc in cur.description]
+            rows_streamed += 1
+            yield dict(zip(columns, row))
         
-        return []
+        logger.debug(f"✅ Stream finished. Rows streamed: {rows_streamed}")
         
-    except Exception as e:
-        if connection:
+    finally:
+        if cur is not None:
+            try:
+                cur.close()
+            except Exception:
+                pass
+        try:
             connection.rollback()
-            logger.error("❌ Transaction rolled back")
-        logger.error(f"❌ Error executing insert: {str(e)}")
-        raise
+        except Exception:
+            pass
+        release_connection(connection)
+
+
+def ping_database(timeout=None):
+    """
+    Run SELECT 1 on a pooled connection (used by the health monitor)
+    
+    Waits at most `timeout` seconds for a connection; raises PoolTimeout or
+    the database error when the check fails.
+    """
+    if connection_pool is None:
+        initialize_pool()
+    if connection_pool is None:
+        raise Exception("Connection pool failed to initialize")
+    
+    connection = connection_pool.getconn(timeout=timeout)
+    try:
+        cur = connection.cursor()
+        cur.execute('SELECT 1')
+        cur.fetchone()
+        cur.close()
+        connection.rollback()
     finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            release_connection(connection)
+        release_connection(connection)
+
+
+def get_pool_stats():
+    """Return live connection pool statistics (None if the pool is not initialized)"""
+    if connection_pool is None:
+        return None
+    return connection_pool.stats()
 
 
 def test_connection():
@@ -226,12 +330,9 @@ def test_connection():
     try:
         logger.info("🧪 Testing database connection...")
         
-        connection = get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT version();')
-        db_version = cursor.fetchone()[0]
-        cursor.close()
-        release_connection(connection)
+        with cursor() as cur:
+            cur.execute('SELECT version();')
+            db_version = cur.fetchone()[0]
         
         logger.info(f"✅ Database connection test successful")
         return f"PostgreSQL version: {db_version}"
@@ -0,0 +1,75 @@
+# ========================================
+# FILE: utils/document_lines.py
+# PURPOSE: Bulk insertion of document lines (one round trip per page)
+# ========================================
+
+from psycopg2.extras import execute_values
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ===== LINE TABLE REGISTRY =====
+# document type -> (lines table, parent foreign key, line columns)
+# Table and column names only ever come from here, never from request data.
+LINE_TABLES = {
+    'purchase_order': (
+        'purchase_order_lines', 'purchase_order_id',
+        ('product_id', 'description', 'quantity', 'price', 'subtotal', 'analytical_account_id'),
+    ),
+    'sales_order': (
+        'sales_order_lines', 'sales_order_id',
+        ('product_id', 'description', 'quantity', 'price', 'subtotal', 'analytical_account_id'),
+    ),
+    'customer_invoice': (
+        'customer_invoice_lines', 'customer_invoice_id',
+        ('product_id', 'description', 'quantity', 'price', 'subtotal', 'analytical_account_id'),
+    ),
+    'budget': (
+        'budget_lines', 'budget_id',
+        ('analytical_account_id', 'type', 'planned_amount', 'achieved_amount'),
+    ),
+}
+
+# Values used when a line omits a column (same defaults the handlers used)
+COLUMN_DEFAULTS = {
+    'quantity': 1,
+    'price': 0,
+    'subtotal': 0,
+    'achieved_amount': 0.00,
+}
+
+# Rows sent per INSERT statement
+PAGE_SIZE = 500
+
+
+def insert_lines(cur, document_type, parent_id, lines, page_size=PAGE_SIZE):
+    """
+    Insert all lines of a document with multi-row INSERT ... VALUES
+
+    Args:
+        cur: cursor from utils.db.transaction()
+        document_type (str): key of LINE_TABLES ('purchase_order', 'budget', ...)
+        parent_id (int): id of the document header
+        lines (list): line dictionaries keyed by column name
+
+    Returns:
+        int: number of lines written
+    """
+    if document_type not in LINE_TABLES:
+        raise ValueError(f"Unknown document type: {document_type}")
+
+    if not lines:
+        return 0
+
+    table, parent_column, columns = LINE_TABLES[document_type]
+
+    rows = [
+        (parent_id,) + tuple(line.get(column, COLUMN_DEFAULTS.get(column)) for column in columns)
+        for line in lines
+    ]
+
+    query = f"INSERT INTO {table} ({parent_column}, {', '.join(columns)}) VALUES %s"
+    execute_values(cur, query, rows, page_size=page_size)
+
+    logger.debug(f"➕ Inserted {len(rows)} rows into {table}")
+    return len(rows)
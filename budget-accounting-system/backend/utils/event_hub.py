@@ -0,0 +1,175 @@
+# ========================================
+# FILE: utils/event_hub.py
+# PURPOSE: In-process publish/subscribe hub and Server-Sent Events helpers
+# ========================================
+
+import json
+import queue
+import threading
+import time
+
+# Screens waiting for a payment subscribe to a topic (e.g. 'phonepe:<txn_id>')
+# and are pushed status changes over one long-lived SSE response instead of
+# polling. The hub is per process: a change made in another worker process
+# is not published here, so sse_stream() re-checks the source of truth on
+# every heartbeat. Either way an idle screen costs no requests.
+
+
+class Subscription:
+    """One subscriber's bounded queue (oldest events are dropped when full)"""
+
+    def __init__(self, hub, topic, maxsize):
+        self.hub = hub
+        self.topic = topic
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        """Next event, or None after `timeout` seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventHub:
+    """Thread-safe topic -> subscribers fan-out"""
+
+    def __init__(self, queue_size=16):
+        self.queue_size = queue_size
+        self._topics = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, topic):
+        subscription = Subscription(self, topic, self.queue_size)
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._topics.get(subscription.topic)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[subscription.topic]
+
+    def publish(self, topic, event):
+        """Deliver `event` to every current subscriber of `topic`; returns the count"""
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+            self.published += 1
+            self.delivered += len(subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+        return len(subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'topics': len(self._topics),
+                'subscribers': sum(len(subs) for subs in self._topics.values()),
+                'published': self.published,
+                'delivered': self.delivered
+            }
+
+
+class StreamSlots:
+    """
+    Per-process cap on concurrently open event streams
+
+    Each open stream holds a worker thread for up to its max_duration, so
+    without a cap anonymous clients could occupy every thread. acquire()
+    never blocks: a refused client gets a 503 and falls back to polling.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._open = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def acquire(self):
+        """Take a slot; False when `limit` streams are already open"""
+        with self._lock:
+            if self._open >= self.limit:
+                self.rejected += 1
+                return False
+            self._open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._open = max(self._open - 1, 0)
+
+    def stats(self):
+        with self._lock:
+            return {'open': self._open, 'limit': self.limit, 'rejected': self.rejected}
+
+
+# ===== SERVER-SENT EVENTS =====
+
+def format_sse(data, event=None):
+    """One SSE message (data is JSON encoded)"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, default=str)}\n\n"
+
+
+def sse_stream(hub, topic, load_state, is_final, heartbeat=15, max_duration=300, event='status'):
+    """
+    Generator for a text/event-stream response
+
+    Sends the current state at once, then every state published on `topic`;
+    on each heartbeat the state is re-read with load_state() (catches changes
+    made by other processes) and a comment line keeps proxies from closing
+    the connection. Ends after a final state, when load_state() returns None
+    (nothing to watch) or after `max_duration` seconds - EventSource
+    reconnects by itself in the latter case.
+
+    Args:
+        load_state: callable returning the current state dict (or None)
+        is_final: callable(state) -> True when no further change can happen
+    """
+    subscription = hub.subscribe(topic)
+    try:
+        state = load_state()
+        yield format_sse(state, event)
+        if state is None or is_final(state):
+            # Unknown topic (client falls back to its old check) or already settled
+            return
+
+        deadline = time.monotonic() + max_duration
+        while time.monotonic() < deadline:
+            published = subscription.get(timeout=heartbeat)
+            latest = published if published is not None else load_state()
+
+            if latest != state:
+                state = latest
+                yield format_sse(state, event)
+                if state is not None and is_final(state):
+                    return
+            elif published is None:
+                yield ": keep-alive\n\n"
+    finally:
+        subscription.close()
@@ -0,0 +1,190 @@
+# ========================================
+# FILE: utils/health.py
+# PURPOSE: Background dependency checks answering liveness/readiness probes from memory
+# ========================================
+
+import threading
+import time
+
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Load balancers probe every second on every instance. Instead of touching
+# the database per probe, HealthMonitor runs the checks on its own thread
+# every HEALTH_CHECK_INTERVAL seconds and readiness probes read the last
+# result. A result older than HEALTH_STALE_AFTER counts as not ready, so a
+# stuck monitor takes the instance out of rotation instead of freezing it
+# in a healthy state.
+#
+# Each check returns (ok, detail). Critical checks decide readiness;
+# non-critical ones (the PhonePe circuit, by default) only mark the
+# instance 'degraded' - invoices and reports still work without PhonePe.
+
+
+def check_database():
+    """SELECT 1 on a pooled connection, waiting at most HEALTH_DB_TIMEOUT for one"""
+    from utils.db import ping_database
+    started = time.perf_counter()
+    ping_database(timeout=Config.HEALTH_DB_TIMEOUT)
+    return True, {'latency_ms': round((time.perf_counter() - started) * 1000, 3)}
+
+
+def check_pool():
+    """Not ready while every connection is busy and requests are queueing for one"""
+    from utils.db import get_pool_stats
+    stats = get_pool_stats()
+    if stats is None:
+        return False, {'error': 'Connection pool not initialized'}
+    utilisation = stats['in_use'] / stats['max_size']
+    saturated = utilisation >= Config.HEALTH_POOL_SATURATION and stats['waiters'] > 0
+    return not saturated, {
+        'in_use': stats['in_use'],
+        'max_size': stats['max_size'],
+        'waiters': stats['waiters'],
+        'utilisation': round(utilisation, 3)
+    }
+
+
+def check_gateway():
+    """PhonePe circuit breaker state (no network call)"""
+    from utils.phonepe_client import get_phonepe_client
+    state = get_phonepe_client().breaker.state
+    return state != 'open', {'circuit': state}
+
+
+# name -> (check, critical)
+DEFAULT_CHECKS = {
+    'database': (check_database, True),
+    'pool': (check_pool, True),
+    'phonepe': (check_gateway, Config.HEALTH_GATEWAY_CRITICAL),
+}
+
+
+class HealthMonitor:
+    """
+    Runs dependency checks on a daemon thread and caches the outcome
+
+    Args:
+        checks (dict): name -> (callable returning (ok, detail), critical)
+        interval (float): seconds between check rounds
+        stale_after (float): age beyond which the cached result is not trusted
+    """
+
+    def __init__(self, checks=None, interval=None, stale_after=None):
+        self.checks = checks or DEFAULT_CHECKS
+        self.interval = interval or Config.HEALTH_CHECK_INTERVAL
+        self.stale_after = stale_after or Config.HEALTH_STALE_AFTER
+        self._result = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.started_at = time.time()
+        self.rounds = 0
+
+    def run_checks(self):
+        """Run every check once and cache the result"""
+        results = {}
+        for name, (check, critical) in self.checks.items():
+            started = time.perf_counter()
+            try:
+                ok, detail = check()
+            except Exception as e:
+                ok, detail = False, {'error': str(e)}
+            results[name] = {
+                'ok': ok,
+                'critical': critical,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                **detail
+            }
+
+        ready = all(result['ok'] for result in results.values() if result['critical'])
+        degraded = ready and not all(result['ok'] for result in results.values())
+        result = {
+            'ready': ready,
+            'status': 'degraded' if degraded else ('ready' if ready else 'not_ready'),
+            'checks': results,
+            'checked_at': time.time()
+        }
+
+        with self._lock:
+            previous = self._result
+            self._result = result
+            self.rounds += 1
+
+        if previous is None or previous['status'] != result['status']:
+            failing = [name for name, check in results.items() if not check['ok']]
+            log = logger.info if ready and not degraded else logger.warning
+            log(f"🩺 Health status: {result['status']}" + (f" (failing: {', '.join(failing)})" if failing else ""))
+        return result
+
+    def readiness(self):
+        """
+        Cached readiness for probes (never touches a dependency)
+
+        Returns:
+            dict: ready, status, checks, age_seconds
+        """
+        with self._lock:
+            result = self._result
+
+        if result is None:
+            # Monitor not started (or first round still running)
+            return {'ready': False, 'status': 'starting', 'checks': {}, 'age_seconds': None}
+
+        age = time.time() - result['checked_at']
+        response = dict(result, age_seconds=round(age, 3))
+        if age > self.stale_after:
+            response.update(ready=False, status='stale')
+        return response
+
+    def liveness(self):
+        """The process answers; only reports whether the monitor thread is alive"""
+        return {
+            'alive': True,
+            'uptime_seconds': round(time.time() - self.started_at, 3),
+            'monitor_running': bool(self._thread and self._thread.is_alive())
+        }
+
+    def _loop(self):
+        logger.info("🩺 Health monitor started")
+        while not self._stop.is_set():
+            try:
+                self.run_checks()
+            except Exception as e:
+                logger.error(f"❌ Health monitor error: {str(e)}")
+            self._stop.wait(self.interval)
+        logger.info("🛑 Health monitor stopped")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='health-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_health_monitor():
+    """Process-wide monitor (not started until start_health_monitor())"""
+    global _monitor
+    if _monitor is None:
+        with _monitor_lock:
+            if _monitor is None:
+                _monitor = HealthMonitor()
+    return _monitor
+
+
+def start_health_monitor():
+    monitor = get_health_monitor()
+    monitor.start()
+    return monitor
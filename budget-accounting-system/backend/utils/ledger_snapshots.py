@@ -0,0 +1,97 @@
+# ========================================
+# FILE: utils/ledger_snapshots.py
+# PURPOSE: Monthly account balance snapshots for the trial balance
+# ========================================
+
+from utils.db import execute_update
+import logging
+
+logger = logging.getLogger(__name__)
+
+# account_period_balances (migration 012) holds, per account and calendar
+# month, the debit/credit totals of posted journal items. Triggers on
+# journal_items / journal_entries add or subtract each changed item in its
+# month (deltas, so concurrent postings do not overwrite each other), so:
+#
+#   balance as of D = SUM(snapshots for months before D's month)
+#                   + posted items from the 1st of D's month up to D
+#
+# which reads O(accounts x months) rows instead of every journal item.
+
+TRIAL_BALANCE_SQL = """
+    WITH bounds AS (
+        SELECT
+            date_trunc('month', COALESCE(%(as_of)s::date, CURRENT_DATE))::date as cutoff,
+            %(as_of)s::date as as_of
+    ),
+    snapshot AS (
+        SELECT apb.account_id, SUM(apb.debit) as debit, SUM(apb.credit) as credit
+        FROM account_period_balances apb
+        JOIN chart_of_accounts ca ON ca.id = apb.account_id
+        CROSS JOIN bounds
+        WHERE ca.user_id = %(user_id)s
+          AND apb.period_start < bounds.cutoff
+        GROUP BY apb.account_id
+    ),
+    delta AS (
+        SELECT ji.account_id, SUM(ji.debit) as debit, SUM(ji.credit) as credit
+        FROM journal_items ji
+        JOIN journal_entries je ON je.id = ji.entry_id
+        JOIN chart_of_accounts ca ON ca.id = ji.account_id
+        CROSS JOIN bounds
+        WHERE ca.user_id = %(user_id)s
+          AND je.state = 'posted'
+          AND je.date >= bounds.cutoff
+          AND (bounds.as_of IS NULL OR je.date <= bounds.as_of)
+        GROUP BY ji.account_id
+    )
+    SELECT
+        ca.id,
+        ca.code,
+        ca.name,
+        ca.type,
+        COALESCE(s.debit, 0) + COALESCE(d.debit, 0) as total_debit,
+        COALESCE(s.credit, 0) + COALESCE(d.credit, 0) as total_credit
+    FROM chart_of_accounts ca
+    LEFT JOIN snapshot s ON s.account_id = ca.id
+    LEFT JOIN delta d ON d.account_id = ca.id
+    WHERE ca.user_id = %(user_id)s
+    ORDER BY ca.code
+"""
+
+REBUILD_SQL = """
+    INSERT INTO account_period_balances (user_id, account_id, period_start, debit, credit)
+    SELECT
+        je.user_id,
+        ji.account_id,
+        date_trunc('month', je.date)::date,
+        COALESCE(SUM(ji.debit), 0),
+        COALESCE(SUM(ji.credit), 0)
+    FROM journal_items ji
+    JOIN journal_entries je ON je.id = ji.entry_id
+    WHERE je.user_id = %(user_id)s
+      AND je.state = 'posted'
+      AND ji.account_id IS NOT NULL
+    GROUP BY je.user_id, ji.account_id, date_trunc('month', je.date)
+"""
+
+
+def trial_balance_query(user_id, as_of_date=None):
+    """Return (query, params) of the snapshot-based trial balance"""
+    return TRIAL_BALANCE_SQL, {'user_id': user_id, 'as_of': as_of_date}
+
+
+def rebuild_snapshots(cur, user_id):
+    """
+    Recompute every snapshot of a tenant from the journal
+
+    Only needed to repair drift (e.g. after bulk SQL that bypassed the
+    triggers); normal posting keeps snapshots current on its own.
+
+    Returns:
+        int: number of (account, month) snapshots written
+    """
+    execute_update("DELETE FROM account_period_balances WHERE user_id = %(user_id)s", {'user_id': user_id}, cur=cur)
+    written = execute_update(REBUILD_SQL, {'user_id': user_id}, cur=cur)
+    logger.info(f"📚 Rebuilt {written} balance snapshots for user {user_id}")
+    return written
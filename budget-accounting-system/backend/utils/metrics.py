@@ -0,0 +1,228 @@
+# ========================================
+# FILE: utils/metrics.py
+# PURPOSE: In-process metrics rendered in the Prometheus text format (/metrics)
+# ========================================
+
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The request hook only does lock-free work: observations are appended to
+# a deque (atomic) and folded into the histogram in batches, and in-flight
+# requests are two itertools counters - see benchmarks/metrics_hook.py for the
+# per-request cost. Everything that already keeps its own counters (the
+# connection pool, the TTL caches, the password hasher, query statistics)
+# is read by a collector at scrape time, so it costs nothing per request.
+
+# Upper bounds (seconds) of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Labelled latency histogram
+
+    observe() only appends to a pending deque; every `flush_every`
+    observations (and before rendering) one thread folds them into the
+    series. Series are flat lists: one count per bucket, then +Inf, then
+    the sum; buckets are made cumulative only when rendered.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS, flush_every=256):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.flush_every = flush_every
+        self._series = {}
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        self._pending.append((labelvalues, value))
+        if len(self._pending) >= self.flush_every:
+            self.flush(wait=False)
+
+    def flush(self, wait=True):
+        """Fold pending observations into the series (skipped if another thread is already at it)"""
+        if not self._lock.acquire(blocking=wait):
+            return
+        try:
+            pending, series, buckets = self._pending, self._series, self.buckets
+            popleft = pending.popleft
+            width = len(buckets) + 1
+            for _ in range(len(pending)):
+                labelvalues, value = popleft()
+                values = series.get(labelvalues)
+                if values is None:
+                    values = series[labelvalues] = [0] * width + [0.0]
+                values[bisect_left(buckets, value)] += 1
+                values[-1] += value
+        finally:
+            self._lock.release()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        self.flush()
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+
+        for labelvalues, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(values[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labelvalues)} {cumulative}')
+        return lines
+
+
+class InFlight:
+    """
+    Requests currently being handled
+
+    enter() / exit() advance two itertools.count objects. next() on a count
+    is a single C call, so it is atomic under the GIL and needs no lock.
+    The gauge is the difference of the two. Reading it advances both
+    counters by one, which leaves the difference unchanged.
+    """
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._entered = itertools.count()
+        self._exited = itertools.count()
+        self.enter = self._entered.__next__
+        self.exit = self._exited.__next__
+
+    @property
+    def value(self):
+        exited = next(self._exited)
+        return max(next(self._entered) - exited, 0)
+
+    def render(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge', f'{self.name} {self.value}']
+
+
+def family(name, metric_type, documentation, samples, labelnames=()):
+    """
+    Lines of one metric family from collected samples
+
+    Args:
+        samples: iterable of (labelvalues tuple, value)
+    """
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {metric_type}']
+    for labelvalues, value in samples:
+        if value is None:
+            continue
+        lines.append(f'{name}{_labels(labelnames, labelvalues)} {_number(value)}')
+    return lines
+
+
+# ===== PROCESS-WIDE METRICS =====
+
+http_requests = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency by route (the _count series is the request count)',
+    ('method', 'route', 'status')
+)
+
+http_in_flight = InFlight('http_requests_in_flight', 'Requests currently being handled')
+
+gateway_requests = Histogram(
+    'phonepe_request_duration_seconds',
+    'PhonePe API call latency per attempt',
+    ('operation', 'outcome')
+)
+
+_collectors = []
+_process_started = time.time()
+
+
+def register_collector(collector):
+    """Add a callable returning metric lines, run at every scrape"""
+    _collectors.append(collector)
+    return collector
+
+
+def render():
+    """Full /metrics payload"""
+    lines = family('process_start_time_seconds', 'gauge', 'Start time of the process (Unix time)',
+                   [((), _process_started)])
+    lines += http_in_flight.render()
+    lines += http_requests.render()
+    lines += gateway_requests.render()
+
+    for collector in _collectors:
+        try:
+            lines += collector()
+        except Exception as e:
+            # One failing source must not take the whole endpoint down
+            logger.error(f"❌ Metrics collector {getattr(collector, '__name__', collector)} failed: {str(e)}")
+    return '\n'.join(lines) + '\n'
+
+
+# ===== REQUEST HOOK =====
+
+class RequestTimer:
+    """
+    Flask hooks that feed http_requests / http_in_flight
+
+    Register with init_app(app). Timing starts in before_request and is
+    recorded in teardown_request, so failed requests are counted too.
+    Unmatched URLs share one route label to keep the series bounded.
+    """
+
+    def init_app(self, app):
+        from flask import g, request
+
+        def start_timer():
+            g.metrics_started = time.perf_counter()
+            http_in_flight.enter()
+
+        def remember_status(response):
+            g.metrics_status = response.status_code
+            return response
+
+        def stop_timer(exc):
+            started = g.pop('metrics_started', None)
+            if started is None:
+                return
+            http_in_flight.exit()
+            rule = request.url_rule
+            http_requests.observe(
+                time.perf_counter() - started,
+                request.method,
+                rule.rule if rule is not None else 'unmatched',
+                str(g.pop('metrics_status', 500))
+            )
+
+        app.before_request(start_timer)
+        app.after_request(remember_status)
+        app.teardown_request(stop_timer)
@@ -0,0 +1,186 @@
+# ========================================
+# FILE: utils/pagination.py
+# PURPOSE: Keyset pagination, field selection and filters for list endpoints
+# ========================================
+
+import base64
+import json
+from datetime import date, datetime
+
+from utils.db import execute_query
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PaginationError(ValueError):
+    """Bad limit / cursor / fields / filter value in the query string (-> 400)"""
+
+
+class ListSpec:
+    """
+    Describes one list endpoint
+
+    Args:
+        fields (dict): output name -> SQL expression (insertion order = default projection)
+        from_sql (str): FROM ... JOIN ... clause
+        tenant_column (str): column compared with the current user_id
+        sort (tuple): (SQL expression, cast) of the keyset column, e.g. ('po.date', 'date')
+        id_column (str): unique tie-breaker of the keyset
+        descending (bool): newest first when True
+        filters (dict): query parameter -> SQL expression, compared with '='
+        date_column (str): column used by date_from / date_to (optional)
+    """
+
+    def __init__(self, fields, from_sql, tenant_column, sort, id_column,
+                 descending=True, filters=None, date_column=None):
+        self.fields = fields
+        self.from_sql = from_sql
+        self.tenant_column = tenant_column
+        self.sort_column, self.sort_cast = sort
+        self.id_column = id_column
+        self.descending = descending
+        self.filters = filters or {}
+        self.date_column = date_column
+
+
+# ===== CURSOR ENCODING =====
+# Opaque to clients: urlsafe base64 of [sort value, id]
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, (date, datetime)):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id], default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return sort_value, int(row_id)
+    except Exception:
+        raise PaginationError('Invalid cursor')
+
+
+# ===== QUERY STRING PARSING =====
+
+def _parse_limit(args):
+    raw = args.get('limit')
+    if raw in (None, ''):
+        return Config.LIST_DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if limit < 1:
+        raise PaginationError('limit must be at least 1')
+    return min(limit, Config.LIST_MAX_LIMIT)
+
+
+def _parse_fields(spec, args):
+    raw = args.get('fields')
+    if not raw:
+        return list(spec.fields)
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in spec.fields]
+    if unknown:
+        raise PaginationError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def _parse_date(args, name):
+    raw = args.get(name)
+    if not raw:
+        return None
+    try:
+        return datetime.strptime(raw, '%Y-%m-%d').date()
+    except ValueError:
+        raise PaginationError(f'{name} must be YYYY-MM-DD')
+
+
+# ===== PAGE QUERY =====
+
+def fetch_page(spec, user_id, args, cur=None):
+    """
+    Run one page of a list query
+
+    Query parameters understood:
+        limit, cursor, fields (comma separated), date_from, date_to
+        and every key of spec.filters
+
+    Without limit/cursor (and LIST_DEFAULT_LIMIT = None) the whole list is
+    returned, as before.
+
+    Returns:
+        tuple: (rows, next_cursor or None)
+    """
+    limit = _parse_limit(args)
+    fields = _parse_fields(spec, args)
+
+    where = [f"{spec.tenant_column} = %s"]
+    params = [user_id]
+
+    for name, column in spec.filters.items():
+        value = args.get(name)
+        if value not in (None, ''):
+            if name.endswith('_id') and not value.isdigit():
+                raise PaginationError(f'{name} must be an integer')
+            where.append(f"{column} = %s")
+            params.append(value)
+
+    if spec.date_column:
+        date_from = _parse_date(args, 'date_from')
+        date_to = _parse_date(args, 'date_to')
+        if date_from:
+            where.append(f"{spec.date_column} >= %s")
+            params.append(date_from)
+        if date_to:
+            where.append(f"{spec.date_column} <= %s")
+            params.append(date_to)
+
+    # Keyset condition: rows strictly after the cursor in sort order
+    cursor = args.get('cursor')
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        operator = '<' if spec.descending else '>'
+        where.append(
+            f"({spec.sort_column}, {spec.id_column}) {operator} (%s::{spec.sort_cast}, %s)"
+        )
+        params.extend([sort_value, row_id])
+
+    direction = 'DESC' if spec.descending else 'ASC'
+    select = [f"{spec.fields[name]} as {name}" for name in fields]
+    select.append(f"{spec.sort_column} as _cursor_sort")
+    select.append(f"{spec.id_column} as _cursor_id")
+
+    query = f"""
+        SELECT {', '.join(select)}
+        {spec.from_sql}
+        WHERE {' AND '.join(where)}
+        ORDER BY {spec.sort_column} {direction}, {spec.id_column} {direction}
+    """
+
+    # One extra row tells whether another page exists
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+
+    rows = execute_query(query, tuple(params), cur=cur)
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['_cursor_sort'], rows[-1]['_cursor_id'])
+
+    for row in rows:
+        del row['_cursor_sort']
+        del row['_cursor_id']
+
+    return rows, next_cursor
+
+
+def page_headers(next_cursor):
+    """Response headers for a page (X-Next-Cursor only when there is a next page)"""
+    return {'X-Next-Cursor': next_cursor} if next_cursor else {}
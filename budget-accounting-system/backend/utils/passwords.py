@@ -0,0 +1,200 @@
+# ========================================
+# FILE: utils/passwords.py
+# PURPOSE: Bcrypt hashing off the request threads, adaptive cost and login throttling
+# ========================================
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# bcrypt is deliberately slow (~250 ms at cost 12), so a login storm used to
+# pin every request thread on it and stall unrelated endpoints. Hashes and
+# checks now run in a small process pool; at most workers + max_queue jobs
+# may be in flight, and a request that cannot get a slot within
+# queue_timeout is answered 503 instead of piling up behind the others.
+#
+# The cost factor comes from Config.PASSWORD_HASH_ROUNDS. Hashes made with
+# another cost keep working and are re-hashed transparently on the next
+# successful login (needs_rehash()).
+
+
+class HasherBusy(RuntimeError):
+    """Too many hash jobs already queued (-> 503 with Retry-After)"""
+
+
+def _hash(password, rounds):
+    """Module level so a process pool can pickle it"""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+
+def hash_cost(password_hash):
+    """Cost factor stored in a '$2b$12$...' hash (None if unparseable)"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """
+    Bounded bcrypt worker pool
+
+    Args:
+        rounds (int): bcrypt cost for new hashes
+        workers (int): hashing processes (0 = hash in the calling thread, still bounded)
+        max_queue (int): jobs allowed to wait for a worker
+        queue_timeout (float): seconds a request waits for a slot before HasherBusy
+    """
+
+    def __init__(self, rounds=12, workers=2, max_queue=32, queue_timeout=2.0):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _executor(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            logger.warning("⚠️ Password hasher saturated, rejecting request")
+            raise HasherBusy('Too many login attempts in progress, please retry shortly')
+
+        with self._lock:
+            self.in_flight += 1
+        try:
+            if self.workers:
+                return self._executor().submit(func, *args).result()
+            return func(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def hash(self, password):
+        """bcrypt hash of `password` at the configured cost (str)"""
+        return self._run(_hash, password.encode('utf-8'), self.rounds).decode('utf-8')
+
+    def verify(self, password, password_hash):
+        """True if `password` matches; False for a wrong password or a malformed hash"""
+        try:
+            return self._run(_check, password.encode('utf-8'), password_hash.encode('utf-8'))
+        except HasherBusy:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Password verification error: {str(e)}")
+            return False
+
+    def needs_rehash(self, password_hash):
+        return hash_cost(password_hash) != self.rounds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+# ===== THROTTLING =====
+
+class AttemptThrottle:
+    """
+    Sliding-window attempt counter per key (client IP, email)
+
+    Keeps at most `max_keys` keys (least recently used are dropped), so a
+    flood of distinct keys cannot grow memory without bound.
+    """
+
+    def __init__(self, limit, window, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        return attempts
+
+    def retry_after(self, key):
+        """Seconds until `key` may try again (0 = allowed now)"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, now)
+            if not attempts or len(attempts) < self.limit:
+                return 0
+            return max(1, int(attempts[0] + self.window - now) + 1)
+
+    def record(self, key):
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, now)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+            attempts.append(now)
+            self._attempts.move_to_end(key)
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._attempts), 'limit': self.limit, 'window_seconds': self.window}
+
+
+# ===== PROCESS-WIDE INSTANCES =====
+
+hasher = PasswordHasher(
+    rounds=Config.PASSWORD_HASH_ROUNDS,
+    workers=Config.PASSWORD_HASH_WORKERS,
+    max_queue=Config.PASSWORD_HASH_MAX_QUEUE,
+    queue_timeout=Config.PASSWORD_HASH_QUEUE_TIMEOUT
+)
+
+# Failed logins/signups from one client IP (request.remote_addr, see
+# TRUSTED_PROXY_COUNT when running behind a proxy)
+ip_throttle = AttemptThrottle(Config.AUTH_IP_ATTEMPT_LIMIT, Config.AUTH_THROTTLE_WINDOW)
+
+# Failed logins for one email (cleared by a successful login)
+email_throttle = AttemptThrottle(Config.AUTH_EMAIL_FAILURE_LIMIT, Config.AUTH_THROTTLE_WINDOW)
@@ -0,0 +1,150 @@
+# ========================================
+# FILE: utils/payments.py
+# PURPOSE: Single place where payments are recorded and invoices credited
+# ========================================
+
+from utils.db import execute_query, execute_update
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Every endpoint that takes money (PhonePe verify / reconciler, payment
+# simulator, portal payment, manual payment entry) goes through
+# apply_payment(), which makes a payment exactly-once per idempotency key:
+#
+#   1. the invoice row is locked (SELECT ... FOR UPDATE), so concurrent
+#      applications to one invoice run one after the other
+#   2. the payments row is inserted with ON CONFLICT DO NOTHING - the unique
+#      indexes are the real guard: (user_id, idempotency_key) from migration
+#      014, and idempotency_key alone for gateway keys (migration 017), so a
+#      gateway transaction credits one invoice whichever tenant asks
+#   3. only when that insert created a row is the invoice credited
+#
+# A retry with the same key therefore returns the original payment without
+# touching the invoice. Payments without a key behave as before (no dedupe).
+
+# Keys unique across tenants (partial index of migration 017)
+GATEWAY_KEY_PATTERN = 'phonepe:%'
+
+# payment_method -> customer_invoices column credited
+PAID_COLUMNS = {
+    'cash': 'paid_via_cash',
+    'bank': 'paid_via_bank',
+    'online': 'paid_via_online',
+}
+
+LOCK_INVOICE_SQL = """
+    SELECT id, user_id, customer_id
+    FROM customer_invoices
+    WHERE id = %(invoice_id)s
+      AND (%(user_id)s::integer IS NULL OR user_id = %(user_id)s::integer)
+    FOR UPDATE
+"""
+
+INSERT_PAYMENT_SQL = """
+    INSERT INTO payments
+    (user_id, reference, date, payment_type, payment_method, amount,
+     invoice_id, bill_id, customer_id, vendor_id, notes, idempotency_key)
+    VALUES (%(user_id)s, %(reference)s, COALESCE(%(date)s::date, CURRENT_DATE), %(payment_type)s,
+            %(payment_method)s, %(amount)s, %(invoice_id)s, %(bill_id)s, %(customer_id)s,
+            %(vendor_id)s, %(notes)s, %(idempotency_key)s)
+    ON CONFLICT DO NOTHING
+    RETURNING id
+"""
+
+EXISTING_PAYMENT_SQL = """
+    SELECT id
+    FROM payments
+    WHERE idempotency_key = %(idempotency_key)s
+      AND (user_id = %(user_id)s OR idempotency_key LIKE %(gateway_pattern)s)
+    LIMIT 1
+"""
+
+
+class InvoiceNotFound(LookupError):
+    """The invoice does not exist (or belongs to another tenant)"""
+
+
+def apply_payment(cur, amount, user_id=None, invoice_id=None, idempotency_key=None,
+                  payment_method='online', payment_type='customer', reference=None,
+                  date=None, bill_id=None, customer_id=None, vendor_id=None, notes=None):
+    """
+    Record a payment and credit its invoice, at most once per idempotency key
+
+    Args:
+        cur: cursor inside transaction()
+        amount: payment amount
+        user_id (int): tenant; when None it is taken from the invoice
+        invoice_id (int): customer invoice to credit (optional)
+        idempotency_key (str): e.g. 'phonepe:<txn_id>' or a client-supplied key
+        payment_method (str): 'cash', 'bank' or 'online' (selects the paid_via_* column)
+
+    Returns:
+        dict: {'payment_id': int, 'applied': bool} - applied is False when the
+              key had already been used (nothing was written)
+
+    Raises:
+        InvoiceNotFound: invoice_id given but not found for this tenant
+    """
+    if invoice_id is not None:
+        invoice = execute_query(LOCK_INVOICE_SQL, {'invoice_id': invoice_id, 'user_id': user_id}, cur=cur)
+        if not invoice:
+            raise InvoiceNotFound(f'Invoice {invoice_id} not found')
+        user_id = invoice[0]['user_id']
+        if customer_id is None and payment_type == 'customer':
+            customer_id = invoice[0]['customer_id']
+
+    if user_id is None:
+        raise ValueError('user_id is required when no invoice is given')
+
+    rows = execute_query(INSERT_PAYMENT_SQL, {
+        'user_id': user_id,
+        'reference': reference,
+        'date': date,
+        'payment_type': payment_type,
+        'payment_method': payment_method,
+        'amount': amount,
+        'invoice_id': invoice_id,
+        'bill_id': bill_id,
+        'customer_id': customer_id,
+        'vendor_id': vendor_id,
+        'notes': notes,
+        'idempotency_key': idempotency_key
+    }, cur=cur)
+
+    if not rows:
+        existing = execute_query(EXISTING_PAYMENT_SQL, {
+            'user_id': user_id,
+            'idempotency_key': idempotency_key,
+            'gateway_pattern': GATEWAY_KEY_PATTERN
+        }, cur=cur)
+        if not existing:
+            # DO NOTHING has no conflict target; anything but a key conflict is a real error
+            raise ValueError(f"Payment {reference or ''} conflicts with an existing payment")
+        logger.info(f"↩️ Payment '{idempotency_key}' already applied, skipping")
+        return {'payment_id': existing[0]['id'], 'applied': False}
+
+    payment_id = rows[0]['id']
+
+    if invoice_id is not None:
+        column = PAID_COLUMNS.get(payment_method, 'paid_via_online')
+        execute_update(f"""
+            UPDATE customer_invoices
+            SET {column} = {column} + %s
+            WHERE id = %s
+        """, (amount, invoice_id), cur=cur)
+
+    logger.info(f"💰 Payment {payment_id} applied: ₹{amount} ({payment_method}) invoice {invoice_id}")
+    return {'payment_id': payment_id, 'applied': True}
+
+
+def request_idempotency_key(request, data=None):
+    """
+    Client-supplied key: Idempotency-Key header, else 'idempotency_key' in the JSON body
+
+    Prefixed with 'client:' so it can never collide with server-side keys
+    such as 'phonepe:<txn_id>'.
+    """
+    key = request.headers.get('Idempotency-Key') or (data or {}).get('idempotency_key')
+    key = str(key).strip() if key else ''
+    return f"client:{key[:140]}" if key else None
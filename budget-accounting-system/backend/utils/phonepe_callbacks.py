@@ -0,0 +1,212 @@
+# ========================================
+# FILE: utils/phonepe_callbacks.py
+# PURPOSE: PhonePe server-to-server callbacks (verify, queue, apply)
+# ========================================
+
+import base64
+import hmac
+import json
+import threading
+import time
+
+from utils.db import execute_query, execute_update, execute_insert, transaction
+from utils.phonepe_client import get_phonepe_client
+from utils.reconciler import record_status, publish_outcome
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# PhonePe POSTs {"response": "<base64 JSON>"} to the callbackUrl given at
+# initiation, signed with X-VERIFY = SHA256(response + SaltKey) ### SaltIndex.
+# The endpoint only verifies and stores the event (a single INSERT) so it
+# answers PhonePe immediately; CallbackWorker applies queued events with the
+# same record_status() transition as the verify endpoint and the reconciler,
+# so a callback, a browser verify and a reconciler poll can all see the same
+# PAYMENT_SUCCESS and the invoice is still credited once.
+
+CLAIM_EVENTS_SQL = """
+    WITH due AS (
+        SELECT id
+        FROM phonepe_callback_events
+        WHERE status = 'queued' AND next_attempt_at <= CURRENT_TIMESTAMP
+        ORDER BY id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE phonepe_callback_events e
+    SET status = 'processing', attempts = attempts + 1, claimed_at = CURRENT_TIMESTAMP
+    FROM due
+    WHERE e.id = due.id
+    RETURNING e.id, e.merchant_transaction_id, e.payload, e.attempts
+"""
+
+# Events left 'processing' this long (worker crashed mid-batch) go back to the queue
+STALE_CLAIM_SECONDS = 300
+
+REQUEUE_STALE_SQL = """
+    UPDATE phonepe_callback_events
+    SET status = 'queued'
+    WHERE status = 'processing'
+      AND claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %(stale_after)s)
+"""
+
+
+class CallbackError(ValueError):
+    """Callback body or checksum is invalid (-> 401, nothing is queued)"""
+
+
+def verify_callback(encoded_response, x_verify):
+    """
+    Check the X-VERIFY header of a callback and decode its payload
+
+    Returns:
+        dict: decoded PhonePe status body
+
+    Raises:
+        CallbackError: missing/invalid checksum or undecodable body
+    """
+    if not encoded_response or not x_verify:
+        raise CallbackError('Missing response or X-VERIFY header')
+
+    expected = get_phonepe_client().x_verify(encoded_response)
+    if not hmac.compare_digest(expected, x_verify):
+        raise CallbackError('Invalid X-VERIFY checksum')
+
+    try:
+        payload = json.loads(base64.b64decode(encoded_response))
+    except (ValueError, TypeError):
+        raise CallbackError('Callback response is not base64 JSON')
+
+    if not (payload.get('data') or {}).get('merchantTransactionId'):
+        raise CallbackError('Callback has no merchantTransactionId')
+    return payload
+
+
+def enqueue_callback(payload):
+    """Store a verified callback for the worker; returns the event id"""
+    txn_id = payload['data']['merchantTransactionId']
+    rows = execute_insert("""
+        INSERT INTO phonepe_callback_events (merchant_transaction_id, code, payload)
+        VALUES (%s, %s, %s)
+        RETURNING id
+    """, (txn_id, payload.get('code'), json.dumps(payload)))
+    get_callback_worker().wake()
+    return rows[0]['id']
+
+
+class CallbackWorker:
+    """
+    Applies queued callback events on a daemon thread
+
+    Woken right away by enqueue_callback() in this process; other processes'
+    events are picked up by the periodic poll.
+    """
+
+    def __init__(self, batch_size=None, poll_interval=None):
+        self.batch_size = batch_size or Config.PHONEPE_CALLBACK_BATCH_SIZE
+        self.poll_interval = poll_interval or Config.PHONEPE_CALLBACK_POLL_INTERVAL
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.totals = {'applied': 0, 'unchanged': 0, 'retried': 0, 'failed': 0}
+
+    def wake(self):
+        self._wake.set()
+
+    def process_once(self):
+        """Apply one batch of queued events; returns the number processed"""
+        with transaction() as cur:
+            execute_update(REQUEUE_STALE_SQL, {'stale_after': STALE_CLAIM_SECONDS}, cur=cur)
+            events = execute_query(CLAIM_EVENTS_SQL, {'limit': self.batch_size}, cur=cur)
+
+        for event in events:
+            payload = event['payload']
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            try:
+                with transaction() as cur:
+                    outcome = record_status(cur, event['merchant_transaction_id'], payload)
+                    execute_update("""
+                        UPDATE phonepe_callback_events
+                        SET status = 'done', outcome = %s, last_error = NULL, processed_at = CURRENT_TIMESTAMP
+                        WHERE id = %s
+                    """, (outcome, event['id']), cur=cur)
+                publish_outcome(event['merchant_transaction_id'], outcome)
+                self.totals['applied' if outcome != 'unchanged' else 'unchanged'] += 1
+                logger.info(f"📨 PhonePe callback {event['id']} ({event['merchant_transaction_id']}): {outcome}")
+
+            except Exception as e:
+                # Retry with a growing delay; give up after PHONEPE_CALLBACK_MAX_ATTEMPTS
+                # (the reconciler still polls the transaction in that case)
+                give_up = event['attempts'] >= Config.PHONEPE_CALLBACK_MAX_ATTEMPTS
+                execute_update("""
+                    UPDATE phonepe_callback_events
+                    SET status = %s,
+                        last_error = %s,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    WHERE id = %s
+                """, (
+                    'failed' if give_up else 'queued',
+                    str(e)[:500],
+                    Config.PHONEPE_CALLBACK_RETRY_DELAY * (2 ** (event['attempts'] - 1)),
+                    event['id']
+                ))
+                self.totals['failed' if give_up else 'retried'] += 1
+                logger.error(f"❌ PhonePe callback {event['id']} failed (attempt {event['attempts']}): {str(e)}")
+
+        return len(events)
+
+    def _loop(self):
+        logger.info("📨 PhonePe callback worker started")
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                # Drain: keep going while full batches come back
+                while self.process_once() == self.batch_size and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                logger.error(f"❌ PhonePe callback worker error: {str(e)}")
+                time.sleep(self.poll_interval)
+        logger.info("🛑 PhonePe callback worker stopped")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='phonepe-callbacks', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'poll_interval_seconds': self.poll_interval,
+            'totals': dict(self.totals)
+        }
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_callback_worker():
+    """Process-wide callback worker (not started until start_callback_worker())"""
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = CallbackWorker()
+    return _worker
+
+
+def start_callback_worker():
+    worker = get_callback_worker()
+    worker.start()
+    return worker
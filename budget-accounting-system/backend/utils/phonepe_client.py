@@ -0,0 +1,261 @@
+# ========================================
+# FILE: utils/phonepe_client.py
+# PURPOSE: PhonePe gateway client (pooled session, timeouts, retries, circuit breaker)
+# ========================================
+
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from utils.metrics import gateway_requests
+import logging
+
+logger = logging.getLogger(__name__)
+
+PAY_PATH = "/pg/v1/pay"
+STATUS_PATH = "/pg/v1/status/{merchant_id}/{txn_id}"
+
+# Responses worth another attempt (the request did not take effect)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class GatewayError(Exception):
+    """PhonePe could not be reached or answered with something unusable"""
+
+
+class GatewayUnavailable(GatewayError):
+    """Circuit breaker is open - calls are refused without touching the network"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing gateway for a while
+
+    closed    -> calls go through; `failure_threshold` consecutive failures open it
+    open      -> calls fail fast until `reset_timeout` seconds have passed
+    half-open -> one trial call; success closes, failure opens again
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == 'open' or (state == 'half-open' and self._trial_running):
+                raise GatewayUnavailable("PhonePe gateway temporarily unavailable (circuit open)")
+            if state == 'half-open':
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"⚠️ PhonePe circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+
+class PhonePeClient:
+    """
+    Thread-safe client for the PhonePe PG v1 API
+
+    - One pooled requests.Session (keep-alive connections are reused)
+    - (connect, read) timeouts on every call
+    - Retries with exponential backoff + jitter; a pay request is only
+      retried when it never reached the gateway (connection errors)
+    - Circuit breaker shared by all calls
+    """
+
+    def __init__(self, merchant_id=None, salt_key=None, salt_index=None, base_url=None):
+        self.merchant_id = merchant_id or Config.PHONEPE_MERCHANT_ID
+        self.salt_key = salt_key or Config.PHONEPE_SALT_KEY
+        self.salt_index = salt_index or Config.PHONEPE_SALT_INDEX
+        self.base_url = (base_url or Config.PHONEPE_BASE_URL).rstrip('/')
+        self.timeout = (Config.PHONEPE_CONNECT_TIMEOUT, Config.PHONEPE_READ_TIMEOUT)
+        self.max_retries = Config.PHONEPE_MAX_RETRIES
+        self.backoff = Config.PHONEPE_RETRY_BACKOFF
+
+        self.breaker = CircuitBreaker(
+            failure_threshold=Config.PHONEPE_BREAKER_THRESHOLD,
+            reset_timeout=Config.PHONEPE_BREAKER_RESET
+        )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=Config.PHONEPE_HTTP_POOL_SIZE,
+            max_retries=0
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "accept": "application/json"
+        })
+
+    # ----- checksums -----
+
+    def x_verify(self, data):
+        """X-VERIFY header: SHA256(data + SaltKey) + "###" + SaltIndex"""
+        digest = hashlib.sha256((data + self.salt_key).encode()).hexdigest()
+        return f"{digest}###{self.salt_index}"
+
+    # ----- transport -----
+
+    def _request(self, operation, method, path, retry_on_timeout, **kwargs):
+        url = self.base_url + path
+        attempts = self.max_retries + 1
+
+        for attempt in range(1, attempts + 1):
+            self.breaker.before_call()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                # Includes connect timeouts: the request never reached PhonePe
+                error, retryable = e, True
+                gateway_requests.observe(time.perf_counter() - started, operation, 'connection_error')
+            except requests.Timeout as e:
+                # Read timeout: PhonePe may have acted on it
+                error, retryable = e, retry_on_timeout
+                gateway_requests.observe(time.perf_counter() - started, operation, 'timeout')
+            except requests.RequestException as e:
+                # Broken/undecodable body, redirect loop, bad URL: not worth repeating
+                error, retryable = e, False
+                gateway_requests.observe(time.perf_counter() - started, operation, 'request_error')
+            except BaseException:
+                # Anything else still has to settle the breaker, or a half-open
+                # trial would stay 'running' and refuse every call until restart
+                self.breaker.record_failure()
+                raise
+            else:
+                gateway_requests.observe(time.perf_counter() - started, operation, f"http_{response.status_code}")
+                if response.status_code in RETRY_STATUS_CODES:
+                    error, retryable = GatewayError(f"PhonePe returned HTTP {response.status_code}"), retry_on_timeout
+                else:
+                    try:
+                        data = response.json()
+                    except ValueError:
+                        self.breaker.record_failure()
+                        raise GatewayError(f"PhonePe returned a non-JSON response (HTTP {response.status_code})")
+                    self.breaker.record_success()
+                    return data
+
+            self.breaker.record_failure()
+            if not retryable or attempt == attempts:
+                logger.error(f"❌ PhonePe {method} {path} failed after {attempt} attempt(s): {error}")
+                raise GatewayError(str(error))
+
+            delay = self.backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.25)
+            logger.warning(f"⚠️ PhonePe {method} {path} attempt {attempt} failed ({error}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    # ----- API -----
+
+    def pay(self, payload):
+        """
+        Create a PAY_PAGE transaction
+
+        Args:
+            payload (dict): PhonePe pay request (merchantId is filled in if missing)
+
+        Returns:
+            dict: PhonePe response body
+        """
+        payload = dict(payload)
+        payload.setdefault('merchantId', self.merchant_id)
+        base64_payload = base64.b64encode(json.dumps(payload).encode()).decode()
+
+        return self._request(
+            'pay', 'POST', PAY_PATH,
+            retry_on_timeout=False,
+            json={"request": base64_payload},
+            headers={"X-VERIFY": self.x_verify(base64_payload + PAY_PATH)}
+        )
+
+    def status(self, txn_id):
+        """Check a transaction's status (read-only, safe to retry)"""
+        path = STATUS_PATH.format(merchant_id=self.merchant_id, txn_id=txn_id)
+        return self._request(
+            'status', 'GET', path,
+            retry_on_timeout=True,
+            headers={"X-VERIFY": self.x_verify(path), "X-MERCHANT-ID": self.merchant_id}
+        )
+
+    # ----- async variants -----
+    # requests is blocking; these run the call on a worker thread so an
+    # asyncio caller (or a batch of status checks) does not block its loop
+
+    async def pay_async(self, payload):
+        return await asyncio.to_thread(self.pay, payload)
+
+    async def status_async(self, txn_id):
+        return await asyncio.to_thread(self.status, txn_id)
+
+    async def status_many(self, txn_ids, concurrency=5):
+        """
+        Check many transactions concurrently
+
+        Returns:
+            dict: txn_id -> response dict, or the GatewayError raised for it
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(txn_id):
+            async with semaphore:
+                try:
+                    return txn_id, await self.status_async(txn_id)
+                except GatewayError as e:
+                    return txn_id, e
+
+        return dict(await asyncio.gather(*(one(txn_id) for txn_id in txn_ids)))
+
+    def stats(self):
+        return {'circuit': self.breaker.state, 'base_url': self.base_url}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_phonepe_client():
+    """Process-wide client (shares the HTTP connection pool and circuit breaker)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PhonePeClient()
+    return _client
@@ -0,0 +1,279 @@
+# ========================================
+# FILE: utils/pool.py
+# PURPOSE: Thread-safe, bounded PostgreSQL connection pool
+# ========================================
+
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in milliseconds) of the checkout wait-time histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PoolTimeout(pg_pool.PoolError):
+    """Raised when no connection becomes available before the checkout timeout"""
+
+
+class BoundedConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool
+
+    - Keeps between min_size and max_size connections open
+    - getconn() blocks (FIFO wait queue) until a connection is free or the
+      timeout expires, instead of failing immediately when exhausted
+    - Idle connections are health checked before being handed out and
+      replaced transparently when dead
+    - stats() exposes in-use / idle / waiters counts and a wait-time histogram
+    """
+
+    def __init__(self, min_size, max_size, timeout=30.0, health_check_interval=30.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (min_size, max_size))
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._connect_kwargs = connect_kwargs
+
+        self._lock = threading.Lock()
+        self._idle = deque()        # (connection, last_used_monotonic)
+        self._in_use = set()        # id(connection)
+        self._owned = set()         # id(connection) of every open connection this pool created
+        self._waiters = deque()     # threading.Event per waiting thread (FIFO)
+        self._size = 0              # open connections (idle + in use + being opened)
+        self._closed = False
+
+        # Counters
+        self._checkouts = 0
+        self._timeouts = 0
+        self._replaced = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+        for _ in range(min_size):
+            connection = self._connect()
+            self._idle.append((connection, time.monotonic()))
+            self._owned.add(id(connection))
+            self._size += 1
+
+    # ----- connection lifecycle -----
+
+    def _connect(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, connection, last_used):
+        """Cheap check first, round-trip ping only for connections idle for a while"""
+        if connection.closed:
+            return False
+        if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    # ----- checkout / checkin -----
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to `timeout` seconds for one to free up"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            connection, last_used, must_open = self._reserve(deadline)
+
+            if must_open:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+            elif not self._is_healthy(connection, last_used):
+                logger.warning("⚠️ Replacing dead pooled connection")
+                self._close_quietly(connection)
+                with self._lock:
+                    self._owned.discard(id(connection))
+                self._release_slot(replaced=True)
+                continue
+
+            waited = time.monotonic() - started
+            with self._lock:
+                self._owned.add(id(connection))
+                self._in_use.add(id(connection))
+                self._record_wait(waited)
+            return connection
+
+    def _reserve(self, deadline):
+        """
+        Reserve an idle connection or a slot for a new one.
+        Returns (connection, last_used, must_open)
+        """
+        event = None
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise pg_pool.PoolError("connection pool is closed")
+
+                # Waiters are served in FIFO order; a fresh caller only skips
+                # the queue when nobody is waiting
+                if event is None and self._waiters:
+                    event = threading.Event()
+                    self._waiters.append(event)
+
+                if event is None or self._waiters[0] is event:
+                    if self._idle:
+                        connection, last_used = self._idle.pop()
+                        self._dequeue(event)
+                        return connection, last_used, False
+                    if self._size < self.max_size:
+                        self._size += 1
+                        self._dequeue(event)
+                        return None, None, True
+
+                if event is None:
+                    event = threading.Event()
+                    self._waiters.append(event)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(event)
+                    self._timeouts += 1
+                    self._wake_next()
+                    raise PoolTimeout(
+                        "Timed out waiting for a database connection (max_size=%s)" % self.max_size
+                    )
+
+                event.clear()
+                self._lock.release()
+                try:
+                    event.wait(remaining)
+                finally:
+                    self._lock.acquire()
+
+    def _dequeue(self, event):
+        if event is not None:
+            self._waiters.popleft()
+            self._wake_next()
+
+    def _wake_next(self):
+        if self._waiters and (self._idle or self._size < self.max_size):
+            self._waiters[0].set()
+
+    def _release_slot(self, replaced=False):
+        with self._lock:
+            self._size -= 1
+            if replaced:
+                self._replaced += 1
+            self._wake_next()
+
+    def putconn(self, connection, close=False):
+        """Return a connection to the pool (or discard it if broken)"""
+        if connection is None:
+            return
+
+        with self._lock:
+            # A foreign or already returned connection would corrupt the size accounting
+            if id(connection) not in self._owned:
+                raise pg_pool.PoolError("trying to put a connection that was not taken from this pool")
+            if id(connection) not in self._in_use:
+                raise pg_pool.PoolError("trying to put a connection that is already back in the pool")
+            self._in_use.discard(id(connection))
+
+        if not close and not connection.closed:
+            # Never hand out a connection with an open transaction
+            try:
+                status = connection.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except Exception:
+                close = True
+
+        with self._lock:
+            if close or connection.closed or self._closed:
+                self._owned.discard(id(connection))
+                self._size -= 1
+                discard = True
+            else:
+                self._idle.append((connection, time.monotonic()))
+                discard = False
+            self._wake_next()
+
+        if discard:
+            self._close_quietly(connection)
+
+    def closeall(self):
+        """Close every idle connection and refuse further checkouts"""
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            for connection, _ in idle:
+                self._owned.discard(id(connection))
+            for event in self._waiters:
+                event.set()
+
+        for connection, _ in idle:
+            self._close_quietly(connection)
+
+    # ----- statistics -----
+
+    def _record_wait(self, waited):
+        self._checkouts += 1
+        self._wait_total += waited
+        if waited > self._wait_max:
+            self._wait_max = waited
+        waited_ms = waited * 1000
+        for index, bound in enumerate(WAIT_BUCKETS_MS):
+            if waited_ms <= bound:
+                self._wait_buckets[index] += 1
+                break
+        else:
+            self._wait_buckets[-1] += 1
+
+    def stats(self):
+        """Snapshot of the pool state for monitoring and sizing"""
+        with self._lock:
+            histogram = {'le_%sms' % bound: count for bound, count in zip(WAIT_BUCKETS_MS, self._wait_buckets)}
+            histogram['gt_%sms' % WAIT_BUCKETS_MS[-1]] = self._wait_buckets[-1]
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiters': len(self._waiters),
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'replaced_connections': self._replaced,
+                'wait_time_avg_ms': round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_max * 1000, 3),
+                'wait_time_histogram': histogram,
+            }
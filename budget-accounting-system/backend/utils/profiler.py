@@ -0,0 +1,258 @@
+# ========================================
+# FILE: utils/profiler.py
+# PURPOSE: Opt-in per-request sampling profiler (time breakdown + collapsed stacks)
+# ========================================
+
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A request is profiled when it carries the profiling header and is allowed
+# to (X-Profile: 1 from a caller `authorize` accepts - admin tokens in
+# app.py - or X-Profile: <secret>), or when the sample rate picks it. At
+# most max_per_minute profiles are taken, and only the newest max_files
+# are kept on disk, so the header cannot be used to fill the disk.
+# While a profiled request runs:
+#   - a shared sampler thread reads the request thread's stack every
+#     interval_ms (sys._current_frames) and counts collapsed stacks
+#   - InstrumentedCursor (utils/query_stats.py) adds statement time and
+#     TimedJSONProvider adds JSON encoding time to request_timings.current
+# The response gets Server-Timing (db, json, python, total) and X-Profile-Id
+# headers, and <id>.folded / <id>.json are written to the output directory.
+# .folded files are in the collapsed-stack format used by flamegraph.pl and
+# speedscope. Requests that are not profiled only pay for the header check.
+
+# Thread-local timings of the profiled request on this thread (None otherwise)
+request_timings = threading.local()
+
+MAX_STACK_DEPTH = 128
+
+
+def collapse(frame):
+    """'outer;...;inner' stack string of a frame (frames as 'function (file.py:line)')"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    One daemon thread sampling the stacks of the threads being profiled
+
+    Runs only while at least one thread is registered.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._targets = {}  # thread ident -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, ident):
+        samples = Counter()
+        with self._lock:
+            self._targets[ident] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='request-profiler', daemon=True)
+                self._thread.start()
+        return samples
+
+    def remove(self, ident):
+        with self._lock:
+            return self._targets.pop(ident, Counter())
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                targets = list(self._targets.items())
+
+            frames = sys._current_frames()
+            for ident, samples in targets:
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples[collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class RequestProfiler:
+    """
+    Flask middleware for sampled request profiles
+
+    Args:
+        output_dir (str): where .folded / .json profiles are written
+        sample_rate (float): share of requests profiled without the header (0 = header only)
+        interval_ms (float): stack sampling interval
+        header (str): request header that asks for a profile
+        authorize (callable): returns True when the current request may use
+            '<header>: 1' (None = nobody)
+        secret (str): header value that asks for a profile without authorize()
+        max_per_minute (int): profiles taken per minute, the rest are skipped
+        max_files (int): profiles kept in output_dir (oldest are deleted)
+    """
+
+    def __init__(self, output_dir, sample_rate=0.0, interval_ms=5, header='X-Profile',
+                 authorize=None, secret=None, max_per_minute=30, max_files=200):
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.header = header
+        self.authorize = authorize
+        self.secret = secret
+        self.max_per_minute = max_per_minute
+        self.max_files = max_files
+        self.sampler = StackSampler(interval_ms / 1000)
+        self.profiled = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._window_start = 0.0
+        self._window_count = 0
+
+    def _requested(self, request):
+        value = request.headers.get(self.header)
+        if not value:
+            return False
+        if self.secret and hmac.compare_digest(value.encode('utf-8'), self.secret.encode('utf-8')):
+            return True
+        return value.lower() in ('1', 'true', 'yes') and self.authorize is not None and bool(self.authorize())
+
+    def _take_slot(self):
+        """Count one profile against the per-minute cap; False when the cap is reached"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= 60:
+                self._window_start, self._window_count = now, 0
+            if self._window_count >= self.max_per_minute:
+                self.skipped += 1
+                return False
+            self._window_count += 1
+            return True
+
+    def _wanted(self, request):
+        wanted = self._requested(request) or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        return wanted and self._take_slot()
+
+    def init_app(self, app):
+        from flask import g, request
+        from flask.json.provider import DefaultJSONProvider
+
+        class TimedJSONProvider(DefaultJSONProvider):
+            """Adds JSON encoding time to the profiled request's breakdown"""
+
+            def dumps(self, obj, **kwargs):
+                timings = getattr(request_timings, 'current', None)
+                if timings is None:
+                    return super().dumps(obj, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return super().dumps(obj, **kwargs)
+                finally:
+                    timings['json'] += time.perf_counter() - started
+
+        app.json = TimedJSONProvider(app)
+
+        def start_profile():
+            if not self._wanted(request):
+                return
+            ident = threading.get_ident()
+            request_timings.current = {'db': 0.0, 'json': 0.0}
+            g.profile = {
+                'id': uuid.uuid4().hex[:12],
+                'ident': ident,
+                'started': time.perf_counter(),
+                'samples': self.sampler.add(ident)
+            }
+
+        def finish_profile(response):
+            profile = g.pop('profile', None)
+            if profile is None:
+                return response
+            total = time.perf_counter() - profile['started']
+            timings = self._stop(profile)
+            python = max(total - timings['db'] - timings['json'], 0.0)
+
+            response.headers['X-Profile-Id'] = profile['id']
+            response.headers['Server-Timing'] = ', '.join(
+                f"{name};dur={seconds * 1000:.3f}"
+                for name, seconds in (('db', timings['db']), ('json', timings['json']),
+                                      ('python', python), ('total', total))
+            )
+            self._write(profile, request, response.status_code, {
+                'total_ms': round(total * 1000, 3),
+                'db_ms': round(timings['db'] * 1000, 3),
+                'json_ms': round(timings['json'] * 1000, 3),
+                'python_ms': round(python * 1000, 3)
+            })
+            return response
+
+        def abandon_profile(exc):
+            # after_request did not run (unhandled error): just stop sampling
+            profile = g.pop('profile', None)
+            if profile is not None:
+                self._stop(profile)
+
+        app.before_request(start_profile)
+        app.after_request(finish_profile)
+        app.teardown_request(abandon_profile)
+
+    def _stop(self, profile):
+        profile['samples'] = self.sampler.remove(profile['ident'])
+        timings = getattr(request_timings, 'current', None) or {'db': 0.0, 'json': 0.0}
+        request_timings.current = None
+        return timings
+
+    def _write(self, profile, request, status, breakdown):
+        """Dump <id>.folded (flame graph input) and <id>.json (breakdown)"""
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            rule = request.url_rule.rule if request.url_rule is not None else request.path
+            base = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{profile['id']}")
+
+            with open(base + '.folded', 'w') as folded:
+                for stack, count in profile['samples'].most_common():
+                    folded.write(f"{stack} {count}\n")
+
+            with open(base + '.json', 'w') as summary:
+                json.dump({
+                    'id': profile['id'],
+                    'method': request.method,
+                    'route': rule,
+                    'path': request.path,
+                    'status': status,
+                    'breakdown': breakdown,
+                    'samples': sum(profile['samples'].values()),
+                    'interval_ms': self.sampler.interval * 1000
+                }, summary, indent=2)
+
+            self.profiled += 1
+            self._prune()
+            logger.info(f"🔬 Profile {profile['id']} for {request.method} {rule}: "
+                        f"{breakdown['total_ms']} ms (db {breakdown['db_ms']} ms) -> {base}.folded")
+        except Exception as e:
+            logger.error(f"❌ Could not write profile {profile['id']}: {str(e)}")
+
+    def _prune(self):
+        """Delete the oldest profiles beyond max_files (names start with their timestamp)"""
+        summaries = sorted(name for name in os.listdir(self.output_dir) if name.endswith('.json'))
+        for name in summaries[:max(len(summaries) - self.max_files, 0)]:
+            base = os.path.join(self.output_dir, name[:-len('.json')])
+            for path in (base + '.json', base + '.folded'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,119 @@
+# ========================================
+# FILE: utils/qr_codes.py
+# PURPOSE: QR code rendering with an LRU cache, SVG output and optional process pool
+# ========================================
+
+import base64
+import hashlib
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.cache import TTLCache
+
+# Used by the backend (portal UPI QR) and by the standalone QR payment
+# servers in the repository root. It only depends on the qrcode package
+# (Pillow too for PNG), so settings are passed in rather than read from Config.
+#
+# A QR image is a pure function of (payload, format, box size, border), so
+# the rendered bytes are cached under that key and the same key doubles as
+# the HTTP ETag. SVG skips raster encoding entirely and is several times
+# cheaper than PNG; PNG rendering can be moved off the request thread into
+# a process pool when QR traffic is heavy.
+#
+# The cache only helps payloads that repeat (the portal UPI string of an
+# invoice). One-off payloads such as a per-invoice payment URL should be
+# rendered with cache=False so they do not evict the ones that do repeat.
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def _render(payload, fmt, box_size, border):
+    """Render one QR code to bytes (module level so a process pool can pickle it)"""
+    import qrcode
+
+    qr = qrcode.QRCode(version=None, box_size=box_size, border=border)
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    if fmt == 'svg':
+        from qrcode.image.svg import SvgPathImage
+        return qr.make_image(image_factory=SvgPathImage).to_string()
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class QRRenderer:
+    """
+    Cached QR renderer
+
+    Args:
+        maxsize (int): rendered images kept in memory (LRU beyond this)
+        ttl (float): seconds an image stays cached
+        workers (int): processes used for rendering (0 = render in the calling thread)
+    """
+
+    def __init__(self, maxsize=256, ttl=3600, workers=0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.workers = workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    @staticmethod
+    def etag(payload, fmt='png', box_size=8, border=4):
+        """Stable identifier of a rendering (computed without rendering)"""
+        key = f"{fmt}|{box_size}|{border}|{payload}".encode('utf-8')
+        return hashlib.sha1(key).hexdigest()
+
+    def render(self, payload, fmt='png', box_size=8, border=4, cache=True):
+        """
+        Return the QR image bytes, rendering only on a cache miss
+
+        cache=False renders without reading or filling the cache (one-off payloads)
+
+        Raises:
+            ValueError: unknown format
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported QR format '{fmt}' (use {', '.join(FORMATS)})")
+
+        key = (payload, fmt, box_size, border)
+        image = self._cache.get(key) if cache else None
+        if image is not None:
+            return image
+
+        if self.workers:
+            image = self._executor().submit(_render, payload, fmt, box_size, border).result()
+        else:
+            image = _render(payload, fmt, box_size, border)
+
+        if cache:
+            self._cache.set(key, image)
+        return image
+
+    def render_data_uri(self, payload, fmt='png', box_size=8, border=4, cache=True):
+        """Rendered image as a data: URI (for <img src> in JSON responses)"""
+        image = self.render(payload, fmt, box_size, border, cache=cache)
+        return f"data:{FORMATS[fmt]};base64,{base64.b64encode(image).decode()}"
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['workers'] = self.workers
+        return stats
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
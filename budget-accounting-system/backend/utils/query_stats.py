@@ -0,0 +1,302 @@
+# ========================================
+# FILE: utils/query_stats.py
+# PURPOSE: Per-statement latency statistics, slow-query log and EXPLAIN capture
+# ========================================
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from psycopg2 import extensions
+
+from config import Config
+from utils.profiler import request_timings
+import logging
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('slow_queries')
+
+# Every pooled connection is opened with cursor_factory=InstrumentedCursor
+# (see utils/db.py), so each cur.execute() - through the query helpers or
+# directly inside transaction()/cursor() blocks - is timed and grouped by
+# fingerprint: the statement with literals and parameters replaced by '?'
+# and whitespace collapsed. Parameters themselves are never stored or
+# logged, so nothing sensitive ends up in the metrics.
+#
+# Statements slower than slow_ms are written to the 'slow_queries' logger
+# as one JSON line and kept in a small ring buffer. With explain enabled,
+# a slow SELECT is re-run under EXPLAIN ANALYZE (inside a savepoint, at
+# most once per fingerprint per explain_interval) and the plan is attached.
+
+# Upper bounds (in milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Statements past the fingerprint limit are counted under this key
+OTHER_FINGERPRINT = 'other'
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s")
+# NULL / DEFAULT as a list item are values too (bulk inserts with optional columns)
+_NULL_ITEM_RE = re.compile(r"(?<=[(,])\s*(?:NULL|DEFAULT)\s*(?=[,)])", re.I)
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_SPACE_RE = re.compile(r"\s+")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS_RE = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+
+
+def normalize(query):
+    """Statement text with literals/parameters as '?' and IN / VALUES lists collapsed"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    text = _COMMENT_RE.sub(' ', query)
+    text = _STRING_RE.sub('?', text)
+    text = _PARAM_RE.sub('?', text)
+    text = _NUMBER_RE.sub('?', text)
+    text = _NULL_ITEM_RE.sub('?', text)
+    text = _IN_LIST_RE.sub('(...)', text)
+    text = _ROWS_RE.sub(r'\1, ...', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+def fingerprint(query):
+    """(fingerprint id, normalized text) of a statement"""
+    text = normalize(query)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12], text
+
+
+def is_read_only(text):
+    """True for statements EXPLAIN ANALYZE can safely re-run (no data-modifying CTEs)"""
+    head = text.lstrip('( ').upper()
+    if not head.startswith(('SELECT', 'WITH')):
+        return False
+    head = re.sub(r'\bFOR (NO KEY |KEY )?(UPDATE|SHARE)\b', ' ', head)
+    return not re.search(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', head)
+
+
+class QueryStats:
+    """
+    Thread-safe statement statistics grouped by fingerprint
+
+    Args:
+        slow_ms (float): statements at or above this go to the slow-query log
+        max_fingerprints (int): distinct statements tracked (the rest share OTHER_FINGERPRINT)
+        slow_log_size (int): recent slow statements kept for the metrics endpoint
+        explain (bool): capture EXPLAIN ANALYZE for slow read-only statements
+        explain_interval (float): seconds between captures of one fingerprint
+    """
+
+    def __init__(self, slow_ms=200, max_fingerprints=500, slow_log_size=100,
+                 explain=False, explain_interval=300):
+        self.slow_ms = slow_ms
+        self.max_fingerprints = max_fingerprints
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self._explained_at = {}
+        self._fingerprints = OrderedDict()  # statement text -> (id, text), LRU of hot statements
+        self._fingerprints_max = max_fingerprints * 2
+        self._fingerprints_lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _fingerprint(self, query):
+        # Only plain str statements are cached: bytes come from mogrify()
+        # (execute_values, bulk writers) with the values inlined, so each one
+        # is distinct and would just push the hot statements out
+        if not isinstance(query, str):
+            return fingerprint(query)
+
+        with self._fingerprints_lock:
+            cached = self._fingerprints.get(query)
+            if cached is not None:
+                self._fingerprints.move_to_end(query)
+                return cached
+
+        cached = fingerprint(query)
+        with self._fingerprints_lock:
+            self._fingerprints[query] = cached
+            if len(self._fingerprints) > self._fingerprints_max:
+                self._fingerprints.popitem(last=False)
+        return cached
+
+    def record(self, query, duration, rows=None, error=False, cur=None, params=None):
+        """Add one execution; `cur` and `params` are only used for EXPLAIN capture"""
+        fp_id, text = self._fingerprint(query)
+        duration_ms = duration * 1000
+
+        with self._lock:
+            entry = self._stats.get(fp_id)
+            if entry is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    fp_id, text = OTHER_FINGERPRINT, OTHER_FINGERPRINT
+                    entry = self._stats.get(fp_id)
+                if entry is None:
+                    entry = self._stats[fp_id] = {
+                        'fingerprint': fp_id,
+                        'statement': text[:500],
+                        'calls': 0,
+                        'errors': 0,
+                        'rows': 0,
+                        'total_ms': 0.0,
+                        'max_ms': 0.0,
+                        'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+                    }
+            entry['calls'] += 1
+            entry['total_ms'] += duration_ms
+            if duration_ms > entry['max_ms']:
+                entry['max_ms'] = duration_ms
+            if error:
+                entry['errors'] += 1
+            if rows is not None and rows >= 0:
+                entry['rows'] += rows
+            for index, bound in enumerate(LATENCY_BUCKETS_MS):
+                if duration_ms <= bound:
+                    entry['buckets'][index] += 1
+                    break
+            else:
+                entry['buckets'][-1] += 1
+
+        if duration_ms >= self.slow_ms and not error:
+            self._log_slow(fp_id, text, duration_ms, rows, query, cur, params)
+
+    def _log_slow(self, fp_id, text, duration_ms, rows, query, cur, params):
+        event = {
+            'fingerprint': fp_id,
+            'statement': text[:1000],
+            'duration_ms': round(duration_ms, 3),
+            'rows': rows,
+            'at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        if cur is not None and self._should_explain(fp_id, text):
+            event['plan'] = capture_plan(cur, query, params)
+
+        with self._lock:
+            self._slow.append(event)
+        slow_logger.warning(json.dumps(event, default=str))
+
+    def _should_explain(self, fp_id, text):
+        if not self.explain or not is_read_only(text):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained_at.get(fp_id)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._explained_at[fp_id] = now
+            return True
+
+    def snapshot(self, sort='total_ms', limit=20):
+        """Top statements by `sort` (total_ms, avg_ms, max_ms, calls, errors, rows)"""
+        with self._lock:
+            entries = []
+            for entry in self._stats.values():
+                item = dict(entry)
+                item['avg_ms'] = round(item['total_ms'] / item['calls'], 3) if item['calls'] else 0.0
+                item['total_ms'] = round(item['total_ms'], 3)
+                item['max_ms'] = round(item['max_ms'], 3)
+                histogram = {'le_%sms' % bound: count for bound, count in zip(LATENCY_BUCKETS_MS, item['buckets'])}
+                histogram['gt_%sms' % LATENCY_BUCKETS_MS[-1]] = item['buckets'][-1]
+                item['latency_histogram'] = histogram
+                del item['buckets']
+                entries.append(item)
+
+        if entries and sort not in entries[0]:
+            raise ValueError(f"Unknown sort '{sort}'")
+        entries.sort(key=lambda item: item[sort], reverse=True)
+        return entries[:limit] if limit else entries
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow)
+
+    def summary(self):
+        with self._lock:
+            calls = sum(entry['calls'] for entry in self._stats.values())
+            return {
+                'since': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+                'fingerprints': len(self._stats),
+                'calls': calls,
+                'errors': sum(entry['errors'] for entry in self._stats.values()),
+                'total_ms': round(sum(entry['total_ms'] for entry in self._stats.values()), 3),
+                'slow_threshold_ms': self.slow_ms,
+                'explain_enabled': self.explain
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+            self._explained_at.clear()
+            self.started_at = time.time()
+
+
+def capture_plan(cur, query, params):
+    """
+    EXPLAIN ANALYZE of a statement on the connection that just ran it
+
+    Runs in a savepoint on a plain cursor that is always rolled back, so the
+    caller's result set and transaction are untouched even if EXPLAIN fails.
+    """
+    connection = cur.connection
+    if connection.autocommit:
+        return None
+    plan_cur = connection.cursor(cursor_factory=extensions.cursor)
+    try:
+        plan_cur.execute("SAVEPOINT explain_capture")
+        try:
+            plan_cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + _as_text(query), params)
+            return [row[0] for row in plan_cur.fetchall()]
+        except Exception as e:
+            logger.warning(f"⚠️ EXPLAIN capture failed: {str(e)}")
+            return None
+        finally:
+            plan_cur.execute("ROLLBACK TO SAVEPOINT explain_capture")
+            plan_cur.execute("RELEASE SAVEPOINT explain_capture")
+    except Exception as e:
+        logger.warning(f"⚠️ EXPLAIN capture skipped: {str(e)}")
+        return None
+    finally:
+        plan_cur.close()
+
+
+def _as_text(query):
+    return query.decode('utf-8') if isinstance(query, bytes) else query
+
+
+# ===== PROCESS-WIDE STATISTICS =====
+
+query_stats = QueryStats(
+    slow_ms=Config.DB_SLOW_QUERY_MS,
+    max_fingerprints=Config.DB_QUERY_STATS_MAX,
+    slow_log_size=Config.DB_SLOW_LOG_SIZE,
+    explain=Config.DB_EXPLAIN_SLOW,
+    explain_interval=Config.DB_EXPLAIN_INTERVAL
+)
+
+
+class InstrumentedCursor(extensions.cursor):
+    """psycopg2 cursor that records every execute() in query_stats (and in a running request profile)"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            query_stats.record(query, time.perf_counter() - started, error=True)
+            raise
+        finally:
+            timings = getattr(request_timings, 'current', None)
+            if timings is not None:
+                timings['db'] += time.perf_counter() - started
+        # Named (server-side) cursors only DECLARE here; rows arrive while iterating
+        rows = None if self.name else self.rowcount
+        query_stats.record(query, time.perf_counter() - started, rows=rows,
+                           cur=None if self.name else self, params=vars)
+        return result
@@ -0,0 +1,406 @@
+# ========================================
+# FILE: utils/reconciler.py
+# PURPOSE: Background reconciliation of PENDING PhonePe transactions
+# ========================================
+
+import threading
+import time
+
+from utils.db import execute_query, execute_update, transaction
+from utils.event_hub import EventHub
+from utils.payments import apply_payment
+from utils.phonepe_client import get_phonepe_client, GatewayError, GatewayUnavailable
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A transaction is created PENDING by /api/phonepe/initiate. Without the
+# reconciler it only settles when the browser returns to the verify endpoint.
+# Each cycle the worker:
+#   1. claims a batch of due PENDING rows (FOR UPDATE SKIP LOCKED + a lease,
+#      so several processes never poll the same row at once)
+#   2. asks PhonePe for each status, rate limited, without holding a connection
+#   3. records the outcome in a short transaction per row:
+#        PAYMENT_SUCCESS -> SUCCESS (credited through utils/payments.py)
+#        declined/error  -> FAILED
+#        paid amount differs from the stored one -> not credited, stays
+#                           PENDING with last_error AMOUNT_MISMATCH
+#        anything else   -> stays PENDING, next check backs off exponentially,
+#                           or EXPIRED once older than the expiry window
+
+SUCCESS_CODE = 'PAYMENT_SUCCESS'
+FAILED_CODES = ('PAYMENT_ERROR', 'PAYMENT_DECLINED', 'TIMED_OUT', 'AUTHORIZATION_FAILED')
+
+CLAIM_SQL = """
+    WITH due AS (
+        SELECT id
+        FROM phonepe_transactions
+        WHERE status = 'PENDING' AND next_check_at <= CURRENT_TIMESTAMP
+        ORDER BY next_check_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE phonepe_transactions pt
+    SET next_check_at = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s)
+    FROM due
+    WHERE pt.id = due.id
+    RETURNING pt.merchant_transaction_id
+"""
+
+# Row that can still settle, locked so the amount check and MARK_SUCCESS_SQL
+# see the same state
+SETTLEABLE_SQL = """
+    SELECT amount
+    FROM phonepe_transactions
+    WHERE merchant_transaction_id = %(txn_id)s
+      AND status IN ('PENDING', 'EXPIRED')
+    FOR UPDATE
+"""
+
+# Only a PENDING (or EXPIRED - the money may still arrive late) row can
+# become SUCCESS, so the invoice is credited exactly once however many
+# verify calls / reconciler cycles see PAYMENT_SUCCESS
+MARK_SUCCESS_SQL = """
+    UPDATE phonepe_transactions
+    SET status = 'SUCCESS',
+        phonepe_transaction_id = %(gateway_txn_id)s,
+        last_checked_at = CURRENT_TIMESTAMP,
+        last_error = NULL,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE merchant_transaction_id = %(txn_id)s
+      AND status IN ('PENDING', 'EXPIRED')
+    RETURNING invoice_id, amount, user_id
+"""
+
+MARK_FAILED_SQL = """
+    UPDATE phonepe_transactions
+    SET status = 'FAILED',
+        last_checked_at = CURRENT_TIMESTAMP,
+        last_error = %(code)s,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE merchant_transaction_id = %(txn_id)s AND status = 'PENDING'
+"""
+
+# Still pending: back off (base * 2^attempts, capped) or expire when too old
+RESCHEDULE_SQL = """
+    UPDATE phonepe_transactions
+    SET attempts = attempts + 1,
+        last_checked_at = CURRENT_TIMESTAMP,
+        last_error = %(error)s,
+        status = CASE
+            WHEN created_at < CURRENT_TIMESTAMP - make_interval(mins => %(expiry_minutes)s) THEN 'EXPIRED'
+            ELSE status
+        END,
+        next_check_at = CURRENT_TIMESTAMP
+            + make_interval(secs => LEAST(%(backoff)s * power(2, LEAST(attempts, 20)), %(max_backoff)s)),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE merchant_transaction_id = %(txn_id)s AND status = 'PENDING'
+    RETURNING status
+"""
+
+
+# ===== STATE TRANSITIONS (shared with the verify endpoint) =====
+
+def record_status(cur, txn_id, status_data):
+    """
+    Apply a PhonePe status response to phonepe_transactions (idempotent)
+
+    Args:
+        cur: cursor inside transaction()
+        txn_id (str): merchant transaction id
+        status_data (dict): body returned by PhonePeClient.status()
+
+    Returns:
+        str: 'success' (invoice credited now), 'failed', 'expired', 'pending',
+             'mismatch' (paid amount differs, nothing credited) or
+             'unchanged' (row unknown or already settled)
+    """
+    code = status_data.get('code')
+
+    if status_data.get('success') and code == SUCCESS_CODE:
+        data = status_data.get('data') or {}
+        settleable = execute_query(SETTLEABLE_SQL, {'txn_id': txn_id}, cur=cur)
+        if not settleable:
+            return 'unchanged'
+
+        # Never credit money that was not received: a different amount needs a human
+        expected_paise = int(round(float(settleable[0]['amount']) * 100))
+        paid_paise = data.get('amount')
+        if paid_paise is None or int(paid_paise) != expected_paise:
+            logger.error(f"❌ PhonePe amount mismatch for {txn_id}: gateway {paid_paise} paise, "
+                         f"expected {expected_paise} paise - not credited")
+            reschedule(cur, txn_id, error='AMOUNT_MISMATCH')
+            return 'mismatch'
+
+        rows = execute_query(MARK_SUCCESS_SQL, {'txn_id': txn_id, 'gateway_txn_id': data.get('transactionId')}, cur=cur)
+        if not rows:
+            return 'unchanged'
+
+        invoice_id, amount, user_id = rows[0]['invoice_id'], rows[0]['amount'], rows[0]['user_id']
+        apply_payment(
+            cur, amount,
+            user_id=user_id,
+            invoice_id=invoice_id,
+            idempotency_key=f'phonepe:{txn_id}',
+            reference=f"PAY-{txn_id[:8]}",
+            notes=f'PhonePe: {txn_id}'
+        )
+
+        logger.info(f"✅ PhonePe {txn_id} settled: ₹{amount} applied to invoice {invoice_id}")
+        return 'success'
+
+    if code in FAILED_CODES:
+        changed = execute_update(MARK_FAILED_SQL, {'txn_id': txn_id, 'code': code}, cur=cur)
+        return 'failed' if changed else 'unchanged'
+
+    return reschedule(cur, txn_id, error=code)
+
+
+def reschedule(cur, txn_id, error=None):
+    """Leave a transaction PENDING with a backed-off next check (or expire it)"""
+    rows = execute_query(RESCHEDULE_SQL, {
+        'txn_id': txn_id,
+        'error': error,
+        'backoff': Config.PHONEPE_RECONCILE_BACKOFF,
+        'max_backoff': Config.PHONEPE_RECONCILE_MAX_BACKOFF,
+        'expiry_minutes': Config.PHONEPE_PENDING_EXPIRY_MINUTES
+    }, cur=cur)
+    if not rows:
+        return 'unchanged'
+    return 'expired' if rows[0]['status'] == 'EXPIRED' else 'pending'
+
+
+STORED_STATUS_SQL = """
+    SELECT
+        status,
+        amount,
+        phonepe_transaction_id,
+        last_error,
+        COALESCE(last_checked_at > CURRENT_TIMESTAMP - make_interval(secs => %(min_interval)s), FALSE) as recently_checked
+    FROM phonepe_transactions
+    WHERE merchant_transaction_id = %(txn_id)s
+"""
+
+
+def stored_status(txn_id):
+    """
+    Answer a status request from the database when PhonePe need not be asked
+
+    A settled transaction (SUCCESS / FAILED) cannot change any more, and a
+    PENDING one checked within PHONEPE_VERIFY_MIN_INTERVAL seconds is not
+    worth another gateway call. EXPIRED rows are always re-checked since a
+    late payment can still arrive.
+
+    Returns:
+        dict: PhonePe-shaped status body (with 'cached': True) or None
+    """
+    rows = execute_query(STORED_STATUS_SQL, {
+        'txn_id': txn_id,
+        'min_interval': Config.PHONEPE_VERIFY_MIN_INTERVAL
+    })
+    if not rows:
+        return None
+
+    row = rows[0]
+    data = {
+        'merchantId': Config.PHONEPE_MERCHANT_ID,
+        'merchantTransactionId': txn_id,
+        'transactionId': row['phonepe_transaction_id'],
+        'amount': int(round(float(row['amount']) * 100))
+    }
+
+    if row['status'] == 'SUCCESS':
+        return {'success': True, 'code': SUCCESS_CODE, 'message': 'Your payment is successful.', 'data': data, 'cached': True}
+    if row['status'] == 'FAILED':
+        return {'success': False, 'code': row['last_error'] or 'PAYMENT_ERROR', 'message': 'Payment failed', 'data': data, 'cached': True}
+    if row['status'] == 'PENDING' and row['recently_checked']:
+        return {'success': True, 'code': 'PAYMENT_PENDING', 'message': 'Your payment is in pending state.', 'data': data, 'cached': True}
+    return None
+
+
+# ===== LIVE STATUS EVENTS =====
+# Payment screens subscribe to 'phonepe:<txn_id>' (GET /api/phonepe/events/<txn_id>)
+
+payment_events = EventHub()
+
+# record_status() outcomes that change what a payment screen shows
+PUBLISHED_OUTCOMES = ('success', 'failed', 'expired')
+
+
+def transaction_state(txn_id):
+    """Current state of a transaction as pushed to payment screens (None if unknown)"""
+    rows = execute_query("""
+        SELECT merchant_transaction_id as txn_id, status, amount, phonepe_transaction_id
+        FROM phonepe_transactions
+        WHERE merchant_transaction_id = %s
+    """, (txn_id,))
+    if not rows:
+        return None
+    state = rows[0]
+    state['amount'] = float(state['amount'])
+    return state
+
+
+def publish_outcome(txn_id, outcome):
+    """Push a committed status change to this process's subscribers"""
+    if outcome in PUBLISHED_OUTCOMES:
+        payment_events.publish(f'phonepe:{txn_id}', transaction_state(txn_id))
+
+
+# ===== RATE LIMITING =====
+
+class RateLimiter:
+    """Token bucket: at most `rate` acquisitions per second (bursts up to `burst`)"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# ===== WORKER =====
+
+class PaymentReconciler:
+    """
+    Polls due PENDING transactions on a daemon thread
+
+    run_once() performs a single cycle and can be called directly
+    (tests, the on-demand endpoint, reconcile_payments.py).
+    """
+
+    def __init__(self, client=None, batch_size=None, interval=None, rate=None):
+        self.client = client or get_phonepe_client()
+        self.batch_size = batch_size or Config.PHONEPE_RECONCILE_BATCH_SIZE
+        self.interval = interval or Config.PHONEPE_RECONCILE_INTERVAL
+        self.limiter = RateLimiter(rate or Config.PHONEPE_RECONCILE_RATE)
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()  # one cycle at a time per process
+        self.cycles = 0
+        self.totals = {'checked': 0, 'success': 0, 'failed': 0, 'pending': 0, 'expired': 0, 'mismatch': 0, 'errors': 0}
+        self.last_run = None
+
+    def claim_batch(self):
+        """Lease up to batch_size due transactions; returns their merchant ids"""
+        # The lease keeps the rows away from other workers while they are
+        # polled; every outcome below overwrites it with the real next check
+        lease = max(self.interval * 2, 60)
+        with transaction() as cur:
+            rows = execute_query(CLAIM_SQL, {'limit': self.batch_size, 'lease': lease}, cur=cur)
+        return [row['merchant_transaction_id'] for row in rows]
+
+    def run_once(self):
+        """
+        One reconciliation cycle
+
+        Returns:
+            dict: counts per outcome for this cycle
+        """
+        with self._lock:
+            summary = {'checked': 0, 'success': 0, 'failed': 0, 'pending': 0, 'expired': 0, 'mismatch': 0, 'errors': 0}
+            txn_ids = self.claim_batch()
+
+            for txn_id in txn_ids:
+                if self._stop.is_set():
+                    break
+                self.limiter.acquire()
+                try:
+                    status_data = self.client.status(txn_id)
+                except GatewayUnavailable as e:
+                    # Circuit is open: the rest of the batch would fail the same
+                    # way; their leases expire and they are picked up later
+                    logger.warning(f"⚠️ Reconciler paused: {e}")
+                    summary['errors'] += 1
+                    break
+                except GatewayError as e:
+                    with transaction() as cur:
+                        outcome = reschedule(cur, txn_id, error=str(e)[:500])
+                    publish_outcome(txn_id, outcome)
+                    summary['errors'] += 1
+                    if outcome == 'expired':
+                        summary['expired'] += 1
+                    continue
+
+                with transaction() as cur:
+                    outcome = record_status(cur, txn_id, status_data)
+                publish_outcome(txn_id, outcome)
+                summary['checked'] += 1
+                if outcome in summary:
+                    summary[outcome] += 1
+
+            self.cycles += 1
+            self.last_run = time.time()
+            for key, value in summary.items():
+                self.totals[key] += value
+
+        if txn_ids:
+            logger.info(f"🔄 PhonePe reconciliation: {len(txn_ids)} claimed, {summary}")
+        return summary
+
+    def _loop(self):
+        logger.info(f"🔄 PhonePe reconciler started (every {self.interval}s, batch {self.batch_size})")
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ PhonePe reconciliation cycle failed: {str(e)}")
+        logger.info("🛑 PhonePe reconciler stopped")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='phonepe-reconciler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'interval_seconds': self.interval,
+            'batch_size': self.batch_size,
+            'cycles': self.cycles,
+            'last_run': self.last_run,
+            'totals': dict(self.totals),
+            'gateway': self.client.stats()
+        }
+
+
+_reconciler = None
+_reconciler_lock = threading.Lock()
+
+
+def get_reconciler():
+    """Process-wide reconciler (not started until start_reconciler())"""
+    global _reconciler
+    if _reconciler is None:
+        with _reconciler_lock:
+            if _reconciler is None:
+                _reconciler = PaymentReconciler()
+    return _reconciler
+
+
+def start_reconciler():
+    reconciler = get_reconciler()
+    reconciler.start()
+    return reconciler
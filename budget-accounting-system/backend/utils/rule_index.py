@@ -0,0 +1,184 @@
+# ========================================
+# FILE: utils/rule_index.py
+# PURPOSE: In-memory index of confirmed auto analytical models per tenant
+# ========================================
+
+import threading
+
+from utils.db import execute_query
+from utils.cache import TTLCache
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A model matches when every field it specifies equals the transaction's;
+# the score is the number of specified fields. Models that specify neither
+# partner nor category never match. Ties go to the oldest model (lowest id).
+#
+# The index maps (partner, category) -> best model for that exact key, with
+# None as the wildcard, so a lookup is at most three dict probes:
+#   (partner, category)            score 2
+#   (partner, None) / (None, category)   score 1
+
+MODELS_QUERY = """
+    SELECT
+        aam.id,
+        aam.partner_id,
+        aam.product_category,
+        aam.analytical_account_id,
+        aa.name as analytical_account_name,
+        aa.code as analytical_account_code
+    FROM auto_analytical_models aam
+    LEFT JOIN analytical_accounts aa ON aam.analytical_account_id = aa.id
+    WHERE aam.user_id = %s AND aam.status = 'confirm'
+    ORDER BY aam.id
+"""
+
+_indexes = TTLCache(maxsize=Config.RULE_INDEX_CACHE_SIZE, ttl=Config.RULE_INDEX_TTL)
+
+# Bumped on every invalidation; an index built from a read that started
+# before the bump is not cached (protects against concurrent rule edits)
+_generations = {}
+_generations_lock = threading.Lock()
+
+
+def _key(partner_id, product_category):
+    partner = str(partner_id) if partner_id not in (None, '') else None
+    category = product_category or None
+    return partner, category
+
+
+class RuleIndex:
+    """Compiled confirmed models of one tenant"""
+
+    def __init__(self, models):
+        self.size = len(models)
+        self._best = {}
+        for model in models:
+            key = _key(model['partner_id'], model['product_category'])
+            if key == (None, None):
+                continue
+            # Models arrive ordered by id: first one per key wins ties
+            self._best.setdefault(key, model)
+
+    def match(self, partner_id, product_category):
+        """
+        Best model for a transaction
+
+        Returns:
+            dict: match payload (model_id, analytical account, score) or None
+        """
+        partner, category = _key(partner_id, product_category)
+
+        if partner and category:
+            model = self._best.get((partner, category))
+            if model:
+                return self._payload(model, 2)
+
+        candidates = []
+        if partner:
+            candidates.append(self._best.get((partner, None)))
+        if category:
+            candidates.append(self._best.get((None, category)))
+        candidates = [model for model in candidates if model]
+        if not candidates:
+            return None
+
+        return self._payload(min(candidates, key=lambda model: model['id']), 1)
+
+    @staticmethod
+    def _payload(model, score):
+        return {
+            'model_id': model['id'],
+            'analytical_account_id': model['analytical_account_id'],
+            'analytical_account_name': model['analytical_account_name'],
+            'analytical_account_code': model['analytical_account_code'],
+            'score': score
+        }
+
+
+def get_rule_index(user_id, cur=None):
+    """Return the tenant's index, building it from the database on a miss"""
+    index = _indexes.get(user_id)
+    if index is not None:
+        return index
+
+    with _generations_lock:
+        generation = _generations.get(user_id, 0)
+
+    index = RuleIndex(execute_query(MODELS_QUERY, (user_id,), cur=cur))
+
+    with _generations_lock:
+        if _generations.get(user_id, 0) == generation:
+            _indexes.set(user_id, index)
+
+    logger.info(f"🧭 Rule index built for user {user_id}: {index.size} confirmed models")
+    return index
+
+
+def invalidate_rule_index(user_id):
+    """Drop the tenant's index (call after models or analytical accounts change)"""
+    with _generations_lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        _indexes.invalidate(user_id)
+
+
+def get_rule_index_stats():
+    """Hit/miss counters of the rule index cache"""
+    return _indexes.stats()
+
+
+# ===== DOCUMENT LINES =====
+
+PRODUCT_CATEGORIES_QUERY = """
+    SELECT id, category
+    FROM products
+    WHERE user_id = %s AND id = ANY(%s)
+"""
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def assign_analytical_accounts(cur, user_id, partner_id, lines):
+    """
+    Fill in a missing analytical_account_id on document lines (in place)
+
+    Runs inside the document's transaction. Rules and product categories are
+    read fresh from the database once per document (not from the per-process
+    cache), so every line is resolved against the same committed rule set
+    even while rules are being edited. Lines that already carry an
+    analytical account are left alone.
+
+    Returns:
+        int: number of lines that were assigned an account
+    """
+    pending = [line for line in lines if not line.get('analytical_account_id')]
+    if not pending:
+        return 0
+
+    product_ids = sorted({_as_int(line.get('product_id')) for line in pending} - {None})
+    categories = {}
+    if product_ids:
+        rows = execute_query(PRODUCT_CATEGORIES_QUERY, (user_id, product_ids), cur=cur)
+        categories = {row['id']: row['category'] for row in rows}
+
+    index = RuleIndex(execute_query(MODELS_QUERY, (user_id,), cur=cur))
+    if not index.size:
+        return 0
+
+    assigned = 0
+    for line in pending:
+        category = categories.get(_as_int(line.get('product_id')))
+        match = index.match(partner_id, category)
+        if match:
+            line['analytical_account_id'] = match['analytical_account_id']
+            assigned += 1
+
+    logger.info(f"🧭 Auto-assigned analytical accounts on {assigned}/{len(pending)} lines")
+    return assigned
@@ -0,0 +1,76 @@
+# ========================================
+# FILE: utils/streaming.py
+# PURPOSE: Stream large query results to the client (NDJSON / chunked JSON array)
+# ========================================
+
+from flask import Response, current_app, stream_with_context
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ?stream=<format> -> response mimetype
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def requested_stream_format(request, data=None):
+    """
+    Streaming format asked for by the client, or None for a normal response
+    
+    Accepted: ?stream=ndjson|json, {"stream": "..."} in the JSON body,
+    or an Accept: application/x-ndjson header.
+    """
+    fmt = request.args.get('stream') or (data or {}).get('stream')
+    if not fmt and 'application/x-ndjson' in request.headers.get('Accept', ''):
+        fmt = 'ndjson'
+    if fmt and fmt not in STREAM_FORMATS:
+        raise ValueError(f"Unsupported stream format: {fmt}")
+    return fmt
+
+
+def _close(rows):
+    """Close the row generator so its pooled connection goes back right away"""
+    close = getattr(rows, 'close', None)
+    if close:
+        close()
+
+
+def _ndjson(rows):
+    dumps = current_app.json.dumps
+    try:
+        for row in rows:
+            yield dumps(row) + '\n'
+    except Exception as e:
+        # Headers are already sent - report the failure in-band
+        logger.error(f"❌ Error while streaming rows: {str(e)}")
+        yield dumps({'error': str(e)}) + '\n'
+    finally:
+        _close(rows)
+
+
+def _json_array(rows):
+    dumps = current_app.json.dumps
+    try:
+        yield '['
+        first = True
+        for row in rows:
+            yield dumps(row) if first else ',' + dumps(row)
+            first = False
+        # If the query fails mid-stream the array is left unterminated, so the
+        # client sees invalid JSON instead of a silently truncated result
+        yield ']'
+    finally:
+        _close(rows)
+
+
+def stream_rows(rows, fmt):
+    """
+    Build a streaming response from a row iterator (e.g. utils.db.stream_query)
+    
+    Rows are serialized with the app's JSON provider, so values look exactly
+    like they do in jsonify() responses.
+    """
+    body = _ndjson(rows) if fmt == 'ndjson' else _json_array(rows)
+    return Response(stream_with_context(body), mimetype=STREAM_FORMATS[fmt])
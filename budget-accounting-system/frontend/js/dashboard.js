@@ -93,73 +93,22 @@ async function loadStatistics() {
         document.getElementById('totalProducts').textContent = '...';
         document.getElementById('totalPurchaseOrders').textContent = '...';
         
-        // Fetch budgets count
-        try {
-            const budgetResponse = await fetch(API_BASE_URL + '/budgets/count', {
-                headers: { 'Authorization': 'Bearer ' + token }
-            });
-            
-            if (budgetResponse.ok) {
-                const budgetData = await budgetResponse.json();
-                document.getElementById('totalBudgets').textContent = budgetData.count || 0;
-            } else {
-                document.getElementById('totalBudgets').textContent = '0';
-            }
-        } catch (error) {
-            console.log('⚠️ Budgets API not available yet');
-            document.getElementById('totalBudgets').textContent = '0';
-        }
+        // Fetch every counter in one call
+        const response = await fetch(API_BASE_URL + '/stats/summary', {
+            headers: { 'Authorization': 'Bearer ' + token }
+        });
         
-        // Fetch contacts count
-        try {
-            const contactResponse = await fetch(API_BASE_URL + '/contacts/count', {
-                headers: { 'Authorization': 'Bearer ' + token }
-            });
-            
-            if (contactResponse.ok) {
-                const contactData = await contactResponse.json();
-                document.getElementById('totalContacts').textContent = contactData.count || 0;
-            } else {
-                document.getElementById('totalContacts').textContent = '0';
-            }
-        } catch (error) {
-            console.log('⚠️ Contacts API not available yet');
-            document.getElementById('totalContacts').textContent = '0';
+        if (!response.ok) {
+            throw new Error('Summary API returned ' + response.status);
         }
         
-        // Fetch products count
-        try {
-            const productResponse = await fetch(API_BASE_URL + '/products/count', {
-                headers: { 'Authorization': 'Bearer ' + token }
-            });
-            
-            if (productResponse.ok) {
-                const productData = await productResponse.json();
-                document.getElementById('totalProducts').textContent = productData.count || 0;
-            } else {
-                document.getElementById('totalProducts').textContent = '0';
-            }
-        } catch (error) {
-            console.log('⚠️ Products API not available yet');
-            document.getElementById('totalProducts').textContent = '0';
-        }
+        const summary = await response.json();
+        const counts = summary.counts || {};
         
-        // Fetch purchase orders count
-        try {
-            const poResponse = await fetch(API_BASE_URL + '/purchase-orders/count', {
-                headers: { 'Authorization': 'Bearer ' + token }
-            });
-            
-            if (poResponse.ok) {
-                const poData = await poResponse.json();
-                document.getElementById('totalPurchaseOrders').textContent = poData.count || 0;
-            } else {
-                document.getElementById('totalPurchaseOrders').textContent = '0';
-            }
-        } catch (error) {
-            console.log('⚠️ Purchase Orders API not available yet');
-            document.getElementById('totalPurchaseOrders').textContent = '0';
-        }
+        document.getElementById('totalBudgets').textContent = counts.budgets || 0;
+        document.getElementById('totalContacts').textContent = counts.contacts || 0;
+        document.getElementById('totalProducts').textContent = counts.products || 0;
+        document.getElementById('totalPurchaseOrders').textContent = counts.purchase_orders || 0;
         
         console.log('✅ [DASHBOARD.JS:70] Statistics loaded successfully');
         
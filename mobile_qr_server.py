@@ -1,13 +1,19 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string, stream_with_context
 import uuid
 import hashlib
 import base64
 import json
 import requests
-import qrcode
-import io
-from base64 import b64encode
 import socket
+import os
+import sys
+
+from payment_store import create_store
+
+# Shared QR renderer lives in the backend's utils package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'budget-accounting-system', 'backend'))
+from utils.qr_codes import QRRenderer
+from utils.event_hub import EventHub, StreamSlots, sse_stream
 
 app = Flask(__name__)
 
@@ -17,8 +23,25 @@ SALT_KEY = "96434309-7796-489d-8924-ab56988a6076"
 SALT_INDEX = 1
 PAY_URL = "https://api-preprod.phonepe.com/apis/pg-sandbox/pg/v1/pay"
 
-# Store pending payments
-pending_payments = {}
+# Pending payments live in a shared store (SQLite file by default, Postgres via
+# PAYMENT_STORE_URL) so they survive restarts and work with several workers
+pending_payments = create_store()
+
+# Rendered QR codes, LRU cached; QR_RENDER_WORKERS > 0 renders in a process pool
+qr_renderer = QRRenderer(maxsize=256, workers=int(os.environ.get('QR_RENDER_WORKERS', '0')))
+
+# Status changes are pushed to open payment screens (GET /events/<invoice_id>)
+status_events = EventHub()
+# Each open stream holds a server thread; past the cap the page polls instead
+stream_slots = StreamSlots(int(os.environ.get('SSE_MAX_STREAMS', '8')))
+
+def invoice_state(invoice_id):
+    """What a payment screen shows (None when the invoice is unknown or expired)"""
+    invoice = pending_payments.get(invoice_id)
+    return {'status': invoice['status']} if invoice else None
+
+def publish_status(invoice_id):
+    status_events.publish(invoice_id, invoice_state(invoice_id))
 
 def get_local_ip():
     """Get the local IP address"""
@@ -156,6 +179,7 @@ def home():
     <script>
         let currentInvoiceId = null;
         let checkInterval = null;
+        let statusStream = null;
 
         async function generateQR() {
             const customerName = document.getElementById('customerName').value;
@@ -195,9 +219,42 @@ def home():
             }
         }
 
+        function showStatus(data) {
+            if (data.status === 'paid') {
+                document.getElementById('statusDiv').className = 'status success';
+                document.getElementById('statusText').textContent = '✅ Payment Received!';
+                return true;
+            } else if (data.status === 'cancelled') {
+                document.getElementById('statusDiv').className = 'status failed';
+                document.getElementById('statusText').textContent = '❌ Payment Cancelled';
+                return true;
+            }
+            return false;
+        }
+
         function startStatusCheck() {
             if (checkInterval) clearInterval(checkInterval);
-            
+            if (statusStream) statusStream.close();
+
+            // The server pushes status changes; polling is only the fallback
+            if (window.EventSource) {
+                statusStream = new EventSource(`/events/${currentInvoiceId}`);
+                statusStream.addEventListener('status', (event) => {
+                    const data = JSON.parse(event.data);
+                    if (!data || showStatus(data)) statusStream.close();
+                });
+                // Refused (404/503) or dropped: poll instead
+                statusStream.onerror = () => {
+                    statusStream.close();
+                    startPolling();
+                };
+                return;
+            }
+            startPolling();
+        }
+
+        function startPolling() {
+            if (checkInterval) clearInterval(checkInterval);
             checkInterval = setInterval(async () => {
                 if (!currentInvoiceId) return;
 
@@ -205,15 +262,7 @@ def home():
                     const response = await fetch(`/check-status/${currentInvoiceId}`);
                     const data = await response.json();
 
-                    if (data.status === 'paid') {
-                        document.getElementById('statusDiv').className = 'status success';
-                        document.getElementById('statusText').textContent = '✅ Payment Received!';
-                        clearInterval(checkInterval);
-                    } else if (data.status === 'cancelled') {
-                        document.getElementById('statusDiv').className = 'status failed';
-                        document.getElementById('statusText').textContent = '❌ Payment Cancelled';
-                        clearInterval(checkInterval);
-                    }
+                    if (showStatus(data)) clearInterval(checkInterval);
                 } catch (error) {
                     console.error('Status check error:', error);
                 }
@@ -234,29 +283,19 @@ def create_invoice():
         
         invoice_id = "INV" + str(uuid.uuid4().hex)[:8].upper()
         
-        pending_payments[invoice_id] = {
-            'customer_name': customer_name,
-            'amount': amount,
-            'status': 'pending'
-        }
+        pending_payments.create(invoice_id, customer_name, amount)
         
         payment_url = f"{BASE_URL}/pay/{invoice_id}"
         
-        # Generate QR code
-        qr = qrcode.QRCode(version=1, box_size=8, border=4)
-        qr.add_data(payment_url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        qr_base64 = b64encode(buf.getvalue()).decode()
+        # The URL is unique per invoice, so caching it would only evict other
+        # entries; SVG (the default) is what keeps this render cheap
+        qr_format = data.get('qr_format', 'svg')
+        qr_code = qr_renderer.render_data_uri(payment_url, qr_format, box_size=8, cache=False)
         
         return jsonify({
             'success': True,
             'invoice_id': invoice_id,
-            'qr_code': f'data:image/png;base64,{qr_base64}',
+            'qr_code': qr_code,
             'payment_url': payment_url
         })
         
@@ -267,7 +306,8 @@ def create_invoice():
 def payment_page(invoice_id):
     """Mobile payment page"""
     
-    if invoice_id not in pending_payments:
+    invoice = pending_payments.get(invoice_id)
+    if not invoice:
         return render_template_string('''
 <!DOCTYPE html>
 <html>
@@ -292,8 +332,6 @@ def payment_page(invoice_id):
 </html>
         '''), 404
     
-    invoice = pending_payments[invoice_id]
-    
     return render_template_string('''
 <!DOCTYPE html>
 <html>
@@ -532,10 +570,8 @@ def phonepe_success():
     invoice_id = request.args.get('invoice_id')
     txn_id = request.args.get('txn_id')
     
-    if invoice_id in pending_payments:
-        pending_payments[invoice_id]['status'] = 'paid'
-        pending_payments[invoice_id]['txn_id'] = txn_id
-        pending_payments[invoice_id]['payment_method'] = 'phonepe'
+    if pending_payments.transition(invoice_id, 'paid', txn_id=txn_id, payment_method='phonepe'):
+        publish_status(invoice_id)
     
     return render_template_string('''
 <!DOCTYPE html>
@@ -585,6 +621,15 @@ def phonepe_success():
 </html>
     ''', invoice_id=invoice_id, txn_id=txn_id)
 
+def transition_refused(invoice_id, wanted):
+    """Response when an invoice could not be moved to `wanted`"""
+    invoice = pending_payments.get(invoice_id)
+    if not invoice:
+        return jsonify({'success': False, 'error': 'Invoice not found'}), 404
+    if invoice['status'] == wanted:
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': f"Invoice is already {invoice['status']}"}), 409
+
 @app.route('/confirm-payment', methods=['POST'])
 def confirm_payment():
     """Mark payment as paid (cash/other)"""
@@ -592,12 +637,11 @@ def confirm_payment():
         data = request.get_json()
         invoice_id = data.get('invoice_id')
         
-        if invoice_id in pending_payments:
-            pending_payments[invoice_id]['status'] = 'paid'
-            pending_payments[invoice_id]['payment_method'] = data.get('method', 'cash')
+        # Atomic: only a pending invoice can be paid; repeating the call is harmless
+        if pending_payments.transition(invoice_id, 'paid', payment_method=data.get('method', 'cash')):
+            publish_status(invoice_id)
             return jsonify({'success': True})
-        else:
-            return jsonify({'success': False, 'error': 'Invoice not found'}), 404
+        return transition_refused(invoice_id, 'paid')
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -609,11 +653,10 @@ def cancel_payment():
         data = request.get_json()
         invoice_id = data.get('invoice_id')
         
-        if invoice_id in pending_payments:
-            pending_payments[invoice_id]['status'] = 'cancelled'
+        if pending_payments.transition(invoice_id, 'cancelled'):
+            publish_status(invoice_id)
             return jsonify({'success': True})
-        else:
-            return jsonify({'success': False, 'error': 'Invoice not found'}), 404
+        return transition_refused(invoice_id, 'cancelled')
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -621,10 +664,30 @@ def cancel_payment():
 @app.route('/check-status/<invoice_id>')
 def check_status(invoice_id):
     """Check payment status"""
-    if invoice_id in pending_payments:
-        return jsonify({'status': pending_payments[invoice_id]['status']})
+    invoice = pending_payments.get(invoice_id)
+    if invoice:
+        return jsonify({'status': invoice['status']})
     return jsonify({'status': 'not_found'}), 404
 
+@app.route('/events/<invoice_id>')
+def status_stream(invoice_id):
+    """Server-Sent Events: current status, then each change until paid/cancelled"""
+    if invoice_state(invoice_id) is None:
+        return jsonify({'status': 'not_found'}), 404
+    if not stream_slots.acquire():
+        return jsonify({'error': 'Too many open status streams'}), 503, {'Retry-After': '30'}
+
+    stream = sse_stream(
+        status_events,
+        invoice_id,
+        load_state=lambda: invoice_state(invoice_id),
+        is_final=lambda state: state['status'] in ('paid', 'cancelled')
+    )
+    response = Response(stream_with_context(stream), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(stream_slots.release)
+    return response
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("🚀 MOBILE QR PAYMENT SYSTEM - READY!")